@@ -0,0 +1,34 @@
+import os
+import gzip
+import json
+
+# Artefato do OCR: o texto e a tabela das linhas de uma nota em JSON compactado,
+# gravado pela extrai-texto em PREFIXO_ARTEFATOS + <chave da imagem sem extensão>.
+# Ele é lido pela extrai-dados (quando o resultado do OCR não cabe no payload da Step
+# Function) e pela reextração em lote (aws/pipeline/reextracao.py).
+PREFIXO_ARTEFATOS = os.environ.get("PREFIXO_ARTEFATOS", "ocr/")
+EXTENSAO_ARTEFATO = ".json.gz"
+VERSAO_ARTEFATO = 1
+
+
+def chave_artefato(key, prefixo=PREFIXO_ARTEFATOS):
+    return prefixo + os.path.splitext(key)[0] + EXTENSAO_ARTEFATO
+
+
+def serializar_artefato(key, texto, colunas):
+    artefato = {"versao": VERSAO_ARTEFATO, "key": key, "text": texto, "linhas": colunas}
+    # mtime=0: o mesmo OCR gera sempre os mesmos bytes
+    return gzip.compress(
+        json.dumps(artefato, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), mtime=0
+    )
+
+
+def ler_artefato(conteudo):
+    artefato = json.loads(gzip.decompress(conteudo).decode("utf-8"))
+    if artefato.get("versao") != VERSAO_ARTEFATO:
+        raise ValueError(f"Versão de artefato não suportada: {artefato.get('versao')}")
+    return artefato
+
+
+def baixar_artefato(s3_client, bucket, chave):
+    return ler_artefato(s3_client.get_object(Bucket=bucket, Key=chave)["Body"].read())
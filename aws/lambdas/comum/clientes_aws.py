@@ -0,0 +1,103 @@
+import os
+import threading
+
+# Fábrica única dos clientes AWS usada pelas Lambdas (recebe-notas, extrai-texto e llm).
+# O boto3 só é importado e cada cliente só é criado no primeiro uso, uma vez por
+# processo: invocações seguintes do mesmo container reaproveitam o cliente e as conexões
+# já abertas. Todos saem com o mesmo Config: pool de conexões, keep-alive, timeouts e
+# retry adaptativo. Os clientes envolvidos pelo limitador (limitador.limitado) são
+# criados com tentativas=1: o backoff dos throttles fica só com o limitador, senão cada
+# tentativa dele viraria até AWS_TENTATIVAS chamadas do botocore. Para testes e execução
+# local, substituir() troca o cliente de um serviço por qualquer objeto com a mesma
+# interface (ex.: os de aws/pipeline/locais.py).
+
+# Conexões por cliente: precisa cobrir as threads que usam o mesmo cliente (upload em
+# lote, relocação), senão o urllib3 descarta conexões e abre outras a cada chamada
+MAX_CONEXOES = int(os.environ.get("AWS_MAX_CONEXOES", "32"))
+TIMEOUT_CONEXAO = float(os.environ.get("AWS_TIMEOUT_CONEXAO", "2"))
+TIMEOUT_LEITURA = float(os.environ.get("AWS_TIMEOUT_LEITURA", "30"))
+TENTATIVAS = int(os.environ.get("AWS_TENTATIVAS", "5"))
+# Serviços com chamadas que ficam esperando a resposta por mais tempo:
+# start_sync_execution (state machine EXPRESS, até 5 min) e a geração do Bedrock
+TIMEOUT_LEITURA_SERVICO = {
+    "stepfunctions": 310.0,
+    "bedrock-runtime": 120.0,
+}
+
+_clientes = {}
+_substitutos = {}
+_trava = threading.Lock()
+
+
+def configuracao(servico, tentativas=None):
+    # tentativas=None: retry adaptativo do botocore com AWS_TENTATIVAS; um número fixa o
+    # total de chamadas por operação (1 = sem retry no botocore)
+    from botocore.config import Config
+    if tentativas is None:
+        retries = {"mode": "adaptive", "max_attempts": TENTATIVAS}
+    else:
+        retries = {"mode": "standard", "total_max_attempts": tentativas}
+    return Config(
+        max_pool_connections=MAX_CONEXOES,
+        connect_timeout=TIMEOUT_CONEXAO,
+        read_timeout=TIMEOUT_LEITURA_SERVICO.get(servico, TIMEOUT_LEITURA),
+        tcp_keepalive=True,
+        retries=retries,
+    )
+
+
+def cliente(servico, regiao=None, tentativas=None):
+    substituto = _substitutos.get((servico, regiao))
+    if substituto is not None:
+        return substituto
+    chave = (servico, regiao, tentativas)
+    encontrado = _clientes.get(chave)
+    if encontrado is not None:
+        return encontrado
+    # Criar clientes do boto3 em várias threads ao mesmo tempo não é seguro
+    with _trava:
+        if chave not in _clientes:
+            import boto3
+            parametros = {"config": configuracao(servico, tentativas)}
+            if regiao:
+                parametros["region_name"] = regiao
+            _clientes[chave] = boto3.client(servico, **parametros)
+        return _clientes[chave]
+
+
+def substituir(servico, novo_cliente, regiao=None):
+    # Troca o cliente de um serviço (testes / execução local), com ou sem retry no
+    # botocore; None volta ao boto3
+    with _trava:
+        if novo_cliente is None:
+            _substitutos.pop((servico, regiao), None)
+        else:
+            _substitutos[(servico, regiao)] = novo_cliente
+
+
+def limpar():
+    with _trava:
+        _clientes.clear()
+        _substitutos.clear()
+
+
+class ClientePreguicoso:
+    # Usado nas variáveis de módulo das Lambdas (s3_client = preguicoso("s3")): repassa
+    # cada atributo para o cliente da fábrica, que só é criado no primeiro uso e pode
+    # ser substituído depois da importação do módulo
+    __slots__ = ("servico", "regiao", "tentativas")
+
+    def __init__(self, servico, regiao=None, tentativas=None):
+        self.servico = servico
+        self.regiao = regiao
+        self.tentativas = tentativas
+
+    def __getattr__(self, nome):
+        return getattr(cliente(self.servico, self.regiao, self.tentativas), nome)
+
+    def __repr__(self):
+        return f"ClientePreguicoso({self.servico!r}, {self.regiao!r}, {self.tentativas!r})"
+
+
+def preguicoso(servico, regiao=None, tentativas=None):
+    return ClientePreguicoso(servico, regiao, tentativas)
@@ -0,0 +1,262 @@
+import os
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger()
+
+# Limitador de taxa das chamadas ao Textract e ao Bedrock. Cada serviço tem um balde de
+# tokens (taxa sustentada por segundo + rajada): antes de cada chamada um token é
+# consumido ou a chamada espera o próximo. Se mesmo assim a AWS responder com
+# throttling, a chamada é repetida com backoff exponencial com jitter; esgotadas as
+# tentativas, sobe LimiteExcedido, que a Step Function repete com o próprio Retry.
+# Esse é o único backoff das chamadas limitadas: o cliente boto3 envolvido deve ser
+# criado sem retry próprio (preguicoso(servico, tentativas=1), ver clientes_aws.py).
+#
+# O estado dos baldes fica num armazém plugável: em memória (só o container atual) ou
+# numa tabela do DynamoDB, que divide a mesma cota entre todas as invocações
+# simultâneas. Backend escolhido por LIMITADOR_BACKEND: "memoria" (padrão),
+# "dynamodb" ou "desligado".
+
+# Taxa (chamadas/s) e rajada padrão de cada serviço; sobrescritas por
+# LIMITE_TPS_<SERVICO> e RAJADA_<SERVICO> (ex.: LIMITE_TPS_BEDROCK_RUNTIME)
+LIMITES_PADRAO = {
+    "textract": (10.0, 10.0),
+    "bedrock-runtime": (1.5, 3.0),
+}
+# Códigos de erro que indicam throttling (variam entre os serviços)
+ERROS_THROTTLING = {
+    "ThrottlingException",
+    "Throttling",
+    "ProvisionedThroughputExceededException",
+    "TooManyRequestsException",
+    "LimitExceededException",
+    "RequestLimitExceeded",
+}
+# Erros transitórios do lado da AWS, que o retry do botocore repetiria (mais os do
+# Bedrock que podem chegar no meio de um stream): também são repetidos aqui, com o
+# mesmo backoff, mas esgotadas as tentativas sobem como estão
+ERROS_TRANSITORIOS = {
+    "InternalServerError",
+    "InternalServerException",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+    "ModelStreamErrorException",
+    "ModelTimeoutException",
+}
+TENTATIVAS = int(os.environ.get("LIMITADOR_TENTATIVAS", "6"))
+BACKOFF_BASE = float(os.environ.get("LIMITADOR_BACKOFF_BASE", "0.2"))
+BACKOFF_MAXIMO = float(os.environ.get("LIMITADOR_BACKOFF_MAXIMO", "10"))
+# Espera máxima por um token antes de desistir (a Lambda não fica presa no limitador)
+ESPERA_MAXIMA = float(os.environ.get("LIMITADOR_ESPERA_MAXIMA", "30"))
+# Métodos do cliente que não são chamadas à API e passam direto pelo ClienteLimitado
+NAO_LIMITADOS = {
+    "can_paginate", "close", "exceptions", "generate_presigned_url", "get_paginator", "get_waiter", "meta",
+}
+
+
+class LimiteExcedido(Exception):
+    # Nome usado no Retry da Step Function ("ErrorEquals": ["LimiteExcedido"])
+    pass
+
+
+def codigo_erro(erro):
+    return getattr(erro, "response", {}).get("Error", {}).get("Code") or type(erro).__name__
+
+
+def limites(servico):
+    taxa, rajada = LIMITES_PADRAO.get(servico, (0.0, 0.0))
+    sufixo = servico.upper().replace("-", "_")
+    taxa = float(os.environ.get(f"LIMITE_TPS_{sufixo}", taxa))
+    rajada = float(os.environ.get(f"RAJADA_{sufixo}", rajada or taxa))
+    return taxa, max(1.0, rajada)
+
+
+def recarregar(tokens, atualizado, agora, taxa, capacidade):
+    # Tokens acumulados desde a última atualização, limitados à capacidade do balde
+    return min(capacidade, tokens + max(0.0, agora - atualizado) * taxa)
+
+
+class ArmazemMemoria:
+    # Baldes do processo atual (compartilhados entre as threads)
+    def __init__(self):
+        self.baldes = {}
+        self.trava = threading.Lock()
+
+    def consumir(self, chave, taxa, capacidade):
+        # Consome um token e devolve 0, ou devolve quantos segundos faltam para o próximo
+        agora = time.monotonic()
+        with self.trava:
+            tokens, atualizado = self.baldes.get(chave, (capacidade, agora))
+            tokens = recarregar(tokens, atualizado, agora, taxa, capacidade)
+            if tokens >= 1:
+                self.baldes[chave] = (tokens - 1, agora)
+                return 0.0
+            self.baldes[chave] = (tokens, agora)
+            return (1 - tokens) / taxa
+
+
+class ArmazemDynamoDB:
+    # Baldes numa tabela do DynamoDB (chave de partição "chave", string), divididos por
+    # todos os containers. A atualização é condicional: se outra invocação gravou o
+    # balde no meio, lê de novo e recalcula.
+    CONFLITOS_MAXIMOS = 5
+
+    def __init__(self, dynamodb_client, tabela):
+        self.dynamodb = dynamodb_client
+        self.tabela = tabela
+
+    def consumir(self, chave, taxa, capacidade):
+        for _ in range(self.CONFLITOS_MAXIMOS):
+            agora = time.time()
+            item = self.dynamodb.get_item(
+                TableName=self.tabela, Key={"chave": {"S": chave}}, ConsistentRead=True
+            ).get("Item")
+            if item:
+                anterior = item["atualizado"]["N"]
+                tokens = recarregar(float(item["tokens"]["N"]), float(anterior), agora, taxa, capacidade)
+            else:
+                anterior = None
+                tokens = capacidade
+            espera = 0.0 if tokens >= 1 else (1 - tokens) / taxa
+            if espera:
+                # Sem token: não grava nada, só informa quanto esperar
+                return espera
+            condicao = {"ConditionExpression": "attribute_not_exists(chave)"}
+            if anterior is not None:
+                condicao = {
+                    "ConditionExpression": "atualizado = :anterior",
+                    "ExpressionAttributeValues": {":anterior": {"N": anterior}},
+                }
+            try:
+                self.dynamodb.put_item(
+                    TableName=self.tabela,
+                    Item={
+                        "chave": {"S": chave},
+                        "tokens": {"N": repr(tokens - 1)},
+                        "atualizado": {"N": repr(agora)},
+                    },
+                    **condicao
+                )
+                return 0.0
+            except Exception as e:
+                if codigo_erro(e) != "ConditionalCheckFailedException":
+                    raise
+        # Muita disputa pelo mesmo balde: espera um intervalo curto e tenta de novo
+        return 1 / taxa
+
+
+def criar_armazem():
+    backend = os.environ.get("LIMITADOR_BACKEND", "memoria").lower()
+    if backend == "dynamodb":
+        from clientes_aws import preguicoso
+        return ArmazemDynamoDB(preguicoso("dynamodb"), os.environ["LIMITADOR_TABELA"])
+    if backend == "desligado":
+        return None
+    return ArmazemMemoria()
+
+
+class Limitador:
+    def __init__(self, armazem=None, dormir=time.sleep):
+        self.armazem = armazem
+        self.dormir = dormir
+        self.trava = threading.Lock()
+        self.contadores = {}
+
+    def _contar(self, servico, **valores):
+        with self.trava:
+            contadores = self.contadores.setdefault(
+                servico, {"chamadas": 0, "throttles": 0, "retries": 0, "espera_ms": 0.0}
+            )
+            for nome, valor in valores.items():
+                contadores[nome] += valor
+
+    def resumo(self):
+        with self.trava:
+            return {servico: dict(valores) for servico, valores in self.contadores.items()}
+
+    def zerar(self):
+        with self.trava:
+            self.contadores.clear()
+
+    def aguardar(self, servico):
+        # Bloqueia até conseguir um token do balde do serviço
+        taxa, capacidade = limites(servico)
+        if self.armazem is None or taxa <= 0:
+            return
+        esperado = 0.0
+        while True:
+            try:
+                espera = self.armazem.consumir(servico, taxa, capacidade)
+            except Exception as e:
+                # Armazém fora do ar não derruba a chamada: segue sem limitar
+                logger.warning(f"⚠️ Limitador indisponível para {servico}: {str(e)}")
+                break
+            if not espera:
+                break
+            if esperado + espera > ESPERA_MAXIMA:
+                self._contar(servico, espera_ms=esperado * 1000)
+                raise LimiteExcedido(f"{servico}: sem cota após {esperado:.1f} s de espera")
+            self.dormir(espera)
+            esperado += espera
+        if esperado:
+            self._contar(servico, espera_ms=esperado * 1000)
+
+    def chamar(self, servico, funcao, *args, **kwargs):
+        for tentativa in range(TENTATIVAS):
+            self.aguardar(servico)
+            self._contar(servico, chamadas=1)
+            try:
+                return funcao(*args, **kwargs)
+            except Exception as e:
+                codigo = codigo_erro(e)
+                throttling = codigo in ERROS_THROTTLING
+                if not throttling and codigo not in ERROS_TRANSITORIOS:
+                    raise
+                if throttling:
+                    self._contar(servico, throttles=1)
+                if tentativa == TENTATIVAS - 1:
+                    if throttling:
+                        raise LimiteExcedido(f"{servico}: throttling após {TENTATIVAS} tentativas") from e
+                    raise
+                # Backoff exponencial com jitter completo: as invocações que levaram
+                # throttling juntas não voltam todas no mesmo instante
+                espera = random.uniform(0, min(BACKOFF_MAXIMO, BACKOFF_BASE * 2 ** tentativa))
+                logger.warning(f"🚦 {'Throttling' if throttling else 'Erro transitório'} em {servico} ({codigo}); nova tentativa em {espera:.2f} s")
+                self._contar(servico, retries=1, espera_ms=espera * 1000)
+                self.dormir(espera)
+
+
+class ClienteLimitado:
+    # Envolve um cliente (boto3 ou substituto local): cada chamada à API passa pelo
+    # limitador; os demais atributos (exceptions, meta, ...) são repassados como estão
+    def __init__(self, cliente, servico, limitador):
+        self.cliente = cliente
+        self.servico = servico
+        self.limitador = limitador
+
+    def repetir(self, funcao, *args, **kwargs):
+        # Operação que vai além da chamada (ex.: ler um stream, que pode falhar no meio):
+        # funcao(cliente sem limitador, ...) inteira passa pelo limitador e é repetida
+        return self.limitador.chamar(self.servico, funcao, self.cliente, *args, **kwargs)
+
+    def __getattr__(self, nome):
+        atributo = getattr(self.cliente, nome)
+        if nome.startswith("_") or nome in NAO_LIMITADOS or not callable(atributo):
+            return atributo
+
+        def chamada(*args, **kwargs):
+            return self.limitador.chamar(self.servico, atributo, *args, **kwargs)
+        return chamada
+
+
+# Limitador do processo, usado pelas Lambdas
+limitador = Limitador(criar_armazem())
+
+
+def limitado(cliente, servico):
+    return ClienteLimitado(cliente, servico, limitador)
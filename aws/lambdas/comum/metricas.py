@@ -0,0 +1,218 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import logging
+import pstats
+import cProfile
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+logger = logging.getLogger()
+
+# Instrumentação compartilhada pelas Lambdas. As métricas de cada invocação (tempo de
+# OCR, de cada extrair_*, da LLM, do S3, ...) são juntadas num único JSON no formato
+# Embedded Metric Format (EMF), escrito direto no stdout ao fim do handler: o CloudWatch
+# Logs transforma as chaves listadas em "_aws" em métricas, sem chamada extra à API. Os
+# demais campos do JSON (propriedades) ficam pesquisáveis no Logs Insights.
+#
+# O evento recebido só é registrado numa amostra das invocações e com tamanho máximo
+# (LOG_EVENTO_AMOSTRA, LOG_EVENTO_MAX_BYTES). O cProfile pode ser ligado para todas as
+# invocações (PERFIL=true) ou só para uma, com "_perfil": true no evento ou o header
+# "X-Perfil: 1" na API.
+
+NAMESPACE = os.environ.get("METRICAS_NAMESPACE", "NotasFiscais")
+METRICAS_LIGADAS = os.environ.get("METRICAS", "true").lower() in ("1", "true", "sim")
+# Fração das invocações que registram o evento e tamanho máximo registrado (bytes)
+AMOSTRA_EVENTO = float(os.environ.get("LOG_EVENTO_AMOSTRA", "0.1"))
+LIMITE_EVENTO = int(os.environ.get("LOG_EVENTO_MAX_BYTES", "2048"))
+# Strings do evento maiores que isso (ex.: imagem em base64) são cortadas antes de serializar
+LIMITE_VALOR_EVENTO = 256
+PERFIL = os.environ.get("PERFIL", "false").lower() in ("1", "true", "sim")
+PERFIL_LINHAS = int(os.environ.get("PERFIL_LINHAS", "25"))
+# Limite do EMF: até 100 métricas por documento (acima disso, vão em mais de uma linha)
+MAX_METRICAS_DOCUMENTO = 100
+
+
+class Metricas:
+    # Acumula as métricas de uma invocação (entre iniciar e publicar). Fora de uma
+    # invocação (pipeline local, benchmarks) registrar não guarda nada.
+    def __init__(self, namespace=NAMESPACE, saida=None):
+        self.namespace = namespace
+        self.saida = saida or self._escrever
+        self.trava = threading.Lock()
+        self.ativa = False
+        self.dimensoes = {}
+        self.valores = {}
+        self.propriedades = {}
+
+    @staticmethod
+    def _escrever(linha):
+        # Sem o prefixo do logger: o CloudWatch só reconhece a linha EMF como JSON puro
+        sys.stdout.write(linha + "\n")
+        sys.stdout.flush()
+
+    def iniciar(self, funcao):
+        with self.trava:
+            self.ativa = METRICAS_LIGADAS
+            self.dimensoes = {"Funcao": funcao}
+            self.valores = {}
+            self.propriedades = {}
+
+    def registrar(self, nome, valor, unidade="Milliseconds"):
+        with self.trava:
+            if self.ativa:
+                self.valores.setdefault(nome, ([], unidade))[0].append(valor)
+
+    def contar(self, nome, quantidade=1):
+        self.registrar(nome, quantidade, "Count")
+
+    def registrar_contadores(self, prefixo, contadores):
+        # Contadores de um resumo (ex.: limitador.resumo()): chaves terminadas em "_ms"
+        # são tempos, as demais são contagens
+        for nome, valor in contadores.items():
+            self.registrar(f"{prefixo}_{nome}", valor, "Milliseconds" if nome.endswith("_ms") else "Count")
+
+    def propriedade(self, nome, valor):
+        with self.trava:
+            if self.ativa:
+                self.propriedades[nome] = valor
+
+    @contextmanager
+    def cronometro(self, nome):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(nome, (time.perf_counter() - inicio) * 1000)
+
+    def documentos(self, agora=None):
+        # Um documento EMF por bloco de até MAX_METRICAS_DOCUMENTO métricas; métricas
+        # registradas mais de uma vez na invocação vão como lista de valores
+        timestamp = int((agora if agora is not None else time.time()) * 1000)
+        nomes = list(self.valores)
+        documentos = []
+        for inicio in range(0, len(nomes), MAX_METRICAS_DOCUMENTO):
+            bloco = nomes[inicio:inicio + MAX_METRICAS_DOCUMENTO]
+            documento = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(self.dimensoes)],
+                        "Metrics": [{"Name": nome, "Unit": self.valores[nome][1]} for nome in bloco],
+                    }],
+                },
+            }
+            documento.update(self.propriedades)
+            documento.update(self.dimensoes)
+            for nome in bloco:
+                valores = self.valores[nome][0]
+                documento[nome] = valores[0] if len(valores) == 1 else valores
+            documentos.append(documento)
+        return documentos
+
+    def publicar(self):
+        with self.trava:
+            if not self.ativa:
+                return []
+            documentos = self.documentos()
+            self.ativa = False
+            self.valores = {}
+            self.propriedades = {}
+        for documento in documentos:
+            self.saida(json.dumps(documento, ensure_ascii=False, default=str))
+        return documentos
+
+
+# Métricas do processo, usadas pelas Lambdas
+metricas = Metricas()
+_primeira_invocacao = True
+
+
+def _podar(valor, limite=LIMITE_VALOR_EVENTO):
+    # Cópia do evento com as strings longas cortadas, para não serializar o conteúdo
+    # inteiro (ex.: a imagem em base64) só para registrar o começo dele
+    if isinstance(valor, str):
+        if len(valor) <= limite:
+            return valor
+        return f"{valor[:limite]}…(+{len(valor) - limite} caracteres)"
+    if isinstance(valor, dict):
+        return {chave: _podar(item, limite) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_podar(item, limite) for item in valor]
+    return valor
+
+
+def registrar_evento(evento, amostra=AMOSTRA_EVENTO, limite=LIMITE_EVENTO, forcar=False):
+    # Registra o evento em só uma fração das invocações e com tamanho máximo
+    if not forcar and random.random() >= amostra:
+        return False
+    texto = json.dumps(_podar(evento), ensure_ascii=False, default=str)
+    if len(texto) > limite:
+        texto = f"{texto[:limite]}…(+{len(texto) - limite} caracteres)"
+    logger.info("🔹 Evento recebido: %s", texto)
+    return True
+
+
+def perfil_pedido(evento):
+    if PERFIL:
+        return True
+    if not isinstance(evento, dict):
+        return False
+    if evento.get("_perfil") is True:
+        return True
+    headers = {str(chave).lower(): valor for chave, valor in (evento.get("headers") or {}).items()}
+    return str(headers.get("x-perfil", "")).lower() in ("1", "true", "sim")
+
+
+@contextmanager
+def perfilado(ligado):
+    # cProfile da invocação; as funções mais caras (tempo acumulado) vão para o log
+    if not ligado:
+        yield None
+        return
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield perfil
+    finally:
+        perfil.disable()
+        saida = io.StringIO()
+        pstats.Stats(perfil, stream=saida).sort_stats("cumulative").print_stats(PERFIL_LINHAS)
+        logger.info("🔬 Perfil da invocação:\n%s", saida.getvalue())
+
+
+def instrumentado(funcao, resumo=None):
+    # Decorador do lambda_handler: abre as métricas da invocação, registra o evento
+    # (amostrado; `resumo` reduz o evento antes, ex.: sem o arquivo), liga o cProfile se
+    # pedido e publica as métricas no fim, inclusive quando o handler falha
+    def decorador(handler):
+        @wraps(handler)
+        def envolvido(event, context):
+            global _primeira_invocacao
+            metricas.iniciar(funcao)
+            metricas.propriedade("request_id", getattr(context, "aws_request_id", None))
+            registrar_evento(resumo(event) if resumo else event)
+            if _primeira_invocacao:
+                metricas.contar("cold_start")
+                _primeira_invocacao = False
+            inicio = time.perf_counter()
+            try:
+                with perfilado(perfil_pedido(event)):
+                    resposta = handler(event, context)
+                if isinstance(resposta, dict) and "statusCode" in resposta:
+                    metricas.propriedade("status", resposta["statusCode"])
+                    metricas.contar("erros", int(resposta["statusCode"] >= 500))
+                return resposta
+            except Exception:
+                metricas.contar("erros")
+                raise
+            finally:
+                metricas.registrar("handler_ms", (time.perf_counter() - inicio) * 1000)
+                metricas.publicar()
+        return envolvido
+    return decorador
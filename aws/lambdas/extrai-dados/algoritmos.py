@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 def levenshtein(s1, s2):
     if len(s1) < len(s2):
@@ -36,14 +37,112 @@ def damerau_levenshtein(s1, s2):
                 d[(i, j)] = min(d[(i, j)], d[(i - 2, j - 2)] + cost)
     return d[lenstr1 - 1, lenstr2 - 1]
 
+# Mesma distância de damerau_levenshtein, mas calculada só até `limite`: guarda três
+# linhas que se revezam (em vez do dicionário com todas as células), preenche apenas
+# a faixa |i - j| <= limite e desiste assim que a linha inteira passa do limite.
+# Retorna limite + 1 quando a distância real é maior que o limite.
+def damerau_levenshtein_limitado(s1, s2, limite):
+    n, m = len(s1), len(s2)
+    estouro = limite + 1
+    if abs(n - m) > limite:
+        return estouro
+    if n == 0 or m == 0:
+        return max(n, m)
+    anterior2 = None
+    anterior = list(range(m + 1))
+    for i in range(1, n + 1):
+        atual = [estouro] * (m + 1)
+        if i <= limite:
+            atual[0] = i
+        menor = atual[0]
+        c1 = s1[i - 1]
+        for j in range(max(1, i - limite), min(m, i + limite) + 1):
+            c2 = s2[j - 1]
+            custo = 0 if c1 == c2 else 1
+            valor = min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + custo)
+            if i > 1 and j > 1 and c1 == s2[j - 2] and s1[i - 2] == c2:
+                valor = min(valor, anterior2[j - 2] + custo)
+            atual[j] = valor
+            if valor < menor:
+                menor = valor
+        if menor > limite:
+            return estouro
+        anterior2, anterior = anterior, atual
+    return min(anterior[m], estouro)
+
 def fuzzy_search_simples(texto, termos_validos, distancia_max=1):
     palavras = re.findall(r"\b\w+\b", texto)
     substituicoes = {}
     for palavra in palavras:
         for termo in termos_validos:
-            if damerau_levenshtein(palavra.lower(), termo.lower()) <= distancia_max:
+            if damerau_levenshtein_limitado(palavra.lower(), termo.lower(), distancia_max) <= distancia_max:
                 substituicoes[palavra] = termo
                 break
     for original, corrigido in substituicoes.items():
         texto = re.sub(rf"\b{re.escape(original)}\b", corrigido, texto)
     return texto
+
+REGEX_PALAVRA = re.compile(r"\b\w+\b")
+
+# Todas as strings obtidas apagando até `profundidade` caracteres de `palavra`
+def delecoes(palavra, profundidade):
+    resultado = {palavra}
+    fronteira = {palavra}
+    for _ in range(profundidade):
+        fronteira = {p[:k] + p[k + 1:] for p in fronteira for k in range(len(p))}
+        resultado |= fronteira
+    return resultado
+
+# Índice de deleções (estilo SymSpell) de um vocabulário de pares (termo, distancia_max):
+# cada deleção de cada termo aponta para a posição do termo no vocabulário. Duas
+# palavras a distância <= d sempre compartilham alguma deleção de profundidade <= d,
+# então basta gerar as deleções da palavra e olhar no índice. Construído uma vez por
+# vocabulário.
+@lru_cache(maxsize=16)
+def indexar_vocabulario(vocabulario):
+    indice = {}
+    for posicao, (termo, distancia_max) in enumerate(vocabulario):
+        for delecao in delecoes(termo.lower(), distancia_max):
+            indice.setdefault(delecao, []).append(posicao)
+    maior_distancia = max((d for _, d in vocabulario), default=0)
+    maior_termo = max((len(t) for t, _ in vocabulario), default=0)
+    return indice, maior_distancia, maior_termo
+
+# Melhor termo para uma palavra (já em minúsculas) dentro de um vocabulário fixo.
+# vocabulario é uma tupla de pares (termo, distancia_max); vence a menor distância
+# e, no empate, o termo que vem primeiro. Os candidatos saem do índice de deleções
+# e só eles passam pela distância limitada. Memoizado: palavras repetidas entre
+# notas processadas na mesma instância da Lambda não são recalculadas.
+@lru_cache(maxsize=8192)
+def termo_mais_proximo(palavra, vocabulario):
+    indice, maior_distancia, maior_termo = indexar_vocabulario(vocabulario)
+    # A distância nunca é menor que a diferença de tamanho
+    if len(palavra) > maior_termo + maior_distancia:
+        return None
+    candidatos = set()
+    for delecao in delecoes(palavra, maior_distancia):
+        candidatos.update(indice.get(delecao, ()))
+    melhor = None
+    melhor_distancia = None
+    for posicao in sorted(candidatos):
+        termo, distancia_max = vocabulario[posicao]
+        distancia = damerau_levenshtein_limitado(palavra, termo.lower(), distancia_max)
+        if distancia <= distancia_max and (melhor_distancia is None or distancia < melhor_distancia):
+            melhor, melhor_distancia = termo, distancia
+            if distancia == 0:
+                break
+    return melhor
+
+# Etapa única de correção de OCR: tokeniza o texto uma vez, confere cada palavra
+# distinta contra o vocabulário inteiro e aplica todas as trocas em uma só passada.
+# Retorna o texto corrigido e o mapa palavra -> termo usado na correção.
+def corrigir_ocr(texto, vocabulario):
+    mapa = {}
+    for palavra in dict.fromkeys(REGEX_PALAVRA.findall(texto)):
+        termo = termo_mais_proximo(palavra.lower(), vocabulario)
+        if termo is not None and termo != palavra:
+            mapa[palavra] = termo
+    if not mapa:
+        return texto, mapa
+    texto_corrigido = REGEX_PALAVRA.sub(lambda m: mapa.get(m.group(0), m.group(0)), texto)
+    return texto_corrigido, mapa
@@ -0,0 +1,75 @@
+from collections import deque
+
+# Localizador de palavras-âncora (Aho-Corasick). Os padrões dos campos começam por uma
+# palavra-chave fixa ("total", "série", "CNPJ", "rua", ...): em vez de cada padrão
+# percorrer a nota inteira atrás da sua, um autômato montado uma vez na importação acha
+# todas as palavras-chave, e a posição de cada uma, numa única passada pelo texto. O
+# custo da passada é linear no tamanho do texto e não depende de quantas palavras há.
+#
+# Sem diferenciar maiúsculas/minúsculas, com as mesmas equivalências do re.IGNORECASE,
+# para que "padrão.match numa âncora" ache exatamente o que "padrão.search" acharia.
+
+# Letras que o re.IGNORECASE também considera iguais, além de lower()/upper()
+VARIANTES_EXTRAS = {"i": "ıİ", "k": "K", "s": "ſ"}
+
+
+def variantes(caractere):
+    candidatos = {caractere, caractere.lower(), caractere.upper()} | set(VARIANTES_EXTRAS.get(caractere.lower(), ""))
+    return {candidato for candidato in candidatos if len(candidato) == 1}
+
+
+class LocalizadorAncoras:
+    __slots__ = ("palavras", "transicoes", "saidas")
+
+    def __init__(self, palavras):
+        self.palavras = tuple(dict.fromkeys(palavra.lower() for palavra in palavras))
+        # Trie das palavras (estado 0 = raiz); cada estado guarda as palavras que
+        # terminam nele (índice em self.palavras)
+        filhos = [{}]
+        saidas = [()]
+        for indice, palavra in enumerate(self.palavras):
+            estado = 0
+            for caractere in palavra:
+                if caractere not in filhos[estado]:
+                    filhos.append({})
+                    saidas.append(())
+                    filhos[estado][caractere] = len(filhos) - 1
+                estado = filhos[estado][caractere]
+            saidas[estado] += (indice,)
+
+        # Links de falha em largura, já resolvidos numa tabela de transições completa
+        # (autômato determinístico): na busca, cada caractere custa um único lookup.
+        # Caracteres fora das palavras não estão na tabela e voltam para a raiz.
+        transicoes = [None] * len(filhos)
+        transicoes[0] = {}
+        for caractere, filho in filhos[0].items():
+            for variante in variantes(caractere):
+                transicoes[0][variante] = filho
+        falhas = [0] * len(filhos)
+        fila = deque(filhos[0].values())
+        while fila:
+            estado = fila.popleft()
+            saidas[estado] += saidas[falhas[estado]]
+            transicoes[estado] = dict(transicoes[falhas[estado]])
+            for caractere, filho in filhos[estado].items():
+                falhas[filho] = transicoes[falhas[estado]].get(caractere.lower(), 0)
+                for variante in variantes(caractere):
+                    transicoes[estado][variante] = filho
+                fila.append(filho)
+        self.transicoes = transicoes
+        self.saidas = saidas
+
+    def localizar(self, texto):
+        # {palavra: [posições de início]} de todas as ocorrências, em ordem
+        posicoes = {palavra: [] for palavra in self.palavras}
+        transicoes = self.transicoes
+        saidas = self.saidas
+        palavras = self.palavras
+        estado = 0
+        for fim, caractere in enumerate(texto, 1):
+            estado = transicoes[estado].get(caractere, 0)
+            if saidas[estado]:
+                for indice in saidas[estado]:
+                    palavra = palavras[indice]
+                    posicoes[palavra].append(fim - len(palavra))
+        return posicoes
@@ -1,19 +1,469 @@
+import os
 import re
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from algoritmos import fuzzy_search_simples
-
-def extrair_dados_nota(texto):
-    tokens = word_tokenize(texto)
-    stop_words = set(stopwords.words("portuguese"))
-    tokens_filtrados = [word for word in tokens if word.lower() not in stop_words]
-    cnpj_emissor, cpf_consumidor, data_emissao = extrair_regex(texto)
-    endereco = extrair_endereco(texto)
-    nome_emissor = extrair_nome_emissor(texto)
-    numero_nota = extrair_numero_nota(texto)
-    serie = extrair_serie(texto)
-    valor_total = extrair_valor_total(texto)
-    forma_pgto = extrair_forma_pagamento(texto)
+import sys
+import json
+import time
+import argparse
+from bisect import bisect_left
+from datetime import date, datetime
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+from algoritmos import corrigir_ocr
+from ancoras import LocalizadorAncoras
+
+# Caminhos extras de dados do NLTK (ex.: o nltk_data da layer), registrados pelo handler
+CAMINHOS_NLTK_DATA = []
+
+_nltk = None
+
+# Registro de padrões: cada campo é compilado uma única vez, na importação do módulo,
+# em vez de ser remontado (e buscado no cache do módulo re) a cada chamada
+PADROES = {
+    # extrair_regex
+    "cnpj": re.compile(r"\b\d{2}[\._]?\d{3}[\._]?\d{3}[/\\]?\d{4}-?\d{2}\b"),
+    # "\b\d{11}\b" já é o caso sem pontos nem hífen: a alternativa separada só fazia a
+    # busca (sem âncora, pelo texto inteiro) testar cada posição duas vezes
+    "cpf": re.compile(r"\b\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b"),
+    "data": re.compile(r"\b\d{2}/\d{2}/\d{4}\b"),
+    # extrair_valor_total (a ordem da lista define a prioridade)
+    "valor_total_r": re.compile(r"valor\s+total\s+r\$?\s*([\d.,]+)", re.IGNORECASE),
+    "valor_total": re.compile(r"valor\s+total\s*([\d.,]+)", re.IGNORECASE),
+    "total_r": re.compile(r"total\s+r\$?\s*([\d.,]+)", re.IGNORECASE),
+    "total": re.compile(r"total\s*([\d.,]+)", re.IGNORECASE),
+    # extrair_serie
+    "serie": re.compile(r"(?:S[ée]rie|Serie|ECF)[:\s\-]*?(\d{1,3})", re.IGNORECASE),
+    # extrair_numero_nota
+    # "\s*(?:[:\-]\s*)?" aceita o mesmo que "\s*[:\-]?\s*", sem os dois \s* seguidos que
+    # faziam o backtracking ser quadrático numa sequência longa de espaços
+    "numero_extrato": re.compile(r"(?:extrato\s+n[ºo.°]*|nfc[-–]?[eE]?)\s*(?:[:\-]\s*)?(\d{4,})", re.IGNORECASE),
+    "numero_nfe": re.compile(r"(?:NF[\-–]?E|NME)[^0-9]{0,5}(\d{6,})", re.IGNORECASE),
+    "numero_coo": re.compile(r"(?:Nº|No|Número|COO|CCF|Extrato\s+N)[:\s]*(\d{4,})", re.IGNORECASE),
+    # extrair_forma_pagamento
+    "pgto_pix": re.compile(r"pix", re.IGNORECASE),
+    "pgto_dinheiro": re.compile(r"dinheiro", re.IGNORECASE),
+    "pgto_cartao_credito": re.compile(r"cart[aã]o\s+(de\s+)?cr[eé]dito", re.IGNORECASE),
+    "pgto_credito": re.compile(r"\bcr[eé]dito\b", re.IGNORECASE),
+    "pgto_cartao_debito": re.compile(r"cart[aã]o\s+(de\s+)?d[eé]bito", re.IGNORECASE),
+    "pgto_debito": re.compile(r"\bd[eé]bito\b", re.IGNORECASE),
+    "pgto_cartao": re.compile(r"\bcart[aã]o\b", re.IGNORECASE),
+}
+
+CAMPOS_REGEX = ("cnpj", "cpf", "data")
+PADROES_VALOR_TOTAL = ("valor_total_r", "valor_total", "total_r")
+PADROES_SERIE = ("serie",)
+PADROES_NUMERO_NOTA = ("numero_extrato", "numero_nfe", "numero_coo")
+PADROES_FORMA_PGTO = {
+    "PIX": ("pgto_pix",),
+    "DINHEIRO": ("pgto_dinheiro",),
+    "CRÉDITO": ("pgto_cartao_credito", "pgto_credito"),
+    "DÉBITO": ("pgto_cartao_debito", "pgto_debito"),
+    "CARTÃO": ("pgto_cartao",),
+}
+PADROES_PGTO = tuple(nome for nomes in PADROES_FORMA_PGTO.values() for nome in nomes)
+# Campos buscados na varredura única do texto original ("total" só entra no fallback)
+CAMPOS_VARREDURA = CAMPOS_REGEX + PADROES_VALOR_TOTAL + PADROES_SERIE + PADROES_NUMERO_NOTA + PADROES_PGTO
+# Padrões que disputam o mesmo campo, em ordem de prioridade: o extrator usa só o
+# primeiro que casar (_primeiro_grupo, _forma_encontrada), então a varredura de um
+# grupo para no primeiro padrão encontrado e os seguintes nem chegam a ser buscados
+GRUPOS_VARREDURA = tuple((nome,) for nome in CAMPOS_REGEX) + (
+    PADROES_VALOR_TOTAL + ("total",), PADROES_SERIE, PADROES_NUMERO_NOTA, PADROES_PGTO,
+)
+GRUPO_DO_PADRAO = {nome: grupo for grupo in GRUPOS_VARREDURA for nome in grupo}
+
+# Padrões usados sobre o texto já corrigido pelo fuzzy
+PALAVRAS_ENDERECO_NOME = r"\b(?:RUA|R\.|AV(?:\.|ENIDA)?|AL(?:\.|AMEDA)?|(?:PRA[ÇC]A|PÇA\.?)|ROD(?:\.|OVIA)?|(?:TRAVESSA|TV\.?)|VL(?:\.|ILA)?|EST(?:\.|RADA)?|LG(?:\.|ARGO)?|QUADRA|KM|CEP|CHACARAS|JARDIM|AVE|VIA|IE)\b"
+PALAVRAS_ENDERECO = r"\b(?:RUA|R\.|AV(?:\.|ENIDA)?|AL(?:\.|AMEDA)?|(?:PRA[ÇC]A|PÇA\.?)|ROD(?:\.|OVIA)?|(?:TRAVESSA|TV\.?)|VL(?:\.|ILA)?|EST(?:\.|RADA)?|LG(?:\.|ARGO)?|QUADRA|KM|CEP|CHACARAS|JARDIM|AVE|VIA)\b"
+PALAVRAS_PARADA_ENDERECO = r"(?:\b(?:CNPJ|IE|CPF|TELEFONE|FONE|DANFE|DOCUMENTO|VALOR|FORMA\s+PAGAMENTO|NFC-e|CONSUMIDOR|CHAVE)\b)"
+
+# Vocabulário da correção de OCR de cada extrator (termo, distância máxima): os termos
+# do campo e as palavras onde ele termina (as paradas do endereço, as palavras de
+# endereço que encerram o nome). No empate vence o termo que vem primeiro, então a
+# ordem é a do campo: num vocabulário único, "CPE" virava "cpf" em vez de "cep" e
+# cortava o endereço, enquanto "CNP" antes de um CNPJ continua virando "cnpj". Termos
+# curtos não aceitam distância maior que 1 (senão "e" viraria "ecf"); um termo com
+# distância 0 só impede que a palavra seja "corrigida" para outro termo do campo
+# ("Nota" -> "total").
+TERMOS_ENDERECO = (
+    ("rua", 1), ("avenida", 1), ("travessa", 1), ("alameda", 1), ("quadra", 1), ("cep", 1), ("chacaras", 1),
+)
+VOCABULARIOS_CAMPOS = {
+    "regex": (("cnpj", 1), ("cpf", 1), ("data", 1)),
+    "nome_emissor": (("cnpj", 1),) + TERMOS_ENDERECO,
+    "endereco": (("cnpj", 1),) + TERMOS_ENDERECO + (("cpf", 1),),
+    # As variantes com espaço ("valor total r$", ...) nunca casavam com uma palavra só
+    "valor_total": (("nota", 0), ("total", 2)),
+    "serie": (("serie", 2), ("série", 2), ("ecf", 1)),
+    "numero_nota": (("nfe", 1), ("nf-e", 1), ("número", 1), ("coo", 1), ("ccf", 1), ("extrato", 1), ("nfc-e", 1)),
+    "forma_pgto": (
+        ("pix", 1), ("dinheiro", 1), ("credito", 1), ("crédito", 1), ("debito", 1), ("débito", 1),
+        ("cartao", 1), ("cartão", 1),
+    ),
+}
+# Todos os termos, na ordem dos campos (benchmarks)
+VOCABULARIO_OCR = tuple(dict.fromkeys(chain.from_iterable(VOCABULARIOS_CAMPOS.values())))
+
+REGEX_CNPJ_ROTULADO = re.compile(r"\bCNPJ[:\s]*\d{2}\.?\d{3}\.?\d{3}[\/\\]?\d{4}-?\d{2}", re.IGNORECASE)
+REGEX_ENDERECO_NOME = re.compile(PALAVRAS_ENDERECO_NOME, re.IGNORECASE)
+# A regex utiliza negative lookahead para capturar até antes das palavras de parada.
+# O lookahead roda a cada caractere (e o \s* dele relê cada sequência de espaços), então
+# ela só é usada em trechos curtos: o endereço sai de casar_endereco, em tempo linear
+REGEX_ENDERECO = re.compile(
+    PALAVRAS_ENDERECO + r"(?:(?!\s*" + PALAVRAS_PARADA_ENDERECO + r").)+", re.IGNORECASE
+)
+REGEX_PALAVRA_ENDERECO = re.compile(PALAVRAS_ENDERECO, re.IGNORECASE)
+REGEX_PARADA_ENDERECO = re.compile(PALAVRAS_PARADA_ENDERECO, re.IGNORECASE)
+REGEX_NAO_ESPACO = re.compile(r"\S")
+
+# Palavras-âncora de cada padrão: todo match do padrão começa numa delas, então basta
+# testar o padrão (re.match) nessas posições em vez de percorrer o texto inteiro.
+# cnpj, cpf e data começam por dígitos e continuam com a busca normal.
+ANCORAS_ENDERECO = (
+    "rua", "r.", "av", "al", "praça", "praca", "pça", "rod", "travessa", "tv", "vl", "est", "lg",
+    "quadra", "km", "cep", "chacaras", "jardim", "via",
+)
+ANCORAS_PADROES = {
+    "valor_total_r": ("valor",),
+    "valor_total": ("valor",),
+    "total_r": ("total",),
+    "total": ("total",),
+    "serie": ("série", "serie", "ecf"),
+    "numero_extrato": ("extrato", "nfc"),
+    "numero_nfe": ("nf-e", "nf–e", "nfe", "nme"),
+    "numero_coo": ("nº", "no", "número", "coo", "ccf", "extrato"),
+    "pgto_pix": ("pix",),
+    "pgto_dinheiro": ("dinheiro",),
+    "pgto_cartao_credito": ("cartao", "cartão"),
+    "pgto_credito": ("credito", "crédito"),
+    "pgto_cartao_debito": ("cartao", "cartão"),
+    "pgto_debito": ("debito", "débito"),
+    "pgto_cartao": ("cartao", "cartão"),
+    "cnpj_rotulado": ("cnpj",),
+    "endereco": ANCORAS_ENDERECO,
+    "endereco_nome": ANCORAS_ENDERECO + ("ie",),
+    "parada_endereco": (
+        "cnpj", "ie", "cpf", "telefone", "fone", "danfe", "documento", "valor", "forma", "nfc-e", "consumidor", "chave",
+    ),
+}
+LOCALIZADOR = LocalizadorAncoras(chain.from_iterable(ANCORAS_PADROES.values()))
+
+# Com a tabela de linhas do OCR, um campo só pode ocupar a linha onde começa e mais
+# esta quantidade de linhas seguintes (ex.: "VALOR TOTAL" numa linha e o valor na próxima)
+JANELA_LINHAS = 1
+
+# Modo protegido (usado pela Lambda): cada documento tem um Orcamento com prazo, tamanho
+# máximo de entrada, quantas âncoras cada padrão pode testar e até onde cada match pode
+# ir depois da âncora. Quando o prazo acaba, os campos que faltam saem como "None"
+# (resultado parcial, que a etapa de LLM completa pela confiança baixa).
+PRAZO_EXTRACAO_MS = float(os.environ.get("EXTRACAO_PRAZO_MS", "2000"))
+MAX_CARACTERES_EXTRACAO = int(os.environ.get("EXTRACAO_MAX_CARACTERES", "100000"))
+MAX_ANCORAS_PADRAO = int(os.environ.get("EXTRACAO_MAX_ANCORAS", "64"))
+# Caracteres que um campo pode ocupar a partir da âncora
+JANELA_PADRAO = 80
+JANELAS_CAMPOS = {"endereco": 300, "nome_emissor": 300}
+# Quantas vezes cada limite foi atingido neste processo (um por documento e limite)
+ESTOUROS_ORCAMENTO = Counter()
+
+
+class Orcamento:
+    def __init__(self, prazo_ms=PRAZO_EXTRACAO_MS, max_caracteres=MAX_CARACTERES_EXTRACAO,
+                 max_ancoras=MAX_ANCORAS_PADRAO, janelas=None):
+        self.limite = time.monotonic() + prazo_ms / 1000
+        self.max_caracteres = max_caracteres
+        self.max_ancoras = max_ancoras
+        self.janelas = dict(JANELAS_CAMPOS, **(janelas or {}))
+        self.estouros = []
+
+    def registrar(self, limite):
+        if limite not in self.estouros:
+            self.estouros.append(limite)
+            ESTOUROS_ORCAMENTO[limite] += 1
+
+    def esgotado(self):
+        if time.monotonic() < self.limite:
+            return False
+        self.registrar("prazo")
+        return True
+
+    @property
+    def parcial(self):
+        # Campos ficaram sem ser extraídos (prazo) ou parte do texto foi ignorada (entrada)
+        return "prazo" in self.estouros or "entrada" in self.estouros
+
+    def janela(self, nome):
+        return self.janelas.get(nome, JANELA_PADRAO)
+
+    def ancoras(self, posicoes):
+        if len(posicoes) <= self.max_ancoras:
+            return posicoes
+        self.registrar("ancoras")
+        return posicoes[:self.max_ancoras]
+
+
+def _esgotado(orcamento):
+    return orcamento is not None and orcamento.esgotado()
+
+
+# Correção de OCR de um campo (chave de VOCABULARIOS_CAMPOS) usada pelos fallbacks:
+# roda no máximo uma vez por documento e campo (as chamadas seguintes saem do cache)
+@lru_cache(maxsize=128)
+def corrigir_texto(texto, campo):
+    return corrigir_ocr(texto, VOCABULARIOS_CAMPOS[campo])
+
+
+# Posições onde cada padrão de ANCORAS_PADROES pode começar, achadas numa única
+# passada do autômato
+def ancoras_do_texto(texto):
+    por_palavra = LOCALIZADOR.localizar(texto)
+    return {
+        nome: sorted(set(chain.from_iterable(por_palavra[palavra] for palavra in palavras)))
+        for nome, palavras in ANCORAS_PADROES.items()
+    }
+
+
+# O mesmo texto (original ou corrigido) é consultado por vários extratores
+@lru_cache(maxsize=16)
+def localizar_ancoras(texto):
+    return ancoras_do_texto(texto)
+
+
+def buscar_ancorado(padrao, texto, posicoes, fim=None, janela=None):
+    # Primeiro match que começa numa das posições: igual a padrao.search(texto), porque
+    # nenhum match começa fora das âncoras (re.match respeita o \b antes da posição).
+    # `janela` limita até onde cada match pode ir a partir da sua âncora.
+    for posicao in posicoes:
+        if fim is not None and posicao >= fim:
+            return None
+        limite = fim
+        if janela is not None:
+            limite = posicao + janela if fim is None else min(fim, posicao + janela)
+        match = padrao.match(texto, posicao) if limite is None else padrao.match(texto, posicao, limite)
+        if match:
+            return match
+    return None
+
+
+def _por_prioridade(nomes):
+    # Os nomes pedidos separados por grupo, cada grupo na ordem de prioridade
+    grupos = {}
+    for nome in nomes:
+        grupos.setdefault(GRUPO_DO_PADRAO.get(nome, (nome,)), []).append(nome)
+    return [sorted(pedidos, key=grupo.index) for grupo, pedidos in grupos.items()]
+
+
+# Resolve de uma vez os campos pedidos e devolve {nome: primeiro match ou None}.
+# Dentro de cada grupo de GRUPOS_VARREDURA a busca para no primeiro padrão que casar
+# (os de menor prioridade ficam em None); o match de cada padrão buscado é idêntico ao
+# de PADROES[nome].search(texto). Os extratores recebem esse dicionário em vez de
+# buscar cada padrão de novo.
+# Com `orcamento`, cada padrão testa no máximo orcamento.max_ancoras âncoras, dentro
+# da janela do campo, e os padrões que sobrarem quando o prazo acabar ficam em None
+def varrer_campos(texto, nomes=None, orcamento=None):
+    ancoras = localizar_ancoras(texto)
+
+    def buscar(nome):
+        if nome not in ancoras:
+            return PADROES[nome].search(texto)
+        if orcamento is None:
+            return buscar_ancorado(PADROES[nome], texto, ancoras[nome])
+        return buscar_ancorado(PADROES[nome], texto, orcamento.ancoras(ancoras[nome]), janela=orcamento.janela(nome))
+
+    return _varrer(buscar, CAMPOS_VARREDURA if nomes is None else nomes, orcamento)
+
+
+# Mesmo resultado de varrer_campos, mas usando a tabela de linhas: cada match fica
+# restrito às linhas em volta de onde ele começa, em vez de avançar pelo resto da nota
+def varrer_linhas(tabela, nomes=None, depois=JANELA_LINHAS, orcamento=None):
+    ancoras = localizar_ancoras(tabela.texto)
+
+    def buscar(nome):
+        if nome not in ancoras:
+            return buscar_em_linhas(tabela, PADROES[nome], depois)
+        if orcamento is None:
+            return buscar_ancorado_em_linhas(tabela, PADROES[nome], ancoras[nome], depois)
+        return buscar_ancorado_em_linhas(
+            tabela, PADROES[nome], orcamento.ancoras(ancoras[nome]), depois, orcamento.janela(nome)
+        )
+
+    return _varrer(buscar, CAMPOS_VARREDURA if nomes is None else nomes, orcamento)
+
+
+def _varrer(buscar, nomes, orcamento=None):
+    achados = dict.fromkeys(nomes)
+    for grupo in _por_prioridade(nomes):
+        for nome in grupo:
+            if _esgotado(orcamento):
+                return achados
+            achados[nome] = buscar(nome)
+            if achados[nome]:
+                break
+    return achados
+
+
+# Padrões que uma página nova ainda pode mudar: os não encontrados de cada grupo que
+# têm prioridade maior que o melhor já encontrado
+def _pendentes(achados):
+    pendentes = []
+    for grupo in _por_prioridade(achados):
+        for nome in grupo:
+            if achados[nome]:
+                break
+            pendentes.append(nome)
+    return pendentes
+
+
+def buscar_em_linhas(tabela, padrao, depois=JANELA_LINHAS):
+    texto = tabela.texto
+    posicao = 0
+    while posicao <= len(texto):
+        match = padrao.search(texto, posicao)
+        if match is None:
+            return None
+        linha = tabela.indice_da_posicao(match.start())
+        fim = tabela.fim_trecho(linha, linha + 1 + depois)
+        if match.end() <= fim:
+            return match
+        # O match atravessou a janela: busca de novo só dentro dela (endpos corta o
+        # texto ali, então quantificadores como [\d.,]+ param no fim da janela)
+        local = padrao.search(texto, match.start(), fim)
+        if local is not None:
+            return local
+        if linha + 1 >= len(tabela):
+            return None
+        posicao = tabela.inicios[linha + 1]
+    return None
+
+
+# buscar_em_linhas testando o padrão só nas posições das âncoras
+def buscar_ancorado_em_linhas(tabela, padrao, posicoes, depois=JANELA_LINHAS, janela=None):
+    texto = tabela.texto
+    inicio_permitido = 0
+    for i, posicao in enumerate(posicoes):
+        if posicao < inicio_permitido:
+            continue
+        match = buscar_ancorado(padrao, texto, (posicao,), janela=janela)
+        if match is None:
+            continue
+        linha = tabela.indice_da_posicao(posicao)
+        fim = tabela.fim_trecho(linha, linha + 1 + depois)
+        if match.end() <= fim:
+            return match
+        local = buscar_ancorado(padrao, texto, posicoes[i:], fim, janela)
+        if local is not None:
+            return local
+        if linha + 1 >= len(tabela):
+            return None
+        inicio_permitido = tabela.inicios[linha + 1]
+    return None
+
+
+def _primeiro_grupo(achados, nomes):
+    # Respeita a ordem de prioridade dos padrões, não a posição no texto
+    for nome in nomes:
+        match = achados.get(nome)
+        if match:
+            return match.group(1).strip()
+    return None
+
+
+# O NLTK é opcional: a extração dos campos usa só regex, então o pacote (e o corpus
+# de stopwords) só é importado na primeira vez que alguma etapa pedir tokens
+def carregar_nltk():
+    global _nltk
+    if _nltk is None:
+        import nltk
+        for caminho in CAMINHOS_NLTK_DATA:
+            if caminho not in nltk.data.path:
+                nltk.data.path.append(caminho)
+        _nltk = nltk
+    return _nltk
+
+
+@lru_cache(maxsize=1)
+def stopwords_portugues():
+    carregar_nltk()
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words("portuguese"))
+
+
+# Tokens do texto sem as stopwords em português (carrega o NLTK sob demanda)
+def tokens_filtrados(texto):
+    carregar_nltk()
+    from nltk.tokenize import word_tokenize
+    stop_words = stopwords_portugues()
+    return [word for word in word_tokenize(texto) if word.lower() not in stop_words]
+
+
+# Texto com no máximo `limite` caracteres: o começo (cabeçalho: emissor, endereço,
+# CNPJ) e o fim (rodapé: total, pagamento, número, série e data). O que fica de fora é
+# o meio, a lista de itens. Usado na entrada da extração em modo protegido e no texto
+# repassado para a etapa de LLM.
+SEPARADOR_RECORTE = "\n[...]\n"
+# Campos que ficam no rodapé da nota: com a entrada recortada, saem com confiança baixa
+CAMPOS_RODAPE = ("data_emissao", "valor_total", "numero_nota_fiscal", "serie_nota_fiscal", "forma_pgto")
+
+
+def recortar_texto(texto, limite):
+    if len(texto) <= limite:
+        return texto
+    metade = (limite - len(SEPARADOR_RECORTE)) // 2
+    return texto[:metade] + SEPARADOR_RECORTE + texto[len(texto) - metade:]
+
+
+# Chamadas a corrigir_texto até agora (com e sem cache): se o número muda durante um
+# extrator, o fallback de correção de OCR foi usado nele
+def _correcoes_ocr():
+    info = corrigir_texto.cache_info()
+    return info.hits + info.misses
+
+
+# `linhas` é a TabelaLinhas do OCR (opcional): com ela, as buscas ficam restritas às
+# linhas perto de cada campo; sem ela, tudo roda sobre o texto inteiro como antes.
+# `orcamento` (opcional) liga o modo protegido; os limites atingidos ficam nele.
+# `medicoes` (opcional) é um dict que recebe o tempo de cada etapa em "tempos_ms" e os
+# extratores que precisaram do fallback de correção de OCR em "fallbacks".
+def extrair_dados_nota(texto, linhas=None, orcamento=None, medicoes=None):
+    if orcamento is not None and len(texto) > orcamento.max_caracteres:
+        # Entrada grande demais: extrai do começo e do fim, sem a lista de itens do meio
+        # (a tabela de linhas não vale mais)
+        orcamento.registrar("entrada")
+        texto = recortar_texto(texto, orcamento.max_caracteres)
+        linhas = None
+    inicio = time.perf_counter()
+    achados = varrer_campos(texto, orcamento=orcamento) if linhas is None else varrer_linhas(linhas, orcamento=orcamento)
+    meio = time.perf_counter()
+    endereco = "None" if _esgotado(orcamento) else extrair_endereco(texto, linhas, orcamento)
+    if medicoes is not None:
+        tempos = medicoes.setdefault("tempos_ms", {})
+        tempos["varredura"] = (meio - inicio) * 1000
+        tempos["extrair_endereco"] = (time.perf_counter() - meio) * 1000
+    return montar_dados(texto, achados, endereco, orcamento, medicoes)
+
+
+# Aplica as regras de cada campo sobre os matches já encontrados (com os fallbacks de
+# correção de OCR sobre o texto inteiro quando algum padrão não apareceu). Com
+# orçamento, os campos que começariam depois do prazo ficam como "None".
+def montar_dados(texto, achados, endereco, orcamento=None, medicoes=None):
+    def campo(extrator, *args, vazio="None"):
+        if _esgotado(orcamento):
+            return vazio
+        if medicoes is None:
+            return extrator(texto, *args, orcamento=orcamento)
+        correcoes = _correcoes_ocr()
+        inicio = time.perf_counter()
+        resultado = extrator(texto, *args, orcamento=orcamento)
+        medicoes.setdefault("tempos_ms", {})[extrator.__name__] = (time.perf_counter() - inicio) * 1000
+        if _correcoes_ocr() != correcoes:
+            medicoes.setdefault("fallbacks", []).append(extrator.__name__)
+        return resultado
+
+    cnpj_emissor, cpf_consumidor, data_emissao = campo(extrair_regex, achados, vazio=("None", "None", "None"))
+    nome_emissor = campo(extrair_nome_emissor)
+    numero_nota = campo(extrair_numero_nota, achados)
+    serie = campo(extrair_serie, achados)
+    valor_total = campo(extrair_valor_total, achados)
+    forma_pgto = campo(extrair_forma_pagamento, achados)
     return {
         "nome_emissor": nome_emissor,
         "CNPJ_emissor": cnpj_emissor,
@@ -27,21 +477,49 @@ def extrair_dados_nota(texto):
     }
 
 
-def extrair_regex(texto):
-    padrao_cnpj = r"\b\d{2}[\._]?\d{3}[\._]?\d{3}[/\\]?\d{4}-?\d{2}\b"
-    padrao_cpf = r"\b\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b|\b\d{11}\b"
-    padrao_data = r"\b\d{2}/\d{2}/\d{4}\b"
+# Extração de um documento que chega em páginas (OCR assíncrono de PDFs e notas
+# longas): cada página é varrida assim que chega, só atrás dos padrões que ainda podem
+# mudar algum campo. Como vale sempre o primeiro match de cada padrão, o resultado é o mesmo
+# de extrair_dados_nota sobre o documento inteiro (a não ser por campos que
+# atravessariam a quebra de página).
+class ExtracaoIncremental:
+    def __init__(self, orcamento=None):
+        self.textos = []
+        self.achados = dict.fromkeys(CAMPOS_VARREDURA)
+        self.endereco = "None"
+        self.orcamento = orcamento
+
+    def adicionar_pagina(self, texto, linhas=None):
+        pendentes = _pendentes(self.achados)
+        if pendentes:
+            if linhas is None:
+                novos = varrer_campos(texto, pendentes, self.orcamento)
+            else:
+                novos = varrer_linhas(linhas, pendentes, orcamento=self.orcamento)
+            self.achados.update((nome, match) for nome, match in novos.items() if match)
+        if self.endereco == "None" and not _esgotado(self.orcamento):
+            self.endereco = extrair_endereco(texto, linhas, self.orcamento)
+        self.textos.append(texto)
+
+    def finalizar(self):
+        return montar_dados(" ".join(self.textos), self.achados, self.endereco, self.orcamento)
+
 
-    cnpj_match = re.search(padrao_cnpj, texto)
-    cpf_match = re.search(padrao_cpf, texto)
-    data_match = re.search(padrao_data, texto)
+def extrair_regex(texto, achados=None, orcamento=None):
+    if achados is None:
+        achados = varrer_campos(texto, CAMPOS_REGEX, orcamento)
+    cnpj_match = achados["cnpj"]
+    cpf_match = achados["cpf"]
+    data_match = achados["data"]
 
     # fallback com fuzzy se falhar
-    if not cnpj_match or not cpf_match or not data_match:
-        texto_corrigido = fuzzy_search_simples(texto, ["cnpj", "cpf", "data"])
-        cnpj_match = cnpj_match or re.search(padrao_cnpj, texto_corrigido)
-        cpf_match = cpf_match or re.search(padrao_cpf, texto_corrigido)
-        data_match = data_match or re.search(padrao_data, texto_corrigido)
+    if (not cnpj_match or not cpf_match or not data_match) and not _esgotado(orcamento):
+        texto_corrigido = corrigir_texto(texto, "regex")[0]
+        faltantes = [nome for nome in CAMPOS_REGEX if not achados[nome]]
+        corrigidos = varrer_campos(texto_corrigido, faltantes, orcamento)
+        cnpj_match = cnpj_match or corrigidos.get("cnpj")
+        cpf_match = cpf_match or corrigidos.get("cpf")
+        data_match = data_match or corrigidos.get("data")
 
     cnpj = cnpj_match.group(0) if cnpj_match else "None"
     cpf = cpf_match.group(0) if cpf_match else "None"
@@ -49,152 +527,454 @@ def extrair_regex(texto):
 
     return (cnpj, cpf, data)
 
-def extrair_nome_emissor(texto):
-        # Corrige erros comuns de OCR em "CNPJ"
-    texto_corrigido = fuzzy_search_simples(texto, "cnpj")
-    
-    # Procura o CNPJ no texto (aceitando variações de formatação)
-    match_cnpj = re.search(r"\bCNPJ[:\s]*\d{2}\.?\d{3}\.?\d{3}[\/\\]?\d{4}-?\d{2}", texto_corrigido, re.IGNORECASE)
-    address_keywords = r"\b(?:RUA|R\.|AV(?:\.|ENIDA)?|AL(?:\.|AMEDA)?|(?:PRA[ÇC]A|PÇA\.?)|ROD(?:\.|OVIA)?|(?:TRAVESSA|TV\.?)|VL(?:\.|ILA)?|EST(?:\.|RADA)?|LG(?:\.|ARGO)?|QUADRA|KM|CEP|CHACARAS|JARDIM|AVE|VIA|IE)\b"
+def extrair_nome_emissor(texto, orcamento=None):
+    # Procura o CNPJ no texto (aceitando variações de formatação); só usa o texto
+    # corrigido (erros comuns de OCR em "CNPJ") quando o original não tem o rótulo
+    texto_corrigido = texto
+    match_cnpj = _buscar_cnpj_rotulado(texto, orcamento)
+    if not match_cnpj and not _esgotado(orcamento):
+        texto_corrigido = corrigir_texto(texto, "nome_emissor")[0]
+        match_cnpj = _buscar_cnpj_rotulado(texto_corrigido, orcamento)
 
     if match_cnpj:
         pos_cnpj = match_cnpj.start()
         candidate_pre = texto_corrigido[:pos_cnpj].strip()
-        
-        # Lista de palavras que indicam início de endereço
-        match_keyword = re.search(address_keywords, candidate_pre, re.IGNORECASE)
+        # Posição do trecho antes do CNPJ dentro do texto (o strip só tira espaços)
+        inicio_pre = texto_corrigido.find(candidate_pre, 0, pos_cnpj) if candidate_pre else pos_cnpj
+        fim_pre = inicio_pre + len(candidate_pre)
+        if orcamento is not None and fim_pre - inicio_pre > orcamento.janela("nome_emissor"):
+            # Cabeçalho longo demais antes do CNPJ: o nome é procurado só no começo dele
+            orcamento.registrar("janela")
+            fim_pre = inicio_pre + orcamento.janela("nome_emissor")
+            candidate_pre = texto_corrigido[inicio_pre:fim_pre].strip()
+
+        # Primeira palavra que indica início de endereço, só dentro desse trecho
+        posicoes = localizar_ancoras(texto_corrigido)["endereco_nome"]
+        match_keyword = buscar_ancorado(
+            REGEX_ENDERECO_NOME, texto_corrigido, posicoes[bisect_left(posicoes, inicio_pre):], fim_pre
+        )
         if match_keyword:
-            candidate_name = candidate_pre[:match_keyword.start()].strip()
+            candidate_name = texto_corrigido[inicio_pre:match_keyword.start()].strip()
         else:
             candidate_name = candidate_pre
-        
+
         # Se o resultado estiver vazio ou for muito curto, tenta separar pelo delimitador " - "
         if not candidate_name or len(candidate_name.split()) < 2:
             candidate_name = candidate_pre.split(" - ")[0].strip()
         return candidate_name
     else:
-        min_index = None
-        for keyword in address_keywords:
-            pos = texto.find(keyword)
-            if pos != -1:
-                if min_index is None or pos < min_index:
-                    min_index = pos
-                    
-        if min_index is not None:
+        # Sem CNPJ rotulado: o nome é o que vem antes da primeira palavra de endereço
+        posicoes = localizar_ancoras(texto)["endereco_nome"]
+        if orcamento is not None:
+            posicoes = orcamento.ancoras(posicoes)
+        match_keyword = buscar_ancorado(REGEX_ENDERECO_NOME, texto, posicoes)
+
+        if match_keyword:
             # Corta o texto até a primeira ocorrência de uma palavra-chave
-            endereco_emissor = texto[:min_index].strip()
-        else:   
+            endereco_emissor = texto[:match_keyword.start()].strip()
+        else:
             # Fallback para a primeira linha, se nenhuma palavra-chave for encontrada
-            endereco_emissor = texto.splitlines()[0].strip()
-    
+            linhas = texto.splitlines()
+            endereco_emissor = linhas[0].strip() if linhas else "None"
+
     return endereco_emissor
 
 
+def _buscar_cnpj_rotulado(texto, orcamento=None):
+    posicoes = localizar_ancoras(texto)["cnpj_rotulado"]
+    if orcamento is None:
+        return buscar_ancorado(REGEX_CNPJ_ROTULADO, texto, posicoes)
+    return buscar_ancorado(
+        REGEX_CNPJ_ROTULADO, texto, orcamento.ancoras(posicoes), janela=orcamento.janela("cnpj_rotulado")
+    )
+
 
 
 
-def extrair_endereco(texto):
+def extrair_endereco(texto, linhas=None, orcamento=None):
+    if linhas is not None:
+        return extrair_endereco_linhas(linhas, orcamento=orcamento)
+
     # Corrige possíveis erros de OCR em termos de endereço
-    texto_corrigido = fuzzy_search_simples(texto, [
-        "rua", "avenida", "travessa", "alameda", "quadra", "cep", "chacaras"
-    ])
-    
-    # Define a parte inicial do endereço (palavra-chave)
-    address_keywords = r"\b(?:RUA|R\.|AV(?:\.|ENIDA)?|AL(?:\.|AMEDA)?|(?:PRA[ÇC]A|PÇA\.?)|ROD(?:\.|OVIA)?|(?:TRAVESSA|TV\.?)|VL(?:\.|ILA)?|EST(?:\.|RADA)?|LG(?:\.|ARGO)?|QUADRA|KM|CEP|CHACARAS|JARDIM|AVE|VIA)\b"
-    # Define as palavras que indicam onde o endereço deve parar
-    stop_keywords = r"(?:\b(?:CNPJ|IE|CPF|TELEFONE|FONE|DANFE|DOCUMENTO|VALOR|FORMA\s+PAGAMENTO|NFC-e|CONSUMIDOR|CHAVE)\b)"
-    
-    # A regex utiliza negative lookahead para capturar até antes do stop_keywords
-    pattern = address_keywords + r"(?:(?!\s*" + stop_keywords + r").)+"
-    
-    match = re.search(pattern, texto_corrigido, re.IGNORECASE)
-    if match:
-        address = match.group(0).strip()
+    texto_corrigido = corrigir_texto(texto, "endereco")[0]
+
+    address = buscar_endereco(texto_corrigido, localizar_ancoras(texto_corrigido), orcamento)
+    if address:
         return address
     else:
         return "None"
 
 
+# Primeiro endereço do texto: o mesmo que REGEX_ENDERECO.search(texto), testado só nas
+# âncoras de endereço e com o fim calculado por casar_endereco
+def buscar_endereco(texto, ancoras, orcamento=None):
+    posicoes = ancoras["endereco"]
+    if orcamento is not None:
+        posicoes = orcamento.ancoras(posicoes)
+    for posicao in posicoes:
+        limite = None if orcamento is None else posicao + orcamento.janela("endereco")
+        endereco = casar_endereco(texto, posicao, ancoras["parada_endereco"], limite)
+        if endereco:
+            return endereco.strip()
+    return None
 
-def extrair_valor_total(texto):
-    padroes_iniciais = [
-        r"valor\s+total\s+r\$?\s*([\d.,]+)",
-        r"valor\s+total\s*([\d.,]+)",
-        r"total\s+r\$?\s*([\d.,]+)"
-    ]
 
-    for padrao in padroes_iniciais:
-        match = re.search(padrao, texto, re.IGNORECASE)
-        if match:
-            return match.group(1).strip()
+# Mesmo trecho que REGEX_ENDERECO.match(texto, posicao, limite) devolveria, em tempo
+# linear: o corpo do endereço vai até a quebra de linha ou até os espaços antes da
+# primeira palavra de parada (posições em `paradas`, vindas do localizador de âncoras)
+def casar_endereco(texto, posicao, paradas, limite=None):
+    palavra = REGEX_PALAVRA_ENDERECO.match(texto, posicao)
+    if palavra is None:
+        return None
+    inicio = palavra.end()
+    fim = texto.find("\n", inicio)
+    if fim == -1:
+        fim = len(texto)
+    # O \s* do lookahead atravessa linhas: uma palavra de parada logo depois de linhas
+    # em branco ainda conta
+    proximo = REGEX_NAO_ESPACO.search(texto, fim)
+    alcance = proximo.start() if proximo else len(texto)
+    fim_parada = None
+    for parada in paradas[bisect_left(paradas, inicio):]:
+        if parada > alcance:
+            break
+        match_parada = REGEX_PARADA_ENDERECO.match(texto, parada)
+        if match_parada:
+            fim_parada = match_parada.end()
+            while parada > inicio and texto[parada - 1].isspace():
+                parada -= 1
+            fim = min(fim, parada)
+            break
+    if limite is not None:
+        fim = min(fim, limite)
+    if fim > inicio:
+        return texto[posicao:fim]
+    # Corpo vazio com a variante mais longa da palavra (ex.: "AV." colado na parada): a
+    # regex original ainda tentaria as variantes mais curtas. O trecho até o fim da
+    # palavra de parada é curto, então ela roda ali mesmo.
+    fim_regex = fim_parada or fim
+    if limite is not None:
+        fim_regex = min(fim_regex, limite)
+    match = REGEX_ENDERECO.match(texto, posicao, fim_regex)
+    return match.group(0) if match else None
 
-    # Se nada for encontrado, corrige palavras com fuzzy (agora incluindo apenas "total")
-    termos_fuzzy = ["valor total", "valor total r$", "total r$", "total"]
-    texto_corrigido = fuzzy_search_simples(texto, termos_fuzzy,distancia_max=2)
 
-    for padrao in padroes_iniciais + [r"total\s*([\d.,]+)"]:
-        match = re.search(padrao, texto_corrigido, re.IGNORECASE)
-        if match:
-            return match.group(1).strip()
 
+# O endereço fica no cabeçalho: corrige e confere linha a linha, de cima para baixo,
+# e só roda a regex de endereço (com lookahead por caractere) na janela da primeira
+# linha que tem uma palavra de endereço. O resto da nota nem chega a ser corrigido, e
+# as linhas de cabeçalho que se repetem entre notas (nome, endereço) saem do cache.
+def extrair_endereco_linhas(linhas, depois=JANELA_LINHAS, orcamento=None):
+    for i in range(len(linhas)):
+        if _esgotado(orcamento):
+            break
+        if not REGEX_PALAVRA_ENDERECO.search(corrigir_texto(linhas.linha(i), "endereco")[0]):
+            continue
+        janela = corrigir_texto(linhas.trecho(i, i + 1 + depois), "endereco")[0]
+        endereco = buscar_endereco(janela, ancoras_do_texto(janela), orcamento)
+        if endereco:
+            return endereco
     return "None"
 
 
-def extrair_serie(texto):
-    padroes = [
-        r"(?:S[ée]rie|Serie|ECF)[:\s\-]*?(\d{1,3})"
-    ]
-    
-    for padrao in padroes:
-        match = re.search(padrao, texto, re.IGNORECASE)
-        if match:
-            return match.group(1).strip()
+def extrair_valor_total(texto, achados=None, orcamento=None):
+    if achados is None:
+        achados = varrer_campos(texto, PADROES_VALOR_TOTAL, orcamento)
+    valor = _primeiro_grupo(achados, PADROES_VALOR_TOTAL)
+    if valor is not None:
+        return valor
+
+    # Se nada for encontrado, usa o texto com as palavras corrigidas pelo fuzzy
+    if _esgotado(orcamento):
+        return "None"
+    texto_corrigido = corrigir_texto(texto, "valor_total")[0]
+
+    padroes_fallback = PADROES_VALOR_TOTAL + ("total",)
+    valor = _primeiro_grupo(varrer_campos(texto_corrigido, padroes_fallback, orcamento), padroes_fallback)
+    if valor is not None:
+        return valor
+
+    return "None"
+
+
+def extrair_serie(texto, achados=None, orcamento=None):
+    if achados is None:
+        achados = varrer_campos(texto, PADROES_SERIE, orcamento)
+    serie = _primeiro_grupo(achados, PADROES_SERIE)
+    if serie is not None:
+        return serie
 
     # Fallback com fuzzy_search
-    texto_corrigido = fuzzy_search_simples(texto, ["serie", "série", "ecf"],distancia_max=2)
-    for padrao in padroes:
-        match = re.search(padrao, texto_corrigido, re.IGNORECASE)
-        if match:
-            return match.group(1).strip()
+    if _esgotado(orcamento):
+        return "None"
+    texto_corrigido = corrigir_texto(texto, "serie")[0]
+    serie = _primeiro_grupo(varrer_campos(texto_corrigido, PADROES_SERIE, orcamento), PADROES_SERIE)
+    if serie is not None:
+        return serie
 
     return "None"
 
 
 
-def extrair_numero_nota(texto):
-    padroes = [
-        r"(?:extrato\s+n[ºo.°]*|nfc[-–]?[eE]?)\s*[:\-]?\s*(\d{4,})",
-        r"(?:NF[\-–]?E|NME)[^0-9]{0,5}(\d{6,})",
-        r"(?:Nº|No|Número|COO|CCF|Extrato\s+N)[:\s]*(\d{4,})",
-    ]
-    for padrao in padroes:
-        match = re.search(padrao, texto, re.IGNORECASE)
-        if match:
-            return match.group(1).strip()
-    texto_corrigido = fuzzy_search_simples(texto, ["nfe", "nf-e", "número", "coo", "ccf", "extrato", "nfc-e"])
-    for padrao in padroes:
-        match = re.search(padrao, texto_corrigido, re.IGNORECASE)
-        if match:
-            return match.group(1).strip()
+def extrair_numero_nota(texto, achados=None, orcamento=None):
+    if achados is None:
+        achados = varrer_campos(texto, PADROES_NUMERO_NOTA, orcamento)
+    numero = _primeiro_grupo(achados, PADROES_NUMERO_NOTA)
+    if numero is not None:
+        return numero
+    if _esgotado(orcamento):
+        return "None"
+    texto_corrigido = corrigir_texto(texto, "numero_nota")[0]
+    numero = _primeiro_grupo(varrer_campos(texto_corrigido, PADROES_NUMERO_NOTA, orcamento), PADROES_NUMERO_NOTA)
+    if numero is not None:
+        return numero
     return "None"
 
-def extrair_forma_pagamento(texto):
-    texto_lower = texto.lower()
-    padroes = {
-        "PIX": [r"pix"],
-        "DINHEIRO": [r"dinheiro"],
-        "CRÉDITO": [r"cart[aã]o\s+(de\s+)?cr[eé]dito", r"\bcr[eé]dito\b"],
-        "DÉBITO": [r"cart[aã]o\s+(de\s+)?d[eé]bito", r"\bd[eé]bito\b"],
-        "CARTÃO": [r"\bcart[aã]o\b"],
-    }
-    for forma, expressoes in padroes.items():
-        for expr in expressoes:
-            if re.search(expr, texto_lower, re.IGNORECASE):
+def _forma_encontrada(achados):
+    for forma, nomes in PADROES_FORMA_PGTO.items():
+        for nome in nomes:
+            if achados.get(nome):
                 return forma
-    texto_corrigido = fuzzy_search_simples(texto, ["pix", "dinheiro", "credito", "crédito", "debito", "débito", "cartao", "cartão"])
-    texto_lower = texto_corrigido.lower()
-    for forma, expressoes in padroes.items():
-        for expr in expressoes:
-            if re.search(expr, texto_lower, re.IGNORECASE):
-                return forma
-    return "None"
\ No newline at end of file
+    return None
+
+def extrair_forma_pagamento(texto, achados=None, orcamento=None):
+    if achados is None:
+        achados = varrer_campos(texto, PADROES_PGTO, orcamento)
+    forma = _forma_encontrada(achados)
+    if forma is not None:
+        return forma
+    if _esgotado(orcamento):
+        return "None"
+    texto_corrigido = corrigir_texto(texto, "forma_pgto")[0]
+    forma = _forma_encontrada(varrer_campos(texto_corrigido, PADROES_PGTO, orcamento))
+    if forma is not None:
+        return forma
+    return "None"
+
+
+
+# ---------------------------------------------------------------------------
+# Confiança por campo (usada pela etapa de LLM para decidir o que revisar)
+# ---------------------------------------------------------------------------
+
+# Níveis de confiança: formato validado (ex.: dígitos verificadores), valor plausível
+# mas sem como validar, e ausente/inválido
+CONFIANCA_VALIDADO = 1.0
+CONFIANCA_PLAUSIVEL = 0.5
+CONFIANCA_BAIXA = 0.0
+
+FORMAS_PGTO_VALIDAS = set(PADROES_FORMA_PGTO)
+REGEX_VALOR = re.compile(r"^(?:\d{1,3}(?:\.\d{3})+|\d+),\d{2}$|^\d+\.\d{2}$")
+REGEX_DATA = re.compile(r"^(\d{2})/(\d{2})/(\d{4})$")
+# Endereços maiores que isso quase sempre "vazaram" para os campos seguintes
+TAMANHO_MAXIMO_ENDERECO = 120
+
+
+def _digitos(valor):
+    return re.sub(r"\D", "", valor or "")
+
+
+def _digito_verificador(numeros, pesos):
+    resto = sum(int(n) * p for n, p in zip(numeros, pesos)) % 11
+    return "0" if resto < 2 else str(11 - resto)
+
+
+def validar_cnpj(valor):
+    digitos = _digitos(valor)
+    if len(digitos) != 14 or digitos == digitos[0] * 14:
+        return False
+    pesos = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+    primeiro = _digito_verificador(digitos[:12], pesos)
+    segundo = _digito_verificador(digitos[:12] + primeiro, [6] + pesos)
+    return digitos[12:] == primeiro + segundo
+
+
+def validar_cpf(valor):
+    digitos = _digitos(valor)
+    if len(digitos) != 11 or digitos == digitos[0] * 11:
+        return False
+    primeiro = _digito_verificador(digitos[:9], range(10, 1, -1))
+    segundo = _digito_verificador(digitos[:9] + primeiro, range(11, 1, -1))
+    return digitos[9:] == primeiro + segundo
+
+
+def validar_data(valor):
+    match = REGEX_DATA.match(valor or "")
+    if not match:
+        return False
+    try:
+        data = datetime.strptime(valor, "%d/%m/%Y").date()
+    except ValueError:
+        return False
+    # Notas com data no futuro (ou muito antigas) são erro de OCR
+    return date(2000, 1, 1) <= data <= date.today()
+
+
+def validar_valor(valor):
+    if not REGEX_VALOR.match(valor or ""):
+        return False
+    return float(valor.replace(".", "").replace(",", ".") if "," in valor else valor) > 0
+
+
+# Confiança de cada campo devolvido por extrair_dados_nota. Com o orçamento da extração,
+# uma entrada recortada deixa os campos do rodapé com confiança baixa (a LLM revisa).
+def avaliar_confianca(dados, orcamento=None):
+    def presente(campo):
+        valor = dados.get(campo)
+        return bool(valor) and valor != "None"
+
+    def por_validacao(campo, validador):
+        if not presente(campo):
+            return CONFIANCA_BAIXA
+        return CONFIANCA_VALIDADO if validador(dados[campo]) else CONFIANCA_BAIXA
+
+    confianca = {
+        "CNPJ_emissor": por_validacao("CNPJ_emissor", validar_cnpj),
+        "data_emissao": por_validacao("data_emissao", validar_data),
+        "valor_total": por_validacao("valor_total", validar_valor),
+        "numero_nota_fiscal": por_validacao("numero_nota_fiscal", str.isdigit),
+        "serie_nota_fiscal": por_validacao("serie_nota_fiscal", lambda v: v.isdigit() and len(v) <= 3),
+        "forma_pgto": por_validacao("forma_pgto", FORMAS_PGTO_VALIDAS.__contains__),
+    }
+
+    # Consumidor é opcional: ausente é aceito, mas um documento presente tem que ser válido
+    consumidor = dados.get("CNPJ_CPF_consumidor")
+    if not presente("CNPJ_CPF_consumidor"):
+        confianca["CNPJ_CPF_consumidor"] = CONFIANCA_VALIDADO
+    elif validar_cpf(consumidor) or validar_cnpj(consumidor):
+        confianca["CNPJ_CPF_consumidor"] = CONFIANCA_VALIDADO
+    else:
+        confianca["CNPJ_CPF_consumidor"] = CONFIANCA_BAIXA
+
+    # Nome e endereço não têm formato verificável: só conferimos se parecem texto
+    nome = dados.get("nome_emissor") or ""
+    confianca["nome_emissor"] = (
+        CONFIANCA_PLAUSIVEL if presente("nome_emissor") and re.search(r"[A-Za-zÀ-ÿ]{2}", nome) else CONFIANCA_BAIXA
+    )
+    endereco = dados.get("endereco_emissor") or ""
+    confianca["endereco_emissor"] = (
+        CONFIANCA_PLAUSIVEL if presente("endereco_emissor") and len(endereco) <= TAMANHO_MAXIMO_ENDERECO else CONFIANCA_BAIXA
+    )
+    if orcamento is not None and "entrada" in orcamento.estouros:
+        for campo in CAMPOS_RODAPE:
+            confianca[campo] = CONFIANCA_BAIXA
+    return confianca
+
+
+# ---------------------------------------------------------------------------
+# Processamento em lote (reprocessamento de textos OCR já armazenados)
+# ---------------------------------------------------------------------------
+
+# Extrai os dados de vários textos e devolve os resultados um a um, na mesma ordem
+# da entrada. Com processos > 1 usa um pool de processos; a entrada é consumida em
+# janelas, então um gerador enorme (ex.: um JSONL de meses) não é lido todo na memória.
+def extrair_lote(textos, processos=None, tamanho_bloco=32):
+    if not processos or processos <= 1:
+        for texto in textos:
+            yield extrair_dados_nota(texto)
+        return
+    yield from _mapear_em_processos(extrair_dados_nota, textos, processos, tamanho_bloco)
+
+
+# Lê um JSONL de textos OCR. Cada linha pode ser um objeto com o campo "text" (o mesmo
+# formato do body que a extrai-texto devolve) ou uma string JSON com o texto puro.
+def ler_jsonl(linhas):
+    for numero, linha in enumerate(linhas, start=1):
+        linha = linha.strip()
+        if not linha:
+            continue
+        try:
+            registro = json.loads(linha)
+        except json.JSONDecodeError as e:
+            yield {"linha": numero, "erro": f"JSON inválido: {e}"}
+            continue
+        if isinstance(registro, str):
+            registro = {"text": registro}
+        if not isinstance(registro, dict) or not isinstance(registro.get("text"), str):
+            yield {"linha": numero, "erro": "Registro sem campo 'text'"}
+            continue
+        registro["linha"] = numero
+        yield registro
+
+
+# Versão de extrair_dados_nota que não derruba o lote: um texto problemático vira
+# um resultado com "erro" em vez de interromper o processamento dos demais
+def _extrair_registro(texto):
+    try:
+        return {"dados": extrair_dados_nota(texto)}
+    except Exception as e:
+        return {"erro": str(e)}
+
+
+# Processa um stream JSONL e gera um resultado por registro, mantendo os campos de
+# identificação (ex.: "key") e trocando o "text" pelos dados extraídos
+def extrair_jsonl(linhas, processos=None, tamanho_bloco=32):
+    # Fila com (registro, valido) na ordem de leitura; os inválidos não passam pela
+    # extração, mas saem na posição em que apareceram
+    pendentes = deque()
+
+    def validos():
+        for registro in ler_jsonl(linhas):
+            valido = "text" in registro
+            pendentes.append((registro, valido))
+            if valido:
+                yield registro.pop("text")
+
+    if not processos or processos <= 1:
+        resultados = map(_extrair_registro, validos())
+    else:
+        resultados = _mapear_em_processos(_extrair_registro, validos(), processos, tamanho_bloco)
+
+    for resultado in resultados:
+        # Registros inválidos lidos antes deste resultado saem primeiro, na ordem
+        registro, valido = pendentes.popleft()
+        while not valido:
+            yield registro
+            registro, valido = pendentes.popleft()
+        registro.update(resultado)
+        yield registro
+    for registro, _ in pendentes:
+        yield registro
+
+
+# executor.map submete a entrada inteira de uma vez; aqui ela vai em janelas para
+# manter a memória limitada em lotes grandes
+def _mapear_em_processos(funcao, itens, processos, tamanho_bloco):
+    iterador = iter(itens)
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        while True:
+            janela = list(islice(iterador, processos * tamanho_bloco * 4))
+            if not janela:
+                break
+            yield from executor.map(funcao, janela, chunksize=tamanho_bloco)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reprocessa textos OCR (JSONL) com as regras atuais de extração."
+    )
+    parser.add_argument("entrada", help="Arquivo JSONL com os textos ('-' para stdin)")
+    parser.add_argument("-o", "--saida", default="-", help="Arquivo JSONL de saída ('-' para stdout)")
+    parser.add_argument("-p", "--processos", type=int, default=1, help="Número de processos (padrão: 1)")
+    parser.add_argument("--tamanho-bloco", type=int, default=32, help="Textos enviados por vez a cada processo")
+    args = parser.parse_args(argv)
+
+    entrada = sys.stdin if args.entrada == "-" else open(args.entrada, encoding="utf-8")
+    saida = sys.stdout if args.saida == "-" else open(args.saida, "w", encoding="utf-8")
+    total = erros = 0
+    try:
+        for resultado in extrair_jsonl(entrada, args.processos, args.tamanho_bloco):
+            saida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+            total += 1
+            erros += "erro" in resultado
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if saida is not sys.stdout:
+            saida.close()
+    print(f"{total} registros processados ({erros} com erro)", file=sys.stderr)
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,115 @@
+import time
+
+# Marca o início da carga do módulo (cold start) antes de qualquer outro import
+_INICIO_CARGA = time.perf_counter()
+
 import sys
 import os
 import json
 import logging
-import nltk
-from nltk.corpus import stopwords
 
-from extracao import extrair_dados_nota
+import extracao
+from extracao import extrair_dados_nota, avaliar_confianca
+from linhas import TabelaLinhas
+from artefatos_ocr import baixar_artefato
+from clientes_aws import preguicoso
+from metricas import instrumentado, metricas
 
 LAYER_SITE_PACKAGES = "/opt/python/lib/python3.10/site-packages"
 LAYER_NLTK_DATA = os.path.join(LAYER_SITE_PACKAGES, "nltk_data")
 
 if LAYER_SITE_PACKAGES not in sys.path:
     sys.path.append(LAYER_SITE_PACKAGES)
-if LAYER_NLTK_DATA not in nltk.data.path:
-    nltk.data.path.append(LAYER_NLTK_DATA)
+# O NLTK não é importado aqui: a extração não usa tokens, então ele só é carregado
+# (já com o nltk_data da layer no caminho) se alguma etapa chamar extracao.carregar_nltk
+if LAYER_NLTK_DATA not in extracao.CAMINHOS_NLTK_DATA:
+    extracao.CAMINHOS_NLTK_DATA.append(LAYER_NLTK_DATA)
+
+# Quanto do texto OCR segue para a etapa de LLM (só é usado nos campos com baixa
+# confiança); notas maiores vão com o começo e o fim (extracao.recortar_texto)
+LIMITE_TEXTO_LLM = 20000
+# Modo protegido da extração (prazo por documento, janelas e limites de entrada; ver
+# extracao.Orcamento). Ligado por padrão para um texto OCR anômalo não estourar o
+# timeout da Lambda.
+EXTRACAO_PROTEGIDA = os.environ.get("EXTRACAO_PROTEGIDA", "true").lower() in ("1", "true", "sim")
+
+# Só usado quando a extrai-texto manda o resultado do OCR por referência (artefato no S3)
+s3_client = preguicoso("s3")
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-try:
-    _ = stopwords.words("portuguese")
-    logger.info("Stopwords carregadas")
-except Exception as e:
-    logger.error("Erro ao carregar stopwords: %s", str(e))
+# Tempo gasto carregando o módulo; reportado junto com o tempo do primeiro handler
+TEMPO_CARGA_MS = (time.perf_counter() - _INICIO_CARGA) * 1000
+_cold_start = True
 
 
+@instrumentado("extrai-dados")
 def lambda_handler(event, context):
-    logger.info("Evento recebido: %s", json.dumps(event))
+    global _cold_start
+    inicio_handler = time.perf_counter()
+    if _cold_start:
+        metricas.registrar("carga_modulo_ms", TEMPO_CARGA_MS)
     try:
+        return _processar(event)
+    finally:
+        tempo_handler_ms = (time.perf_counter() - inicio_handler) * 1000
+        logger.info(
+            "⏱️ Tempos: carga do módulo %.1f ms | handler %.1f ms | cold start: %s",
+            TEMPO_CARGA_MS if _cold_start else 0.0, tempo_handler_ms, _cold_start
+        )
+        _cold_start = False
+
+
+def tabela_linhas(texto, colunas):
+    # Payloads sem "linhas" (ou de outra versão da extrai-texto) seguem pelo texto inteiro
+    if not colunas:
+        return None
+    try:
+        return TabelaLinhas.de_colunas(texto, colunas)
+    except (KeyError, TypeError, ValueError, OverflowError) as e:
+        logger.warning("⚠️ Tabela de linhas ignorada: %s", str(e))
+        return None
+
+
+def registrar_medicoes(medicoes, orcamento=None):
+    # Tempo de cada etapa da extração (varredura, extrair_*) e quais usaram o fallback
+    # de correção de OCR, como métricas da invocação
+    for etapa, tempo_ms in medicoes.get("tempos_ms", {}).items():
+        metricas.registrar(f"{etapa}_ms", tempo_ms)
+    fallbacks = medicoes.get("fallbacks", [])
+    metricas.contar("fallback_ocr", len(fallbacks))
+    if fallbacks:
+        metricas.propriedade("fallbacks", fallbacks)
+    if orcamento is not None:
+        for limite in orcamento.estouros:
+            metricas.contar(f"orcamento_{limite}")
+
+
+def ler_referencia(corpo):
+    # Resultado do OCR grande demais para o payload da Step Function: o texto e as
+    # linhas vêm do artefato gravado pela extrai-texto
+    with metricas.cronometro("s3_artefato_ms"):
+        artefato = baixar_artefato(s3_client, corpo["bucket"], corpo["artefato"])
+    return artefato["text"], artefato.get("linhas")
+
+
+def _processar(event):
+    # O evento (amostrado e com tamanho máximo) é registrado por @instrumentado
+    try:
+        colunas = None
         body = event.get("body")
         if body:
             # Se o body for uma string JSON, tenta carregar
             if isinstance(body, str):
                 try:
                     parsed = json.loads(body)
-                    if isinstance(parsed, dict) and "text" in parsed:
+                    if isinstance(parsed, dict) and "artefato" in parsed:
+                        texto, colunas = ler_referencia(parsed)
+                        origem = "Artefato do OCR no S3"
+                    elif isinstance(parsed, dict) and "text" in parsed:
                         texto = parsed["text"]
+                        colunas = parsed.get("linhas")
                         origem = "Texto no campo 'text' dentro do JSON"
                     else:
                         texto = body.strip('"')  # texto puro (sem campo "text")
@@ -45,20 +119,44 @@ def lambda_handler(event, context):
                     origem = "Texto bruto simples"
             elif isinstance(body, dict) and "text" in body:
                 texto = body["text"]
+                colunas = body.get("linhas")
                 origem = "Texto no campo 'text' (dict direto)"
             else:
                 raise ValueError("Formato do corpo não reconhecido")
         else:
             raise ValueError("Evento sem corpo")
 
-        logger.info("Texto extraído (%s):\n%s", origem, texto)
-        dados_extraidos = extrair_dados_nota(texto)
+        # O texto inteiro só vai para o log em nível DEBUG
+        logger.info("Texto extraído (%s): %d caracteres", origem, len(texto))
+        logger.debug("Texto extraído:\n%s", texto)
+        metricas.registrar("texto_caracteres", len(texto), "Count")
+        orcamento = extracao.Orcamento() if EXTRACAO_PROTEGIDA else None
+        medicoes = {}
+        with metricas.cronometro("extracao_ms"):
+            dados_extraidos = extrair_dados_nota(texto, tabela_linhas(texto, colunas), orcamento, medicoes)
+        registrar_medicoes(medicoes, orcamento)
+        if orcamento is not None and orcamento.estouros:
+            logger.warning(
+                "⚠️ Limites da extração atingidos: %s (total no processo: %s)",
+                orcamento.estouros, dict(extracao.ESTOUROS_ORCAMENTO)
+            )
         logger.info("Dados extraídos:")
         for k, v in dados_extraidos.items():
             logger.info(f"{k}: {v}")
         
+        # A etapa de LLM usa a confiança para pular campos já validados e o texto para
+        # revisar só os demais; campos com "_" não fazem parte da resposta final
+        corpo = dict(dados_extraidos)
+        corpo["_confianca"] = avaliar_confianca(dados_extraidos, orcamento)
+        corpo["_texto"] = extracao.recortar_texto(texto, LIMITE_TEXTO_LLM)
+        if orcamento is not None and orcamento.parcial:
+            # Resultado parcial: os campos que ficaram sem extrair têm confiança baixa e
+            # são revisados pela LLM
+            corpo["_parcial"] = orcamento.estouros
+        logger.info("Confiança por campo: %s", corpo["_confianca"])
+
         logger.info("Chegou no return")
-        return {"statusCode": 200, "body": json.dumps(dados_extraidos, ensure_ascii=False)}
+        return {"statusCode": 200, "body": json.dumps(corpo, ensure_ascii=False)}
     except Exception as e:
         logger.error("Erro no processamento: %s", str(e))
         return {"statusCode": 500, "body": str(e)}
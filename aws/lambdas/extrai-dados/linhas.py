@@ -0,0 +1,65 @@
+from array import array
+from bisect import bisect_right
+
+# Tabela compacta das linhas do OCR. O texto continua sendo uma string única (as linhas
+# unidas por espaço, igual ao "text" que a extrai-texto devolve); cada linha é só um
+# intervalo dentro dela, com caixa (left, top, width, height), confiança e página
+# guardadas em arrays. Assim um trecho de linhas vizinhas é um simples fatiamento do
+# texto e a tabela inteira custa poucos bytes por linha.
+#
+# Formato das colunas no JSON da extrai-texto ("linhas"):
+#   {"tamanhos": [..], "caixas": [l, t, w, h, l, t, w, h, ..], "confiancas": [..], "paginas": [..]}
+
+
+class TabelaLinhas:
+    __slots__ = ("texto", "inicios", "fins", "caixas", "confiancas", "paginas")
+
+    def __init__(self, texto, tamanhos, caixas=None, confiancas=None, paginas=None):
+        self.texto = texto
+        self.inicios = array("I")
+        self.fins = array("I")
+        posicao = 0
+        for tamanho in tamanhos:
+            self.inicios.append(posicao)
+            self.fins.append(posicao + tamanho)
+            posicao += tamanho + 1
+        if (posicao - 1 if tamanhos else 0) != len(texto):
+            raise ValueError("Tamanhos das linhas não batem com o texto")
+        quantidade = len(self.inicios)
+        self.caixas = array("f", caixas if caixas is not None else [0.0] * (4 * quantidade))
+        self.confiancas = array("f", confiancas if confiancas is not None else [0.0] * quantidade)
+        self.paginas = array("H", paginas if paginas is not None else [1] * quantidade)
+        if len(self.caixas) != 4 * quantidade or len(self.confiancas) != quantidade or len(self.paginas) != quantidade:
+            raise ValueError("Colunas da tabela de linhas com tamanhos diferentes")
+
+    @classmethod
+    def de_colunas(cls, texto, colunas):
+        return cls(texto, colunas["tamanhos"], colunas.get("caixas"), colunas.get("confiancas"), colunas.get("paginas"))
+
+    @classmethod
+    def de_linhas(cls, linhas):
+        # Tabela sem geometria a partir de uma lista de strings (testes e reprocessamento)
+        return cls(" ".join(linhas), [len(linha) for linha in linhas])
+
+    def __len__(self):
+        return len(self.inicios)
+
+    def linha(self, i):
+        return self.texto[self.inicios[i]:self.fins[i]]
+
+    def caixa(self, i):
+        return tuple(self.caixas[4 * i:4 * i + 4])
+
+    def indice_da_posicao(self, posicao):
+        # Linha que contém a posição do texto (o espaço entre duas linhas fica na anterior)
+        return max(0, bisect_right(self.inicios, posicao) - 1)
+
+    def fim_trecho(self, inicio, fim):
+        # Posição no texto onde termina o trecho das linhas [inicio, fim)
+        return self.fins[min(fim, len(self.fins)) - 1]
+
+    def trecho(self, inicio, fim):
+        # Linhas [inicio, fim) como no texto original (unidas por espaço)
+        if inicio >= len(self.inicios):
+            return ""
+        return self.texto[self.inicios[inicio]:self.fim_trecho(inicio, fim)]
@@ -1,19 +1,202 @@
+import os
 import json
-import boto3
+import time
 import logging
+from artefatos_ocr import chave_artefato, serializar_artefato
+from clientes_aws import preguicoso
+from limitador import LimiteExcedido, codigo_erro, limitado, limitador
+from metricas import instrumentado, metricas
 
 # Nome do bucket de origem onde as imagens das notas fiscais são armazenadas
 SOURCE_BUCKET = "meu-bucket-notas"
 
-# Inicializa os clientes AWS
-s3_client = boto3.client("s3")
-textract_client = boto3.client("textract")
+# O detect_document_text (síncrono) só aceita imagens de uma página até 5 MB. PDFs,
+# TIFFs e arquivos que o síncrono recusa vão pelo modo assíncrono: start_document_text_detection e
+# get_document_text_detection paginado, entregando o texto página por página. Só o
+# pipeline em processo único (aws/pipeline/pipeline.py) aproveita as páginas uma a uma;
+# a Lambda junta todas (juntar_paginas) antes de responder à Step Function, e a
+# extrai-dados só começa depois do documento inteiro.
+EXTENSOES_ASSINCRONAS = (".pdf", ".tif", ".tiff")
+# "auto" (padrão) decide pelo arquivo; "sempre" ou "nunca" forçam o modo
+OCR_ASSINCRONO = os.environ.get("OCR_ASSINCRONO", "auto").lower()
+# Polling do job assíncrono (em segundos): começa curto e cresce até o máximo
+POLLING_INICIAL = 0.5
+POLLING_MAXIMO = 5.0
+# O polling para MARGEM_TIMEOUT_MS antes do timeout da Lambda. Se o job ainda não
+# terminou, a Lambda devolve statusCode 202 com o job_id e a Step Function espera
+# (estado Wait) e chama a extrai-texto de novo, que continua o mesmo job.
+MARGEM_TIMEOUT_MS = int(os.environ.get("MARGEM_TIMEOUT_MS", "10000"))
+# Máximo de blocos por chamada do get_document_text_detection (limite da API)
+BLOCOS_POR_PAGINA = 1000
+# Artefato do OCR: o texto e a tabela das linhas (o mesmo que segue para a extrai-dados)
+# em JSON compactado (formato em comum/artefatos_ocr.py). Com ele, as regras novas da
+# extrai-dados podem ser aplicadas às notas antigas sem pagar o Textract de novo
+# (aws/pipeline/reextracao.py). Fica num prefixo separado porque as imagens do upload
+# direto disparam a Step Function e as classificadas são movidas de pasta depois.
+ARTEFATOS_OCR = os.environ.get("ARTEFATOS_OCR", "true").lower() in ("1", "true", "sim")
+# A Step Function aceita no máximo 256 KB por estado. Acima de LIMITE_PAYLOAD bytes
+# (com folga para o envelope do lambda:invoke), o corpo leva só a referência do
+# artefato e a extrai-dados lê o texto e as linhas do S3.
+LIMITE_PAYLOAD = int(os.environ.get("LIMITE_PAYLOAD", str(240 * 1024)))
+
+# Clientes AWS da fábrica compartilhada (criados no primeiro uso); as chamadas ao
+# Textract passam pelo limitador de taxa
+s3_client = preguicoso("s3")
+textract_client = limitado(preguicoso("textract", tentativas=1), "textract")
 
 # Configura o logger da Lambda
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Junta o texto de todos os blocos "LINE" de uma resposta do Textract em uma única string
+def texto_das_linhas(response):
+    return " ".join(
+        block["Text"]
+        for block in response["Blocks"]
+        if block["BlockType"] == "LINE"
+    )
+
+# Além do texto unido, devolve uma tabela compacta das linhas em colunas: tamanho de
+# cada linha dentro do texto, caixa (left, top, width, height), confiança e página.
+# A extrai-dados monta a TabelaLinhas com isso para buscar cada campo só nas linhas
+# em volta dele (o texto de cada linha não é repetido no JSON).
+def tabela_das_linhas(response):
+    blocos = [block for block in response["Blocks"] if block["BlockType"] == "LINE"]
+    colunas = {"tamanhos": [], "caixas": [], "confiancas": [], "paginas": []}
+    for block in blocos:
+        caixa = block.get("Geometry", {}).get("BoundingBox", {})
+        colunas["tamanhos"].append(len(block["Text"]))
+        colunas["caixas"].extend(round(caixa.get(lado, 0.0), 4) for lado in ("Left", "Top", "Width", "Height"))
+        colunas["confiancas"].append(round(block.get("Confidence", 0.0), 1))
+        colunas["paginas"].append(block.get("Page", 1))
+    return " ".join(block["Text"] for block in blocos), colunas
+
+# Erros do detect_document_text que indicam documento grande demais ou multipágina:
+# no modo "auto" a mesma chave é refeita pelo modo assíncrono
+ERROS_PARA_ASSINCRONO = ("DocumentTooLargeException", "UnsupportedDocumentException")
+
+def usar_assincrono(key):
+    # Sem consulta extra ao S3: imagens comuns tentam o síncrono primeiro
+    if OCR_ASSINCRONO in ("sempre", "true", "1"):
+        return True
+    if OCR_ASSINCRONO in ("nunca", "false", "0"):
+        return False
+    return key.lower().endswith(EXTENSOES_ASSINCRONAS)
+
+class OcrPendente(TimeoutError):
+    # O job assíncrono não terminou dentro do tempo dado; pode ser retomado pelo job_id
+    def __init__(self, job_id):
+        super().__init__(f"OCR assíncrono {job_id} não terminou a tempo")
+        self.job_id = job_id
+
+def iniciar_ocr_assincrono(key, textract=None, bucket=SOURCE_BUCKET):
+    textract = textract or textract_client
+    resposta = textract.start_document_text_detection(
+        DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
+    )
+    return resposta["JobId"]
+
+def respostas_assincronas(job_id, textract=None, timeout=None):
+    # Gera cada página de resultado do job assim que ela é buscada. Espera o job sair
+    # de IN_PROGRESS com intervalo crescente; depois segue o NextToken sem esperar.
+    textract = textract or textract_client
+    intervalo = POLLING_INICIAL
+    limite = time.monotonic() + timeout if timeout is not None else None
+    parametros = {"JobId": job_id, "MaxResults": BLOCOS_POR_PAGINA}
+    while True:
+        resposta = textract.get_document_text_detection(**parametros)
+        status = resposta.get("JobStatus")
+        if status == "IN_PROGRESS":
+            if limite is not None and time.monotonic() + intervalo >= limite:
+                raise OcrPendente(job_id)
+            time.sleep(intervalo)
+            intervalo = min(intervalo * 2, POLLING_MAXIMO)
+            continue
+        if status == "FAILED":
+            raise RuntimeError(f"OCR assíncrono {job_id} falhou: {resposta.get('StatusMessage', '')}")
+        yield resposta
+        if not resposta.get("NextToken"):
+            return
+        parametros["NextToken"] = resposta["NextToken"]
+
+def paginas_das_respostas(respostas):
+    # Agrupa os blocos LINE por página do documento e entrega (página, texto, colunas)
+    # assim que o Textract passa para a página seguinte, sem esperar o resto do job
+    pagina_atual = None
+    blocos = []
+    for resposta in respostas:
+        for block in resposta["Blocks"]:
+            if block["BlockType"] != "LINE":
+                continue
+            pagina = block.get("Page", 1)
+            if pagina != pagina_atual and blocos:
+                yield (pagina_atual, *tabela_das_linhas({"Blocks": blocos}))
+                blocos = []
+            pagina_atual = pagina
+            blocos.append(block)
+    if blocos:
+        yield (pagina_atual, *tabela_das_linhas({"Blocks": blocos}))
+
+def juntar_paginas(paginas):
+    # Texto e tabela do documento inteiro, no mesmo formato do modo síncrono
+    textos = []
+    colunas = {"tamanhos": [], "caixas": [], "confiancas": [], "paginas": []}
+    for _, texto, colunas_pagina in paginas:
+        textos.append(texto)
+        for nome in colunas:
+            colunas[nome].extend(colunas_pagina[nome])
+    return " ".join(textos), colunas
+
+def gravar_artefato(key, texto, colunas, s3=None, bucket=SOURCE_BUCKET):
+    s3 = s3 or s3_client
+    chave = chave_artefato(key)
+    s3.put_object(
+        Bucket=bucket, Key=chave, Body=serializar_artefato(key, texto, colunas), ContentType="application/gzip"
+    )
+    return chave
+
+# OCR de um arquivo do bucket página por página. Os clientes podem ser trocados (ex.:
+# um Textract local que reproduz respostas gravadas) para rodar a etapa fora da Lambda.
+# Com job_id, continua um job assíncrono já iniciado; com timeout (segundos), a espera
+# pelo job levanta OcrPendente quando o tempo acaba.
+def extrair_paginas(key, textract=None, bucket=SOURCE_BUCKET, timeout=None, job_id=None):
+    textract = textract or textract_client
+    if job_id:
+        yield from paginas_das_respostas(respostas_assincronas(job_id, textract, timeout))
+        return
+    if not usar_assincrono(key):
+        try:
+            # OCR síncrono usando Textract - mais rápido para imagens até 5MB
+            response = textract.detect_document_text(
+                Document={'S3Object': {'Bucket': bucket, 'Name': key}}
+            )
+        except Exception as e:
+            if OCR_ASSINCRONO != "auto" or codigo_erro(e) not in ERROS_PARA_ASSINCRONO:
+                raise
+            logger.info(f"📄 OCR síncrono recusou {key} ({codigo_erro(e)}); usando o assíncrono")
+        else:
+            yield (1, *tabela_das_linhas(response))
+            return
+
+    logger.info(f"📄 OCR assíncrono (multipágina) para {key}")
+    job_id = iniciar_ocr_assincrono(key, textract, bucket)
+    yield from paginas_das_respostas(respostas_assincronas(job_id, textract, timeout))
+
+# Documento inteiro de uma vez (é o que a Lambda devolve)
+def extrair_linhas(key, textract=None, bucket=SOURCE_BUCKET, timeout=None, job_id=None):
+    return juntar_paginas(extrair_paginas(key, textract, bucket, timeout, job_id))
+
+def extrair_texto(key, textract=None, bucket=SOURCE_BUCKET):
+    return extrair_linhas(key, textract, bucket)[0]
+
+def tempo_disponivel(context):
+    # Segundos que o polling pode usar nesta invocação (None fora da Lambda)
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return None
+    return max(0.0, (context.get_remaining_time_in_millis() - MARGEM_TIMEOUT_MS) / 1000)
+
 # Função principal da Lambda, chamada automaticamente pela AWS
+@instrumentado("extrai-texto")
 def lambda_handler(event, context):
     # Recupera o nome do arquivo (chave) do evento recebido
     key = event.get("key") or event.get("input", {}).get("key")
@@ -25,32 +208,61 @@ def lambda_handler(event, context):
             "body": json.dumps({"error": "Chave do arquivo não fornecida"})
         }
 
+    limitador.zerar()
     try:
-        logger.info(f"📄 Iniciando OCR do arquivo: {key}")
+        # job_id vem da própria extrai-texto (statusCode 202) quando o job assíncrono
+        # não terminou na invocação anterior
+        job_id = event.get("job_id")
+        logger.info(f"📄 {'Retomando' if job_id else 'Iniciando'} OCR do arquivo: {key}")
 
-        # OCR síncrono usando Textract - mais rápido para imagens até 5MB
-        response = textract_client.detect_document_text(
-            Document={'S3Object': {'Bucket': SOURCE_BUCKET, 'Name': key}}
-        )
+        # OCR do arquivo: texto de todas as linhas em uma única string + tabela das linhas
+        with metricas.cronometro("ocr_ms"):
+            extracted_text, linhas = extrair_linhas(key, timeout=tempo_disponivel(context), job_id=job_id)
+        metricas.registrar("paginas", len(set(linhas["paginas"])), "Count")
+        metricas.registrar("linhas_ocr", len(linhas["tamanhos"]), "Count")
+        metricas.registrar("texto_caracteres", len(extracted_text), "Count")
 
-        # Filtra os blocos do tipo "LINE" e junta todo o texto extraído em uma única string
-        extracted_text = " ".join(
-            block["Text"]
-            for block in response["Blocks"]
-            if block["BlockType"] == "LINE"
-        )
+        # Corpo para o próximo passo da Step Function
+        body = json.dumps({
+            "text": extracted_text,  # Texto OCR extraído
+            "linhas": linhas,        # Tabela das linhas (posição no texto, caixa, confiança, página)
+            "key": key               # Nome do arquivo (útil para rastreabilidade)
+        }, ensure_ascii=False)
+        grande = len(body.encode("utf-8")) > LIMITE_PAYLOAD
+        artefato = None
+        if ARTEFATOS_OCR or grande:
+            try:
+                with metricas.cronometro("s3_artefato_ms"):
+                    artefato = gravar_artefato(key, extracted_text, linhas)
+            except Exception as e:
+                if grande:
+                    raise
+                # Sem o artefato a nota só não entra na reextração; o OCR segue normalmente
+                logger.warning(f"⚠️ Artefato do OCR não gravado para {key}: {str(e)}")
 
         logger.info(f"✅ Texto extraído com sucesso.")
+        logger.info(f"🚦 Limitador: {limitador.resumo()}")
+        metricas.registrar_contadores("textract", limitador.resumo().get("textract", {}))
 
-        # Retorna o texto extraído em formato JSON para o próximo passo da Step Function
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "text": extracted_text,  # Texto OCR extraído
-                "key": key               # Nome do arquivo (útil para rastreabilidade)
-            }, ensure_ascii=False)
-        }
+        if grande:
+            # Acima do limite de payload da Step Function, segue só a referência
+            logger.info(f"📦 Resultado do OCR ({len(body)} caracteres) enviado por referência: {artefato}")
+            metricas.contar("payload_por_referencia")
+            body = json.dumps({"artefato": artefato, "bucket": SOURCE_BUCKET, "key": key}, ensure_ascii=False)
+        return {"statusCode": 200, "body": body}
 
+    except OcrPendente as e:
+        # O Textract ainda está processando: a Step Function espera e chama de novo
+        logger.info(f"⏳ OCR assíncrono de {key} ainda em andamento (job {e.job_id})")
+        metricas.contar("ocr_pendente")
+        metricas.registrar_contadores("textract", limitador.resumo().get("textract", {}))
+        return {"statusCode": 202, "key": key, "job_id": e.job_id}
+    except LimiteExcedido:
+        # Throttling persistente: a exceção chega à Step Function, que repete a etapa
+        # mais tarde (Retry de "LimiteExcedido") em vez de seguir com um erro 500
+        logger.error(f"❌ Textract sem cota para {key}: {limitador.resumo()}")
+        metricas.registrar_contadores("textract", limitador.resumo().get("textract", {}))
+        raise
     except Exception as e:
         # Em caso de erro, registra o erro no log e retorna código 500 com mensagem de erro
         logger.error(f"❌ Erro ao processar OCR: {str(e)}")
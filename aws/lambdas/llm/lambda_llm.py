@@ -1,7 +1,10 @@
+import os
 import json
-import boto3
+import time
 import logging
-import re
+from clientes_aws import preguicoso
+from limitador import ClienteLimitado, LimiteExcedido, codigo_erro, limitado, limitador
+from metricas import instrumentado, metricas
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -9,12 +12,55 @@ logger.setLevel(logging.INFO)
 MODEL_ID = "amazon.titan-text-premier-v1:0"
 REGIAO = "us-east-1"
 
-bedrock = boto3.client("bedrock-runtime", region_name=REGIAO)
-s3 = boto3.client("s3")
+# Campos da resposta final, na ordem em que aparecem no JSON
+CAMPOS = [
+    "nome_emissor",
+    "CNPJ_emissor",
+    "endereco_emissor",
+    "CNPJ_CPF_consumidor",
+    "data_emissao",
+    "numero_nota_fiscal",
+    "serie_nota_fiscal",
+    "valor_total",
+    "forma_pgto",
+]
+# Campos com confiança abaixo disso (calculada na extrai-dados) são revisados pela LLM.
+# Fica entre os níveis da extrai-dados: só os campos validados (1.0) pulam a revisão; os
+# plausíveis sem validação (0.5, nome e endereço) e os ausentes (0.0) vão para a LLM.
+LIMIAR_CONFIANCA = float(os.environ.get("LIMIAR_CONFIANCA", "0.75"))
+# Palavras que costumam aparecer perto de cada campo na nota, usadas para recortar
+# só os trechos relevantes do texto OCR para o prompt
+ANCORAS_CAMPOS = {
+    "nome_emissor": [],
+    "CNPJ_emissor": ["cnpj"],
+    "endereco_emissor": ["rua", "av", "avenida", "cep", "endere"],
+    "CNPJ_CPF_consumidor": ["consumidor", "cpf"],
+    "data_emissao": ["emiss", "data"],
+    "numero_nota_fiscal": ["extrato", "nfc", "nf-e", "coo", "número", "numero"],
+    "serie_nota_fiscal": ["série", "serie", "ecf"],
+    "valor_total": ["total"],
+    "forma_pgto": ["pagamento", "pix", "dinheiro", "cart", "crédito", "credito", "débito", "debito"],
+}
+# Com streaming ligado, a resposta é lida em pedaços e a leitura para assim que o
+# primeiro objeto JSON fecha (o texto que o Titan costuma mandar depois é descartado)
+STREAMING = os.environ.get("BEDROCK_STREAMING", "true").lower() in ("1", "true", "sim")
+# Caracteres de contexto em volta de cada âncora e tamanho máximo do texto no prompt.
+# Se os trechos não cabem no limite, a janela diminui (até JANELA_MINIMA) antes de cortar.
+JANELA_TRECHO = 150
+JANELA_MINIMA = 40
+LIMITE_TRECHOS = 2000
 
+# Clientes AWS da fábrica compartilhada (criados no primeiro uso); as chamadas ao
+# Bedrock passam pelo limitador de taxa
+bedrock = limitado(preguicoso("bedrock-runtime", REGIAO, tentativas=1), "bedrock-runtime")
+s3 = preguicoso("s3")
 
+
+@instrumentado("llm")
 def lambda_handler(event, context):
-    logger.info("🔹 Evento recebido: %s", json.dumps(event))
+    # O evento (amostrado e com tamanho máximo) é registrado por @instrumentado; o
+    # "_texto" da extrai-dados chega a 20 mil caracteres (começo e fim da nota)
+    limitador.zerar()
 
     try:
         # Trata o corpo vindo da Lambda anterior (pode vir como string ou dict)
@@ -25,53 +71,26 @@ def lambda_handler(event, context):
         else:
             dados = event
 
-        # Gera o prompt com os dados extraídos
-        prompt = gerar_prompt(dados)
-        logger.info("🧠 Prompt enviado para o Titan:\n%s", prompt)
-
-        # Envia o prompt para o modelo Titan via Bedrock
-        resposta = bedrock.invoke_model(
-            modelId=MODEL_ID,
-            body=json.dumps({
-                "inputText": prompt,
-                "textGenerationConfig": {
-                    "maxTokenCount": 500,
-                    "temperature": 0.2,
-                    "topP": 1,
-                    "stopSequences": []
-                }
-            }),
-            contentType="application/json",
-            accept="application/json"
-        )
-
-        # Decodifica a resposta
-        resultado = json.loads(resposta['body'].read().decode())
-        texto_gerado = resultado['results'][0]['outputText']
-        logger.info("✅ Resposta da LLM:\n%s", texto_gerado)
-
-        # Tenta carregar diretamente o JSON, se possível
-        try:
-            json_final = json.loads(texto_gerado)
-        except json.JSONDecodeError:
-            # Fallback: remove marcações e busca primeiro bloco JSON
-            texto_gerado = texto_gerado.replace("```json", "").replace("```", "").strip()
-            match = re.search(r'\{.*\}', texto_gerado, re.DOTALL)
-            if not match:
-                raise ValueError("Não foi possível extrair um JSON válido da resposta da LLM.")
-            json_str_puro = match.group(0)
-            json_final = json.loads(json_str_puro)
-
-        # Substitui None por "None" (string)
-        for k, v in json_final.items():
-            if v is None:
-                json_final[k] = "None"
+        # Metadados da extrai-dados (ausentes em payloads antigos: aí revisa tudo)
+        confianca = dados.pop("_confianca", None)
+        texto = dados.pop("_texto", "")
+        parcial = dados.pop("_parcial", None)
+        if parcial:
+            logger.info("⚠️ Extração parcial na etapa anterior (limites: %s)", parcial)
+        json_final = refinar_dados(dados, confianca, texto)
         logger.info("Chegou no return")
+        logger.info("🚦 Limitador: %s", limitador.resumo())
+        metricas.registrar_contadores("bedrock", limitador.resumo().get("bedrock-runtime", {}))
         return {
             "statusCode": 200,
             "body": json.dumps(json_final, ensure_ascii=False)
         }
 
+    except LimiteExcedido:
+        # Throttling persistente do Bedrock: deixa a Step Function repetir a etapa
+        logger.error("❌ Bedrock sem cota: %s", limitador.resumo())
+        metricas.registrar_contadores("bedrock", limitador.resumo().get("bedrock-runtime", {}))
+        raise
     except Exception as e:
         logger.error("❌ Erro: %s", str(e))
         return {
@@ -80,41 +99,339 @@ def lambda_handler(event, context):
         }
 
 
-def gerar_prompt(dados):
-    return f"""
-Você é um assistente que formata dados extraídos de notas fiscais.
-
-Retorne apenas um JSON puro, sem explicações, código ou marcações, com os seguintes campos. 
-Se algum dado estiver ausente, use o valor 'None' (como string). 
-
-IMPORTANTE: não inclua nenhuma explicação, nem markdown (```), apenas o JSON puro como saída.
-
-Campos esperados:
-{{
-  "nome_emissor": <string ou 'None'>,
-  "CNPJ_emissor": <string ou 'None'>,
-  "endereco_emissor": <string ou 'None'>,
-  "CNPJ_CPF_consumidor": <string ou 'None'>,
-  "data_emissao": <string ou 'None'>,
-  "numero_nota_fiscal": <string ou 'None'>,
-  "serie_nota_fiscal": <string ou 'None'>,
-  "valor_total": <string ou 'None'>,
-  "forma_pgto": <string ou 'None'>
-}}
-
-Aqui estão os dados extraídos:
-{json.dumps(dados, ensure_ascii=False, indent=2)}
-
-Apenas retorne o JSON no formato abaixo, nada mais:
-{{
-  "nome_emissor": ...,
-  "CNPJ_emissor": ...,
-  "endereco_emissor": ...,
-  "CNPJ_CPF_consumidor": ...,
-  "data_emissao": ...,
-  "numero_nota_fiscal": ...,
-  "serie_nota_fiscal": ...,
-  "valor_total": ...,
-  "forma_pgto": ...
-}}
+def campos_pendentes(confianca=None, limiar=None):
+    # Campos que a LLM revisa; sem confiança (chamada antiga), todos
+    if confianca is None:
+        return list(CAMPOS)
+    limiar = LIMIAR_CONFIANCA if limiar is None else limiar
+    return [campo for campo in CAMPOS if confianca.get(campo, 0) < limiar]
+
+
+def refinar_dados(dados, confianca=None, texto="", cliente=None):
+    # Etapa de LLM como função: recebe os dados da extração (e, se houver, a confiança
+    # por campo e o texto OCR) e devolve o JSON final. `cliente` permite trocar o
+    # Bedrock por um substituto local.
+    pendentes = campos_pendentes(confianca)
+    metricas.registrar("campos_pendentes", len(pendentes), "Count")
+
+    # Todos os campos já passaram na validação da heurística: não chama o Bedrock
+    if not pendentes:
+        logger.info("✅ Todos os campos validados pela heurística; LLM não foi chamada")
+        metricas.contar("llm_chamadas", 0)
+        return finalizar(dict(dados))
+
+    # Gera o prompt só com os campos que precisam de revisão
+    prompt = gerar_prompt(dados, pendentes, texto if confianca is not None else "")
+    # O prompt inteiro (com trechos da nota) só vai para o log em nível DEBUG
+    logger.info("🧠 Prompt enviado para o Titan (campos: %s, %d caracteres)", pendentes, len(prompt))
+    logger.debug("🧠 Prompt:\n%s", prompt)
+
+    # Envia o prompt para o modelo Titan via Bedrock e lê só o primeiro objeto JSON
+    metricas.contar("llm_chamadas")
+    metricas.registrar("prompt_caracteres", len(prompt), "Count")
+    with metricas.cronometro("llm_ms"):
+        json_llm = invocar_modelo(prompt, pendentes, cliente)
+
+    # A LLM só responde pelos campos pendentes; os demais ficam com o valor validado
+    json_final = dict(dados)
+    for campo in pendentes:
+        if campo in json_llm:
+            json_final[campo] = json_llm[campo]
+    return finalizar(json_final)
+
+
+class LeitorJSONIncremental:
+    # Acompanha o texto gerado pedaço por pedaço e detecta quando o primeiro objeto JSON
+    # de nível superior termina, sem esperar o resto da resposta. Ignora o que vem antes
+    # da primeira "{" (ex.: ```json) e chaves/colchetes dentro de strings. As chaves do
+    # objeto principal são registradas conforme aparecem, para validação antecipada.
+    def __init__(self, chaves_esperadas=None):
+        self.chaves_esperadas = set(chaves_esperadas or CAMPOS)
+        self.buffer = []
+        self.profundidade = 0
+        self.em_string = False
+        self.escape = False
+        self.string_atual = []
+        self.ultima_string = None
+        self.chaves = []
+        self.chaves_inesperadas = []
+        self.objeto = None
+        self.valor = None
+
+    def _reiniciar(self):
+        self.buffer = []
+        self.profundidade = 0
+        self.ultima_string = None
+        self.chaves = []
+        self.chaves_inesperadas = []
+
+    def alimentar(self, pedaco):
+        # Retorna o objeto (já convertido) quando ele fecha; antes disso, None. Um trecho
+        # entre chaves que não é JSON válido (ex.: "{x}" em texto solto) é descartado e a
+        # leitura continua procurando o próximo objeto.
+        if self.objeto is not None:
+            return self.valor
+        for caractere in pedaco:
+            if self.profundidade == 0:
+                if caractere != "{":
+                    continue
+            self.buffer.append(caractere)
+            if self.em_string:
+                if self.escape:
+                    self.escape = False
+                    self.string_atual.append(caractere)
+                elif caractere == "\\":
+                    self.escape = True
+                elif caractere == '"':
+                    self.em_string = False
+                    self.ultima_string = "".join(self.string_atual)
+                else:
+                    self.string_atual.append(caractere)
+                continue
+            if caractere == '"':
+                self.em_string = True
+                self.string_atual = []
+            elif caractere == ":" and self.profundidade == 1 and self.ultima_string is not None:
+                self._registrar_chave(self.ultima_string)
+            elif caractere in "{[":
+                self.profundidade += 1
+            elif caractere in "}]":
+                self.profundidade -= 1
+                if self.profundidade == 0:
+                    candidato = "".join(self.buffer)
+                    try:
+                        self.valor = json.loads(candidato)
+                    except json.JSONDecodeError:
+                        self._reiniciar()
+                        continue
+                    self.objeto = candidato
+                    return self.valor
+            if not caractere.isspace() and caractere != '"':
+                self.ultima_string = None
+        return None
+
+    def _registrar_chave(self, chave):
+        self.chaves.append(chave)
+        if chave not in self.chaves_esperadas:
+            self.chaves_inesperadas.append(chave)
+            logger.warning("⚠️ Chave inesperada na resposta da LLM: %s", chave)
+        self.ultima_string = None
+
+
+def extrair_primeiro_json(texto, chaves_esperadas=None):
+    # Primeiro objeto JSON completo do texto (substitui a regex gulosa \{.*\})
+    leitor = LeitorJSONIncremental(chaves_esperadas)
+    valor = leitor.alimentar(texto)
+    if valor is None:
+        raise ValueError("Não foi possível extrair um JSON válido da resposta da LLM.")
+    return valor
+
+
+def corpo_requisicao(prompt):
+    return json.dumps({
+        "inputText": prompt,
+        "textGenerationConfig": {
+            "maxTokenCount": 500,
+            "temperature": 0.2,
+            "topP": 1,
+            "stopSequences": []
+        }
+    })
+
+
+class ErroStream(Exception):
+    # Exceção que o Bedrock manda dentro do stream (throttlingException,
+    # modelStreamErrorException, ...), com o código no formato das exceções do boto3
+    # ("ThrottlingException") para o limitador decidir se repete
+    def __init__(self, tipo, mensagem=""):
+        codigo = tipo[:1].upper() + tipo[1:]
+        super().__init__(f"{codigo} no stream do Bedrock: {mensagem}")
+        self.response = {"Error": {"Code": codigo, "Message": mensagem}}
+
+
+def erro_no_stream(evento):
+    # Eventos de exceção do stream: qualquer chave além de "chunk" terminada em "Exception"
+    for tipo, conteudo in evento.items():
+        if tipo != "chunk" and tipo.endswith("Exception"):
+            return ErroStream(tipo, (conteudo or {}).get("message", ""))
+    return None
+
+
+def validar_resposta(valor, campos=None):
+    # Só os campos pedidos, com valor simples, entram no resultado da LLM; chaves
+    # inesperadas ou valores aninhados são descartados (a heurística fica valendo)
+    if not isinstance(valor, dict):
+        raise ValueError("A resposta da LLM não é um objeto JSON.")
+    esperados = campos or CAMPOS
+    validos = {
+        campo: valor[campo] for campo in esperados
+        if campo in valor and (valor[campo] is None or isinstance(valor[campo], (str, int, float)))
+    }
+    descartados = sorted(set(valor) - set(validos))
+    if descartados:
+        logger.warning("⚠️ Chaves descartadas da resposta da LLM: %s", descartados)
+        metricas.registrar("llm_chaves_descartadas", len(descartados), "Count")
+    faltando = [campo for campo in esperados if campo not in validos]
+    if faltando:
+        logger.warning("⚠️ Campos ausentes na resposta da LLM: %s", faltando)
+    return validos
+
+
+def invocar_modelo(prompt, campos=None, cliente=None):
+    cliente = cliente or bedrock
+    if STREAMING:
+        # O stream pode falhar depois de aberto (throttling, erro do modelo): com o
+        # cliente limitado, a leitura inteira passa pelo limitador e é repetida
+        if isinstance(cliente, ClienteLimitado):
+            return cliente.repetir(lambda bruto: invocar_modelo_streaming(prompt, campos, bruto))
+        return invocar_modelo_streaming(prompt, campos, cliente)
+
+    resposta = cliente.invoke_model(
+        modelId=MODEL_ID,
+        body=corpo_requisicao(prompt),
+        contentType="application/json",
+        accept="application/json"
+    )
+
+    # Decodifica a resposta
+    resultado = json.loads(resposta['body'].read().decode())
+    texto_gerado = resultado['results'][0]['outputText']
+    registrar_tokens(resultado.get("inputTextTokenCount"), resultado['results'][0].get("tokenCount"))
+    logger.info("✅ Resposta da LLM:\n%s", texto_gerado)
+
+    # Tenta carregar diretamente o JSON, se possível
+    try:
+        valor = json.loads(texto_gerado)
+    except json.JSONDecodeError:
+        # Fallback: primeiro objeto JSON completo, ignorando marcações e texto extra
+        valor = extrair_primeiro_json(texto_gerado, campos)
+    return validar_resposta(valor, campos)
+
+
+def invocar_modelo_streaming(prompt, campos=None, cliente=None):
+    cliente = cliente or bedrock
+    resposta = cliente.invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        body=corpo_requisicao(prompt),
+        contentType="application/json",
+        accept="application/json"
+    )
+    stream = resposta["body"]
+    leitor = LeitorJSONIncremental(campos)
+    recebido = []
+    valor = None
+    tokens_entrada = tokens_saida = None
+    inicio = time.perf_counter()
+    try:
+        for evento in stream:
+            erro = erro_no_stream(evento)
+            if erro is not None:
+                raise erro
+            chunk = evento.get("chunk")
+            if not chunk:
+                continue
+            dados_chunk = json.loads(chunk["bytes"].decode())
+            if not recebido:
+                metricas.registrar("llm_primeiro_pedaco_ms", (time.perf_counter() - inicio) * 1000)
+            tokens_entrada = dados_chunk.get("inputTextTokenCount", tokens_entrada)
+            tokens_saida = dados_chunk.get("totalOutputTextTokenCount", tokens_saida)
+            pedaco = dados_chunk.get("outputText", "")
+            recebido.append(pedaco)
+            valor = leitor.alimentar(pedaco)
+            if valor is not None:
+                break
+    except Exception as e:
+        # O EventStream do botocore levanta a exceção do stream com o código do evento
+        # ("throttlingException"): normaliza para o limitador reconhecer
+        if not codigo_erro(e)[:1].islower():
+            raise
+        raise ErroStream(codigo_erro(e), str(e)) from e
+    finally:
+        # Encerra a conexão sem ler o restante da geração
+        if hasattr(stream, "close"):
+            stream.close()
+
+    registrar_tokens(tokens_entrada, tokens_saida)
+    logger.info("✅ Resposta da LLM (streaming):\n%s", "".join(recebido))
+    if valor is None:
+        raise ValueError("Não foi possível extrair um JSON válido da resposta da LLM.")
+    return validar_resposta(valor, campos)
+
+
+def registrar_tokens(entrada, saida):
+    # Contagens que o Titan devolve no corpo da resposta (no streaming, as do último
+    # pedaço lido: a leitura para antes do fim da geração)
+    if entrada is not None:
+        metricas.registrar("llm_tokens_entrada", entrada, "Count")
+    if saida is not None:
+        metricas.registrar("llm_tokens_saida", saida, "Count")
+
+
+def finalizar(dados):
+    # Substitui None por "None" (string)
+    for k, v in dados.items():
+        if v is None:
+            dados[k] = "None"
+    return dados
+
+
+def trechos_relevantes(texto, campos):
+    # Recorta o texto em volta das âncoras dos campos pendentes; sem âncora (ex.: o nome
+    # do emissor, que fica no cabeçalho), usa o começo da nota
+    if not texto:
+        return ""
+    texto_lower = texto.lower()
+    janela = JANELA_TRECHO
+    while True:
+        trechos = _recortar(texto, texto_lower, campos, janela)
+        if trechos is None:
+            return texto[:LIMITE_TRECHOS]
+        if len(trechos) <= LIMITE_TRECHOS or janela <= JANELA_MINIMA:
+            return trechos[:LIMITE_TRECHOS]
+        janela //= 2
+
+
+def _recortar(texto, texto_lower, campos, janela):
+    # A primeira e a última ocorrência de cada âncora: o mesmo rótulo costuma aparecer
+    # no cabeçalho e no rodapé (ex.: "VL TOTAL" na tabela de itens e "VALOR TOTAL R$"
+    # no fim), e o valor que interessa pode estar em qualquer um deles
+    intervalos = []
+    for campo in campos:
+        ancoras = ANCORAS_CAMPOS.get(campo, [])
+        if not ancoras:
+            intervalos.append((0, janela * 2))
+        for ancora in ancoras:
+            for pos in {texto_lower.find(ancora), texto_lower.rfind(ancora)} - {-1}:
+                intervalos.append((max(0, pos - janela), pos + len(ancora) + janela))
+    if not intervalos:
+        return None
+
+    # Junta intervalos sobrepostos para não repetir texto
+    intervalos.sort()
+    unidos = [list(intervalos[0])]
+    for inicio, fim in intervalos[1:]:
+        if inicio <= unidos[-1][1]:
+            unidos[-1][1] = max(unidos[-1][1], fim)
+        else:
+            unidos.append([inicio, fim])
+    return " [...] ".join(texto[inicio:fim] for inicio, fim in unidos)
+
+
+def gerar_prompt(dados, campos=None, texto=""):
+    campos = campos or CAMPOS
+    esquema = ", ".join(f'"{campo}"' for campo in campos)
+    extraidos = {campo: dados.get(campo, "None") for campo in campos}
+    prompt = f"""Você é um assistente que formata dados extraídos de notas fiscais.
+Retorne apenas um JSON puro, sem explicações nem markdown (```), com os campos: {esquema}.
+Todos os valores são strings; se algum dado estiver ausente, use 'None'.
+
+Valores encontrados pela extração automática (podem estar errados ou faltando):
+{json.dumps(extraidos, ensure_ascii=False)}
+"""
+    trechos = trechos_relevantes(texto, campos)
+    if trechos:
+        prompt += f"""
+Trechos do texto da nota:
+{trechos}
 """
+    return prompt
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger()
+
+# Tempo de vida padrão de um resultado em cache (7 dias)
+TTL_PADRAO = 7 * 24 * 3600
+# Limite de itens do backend SQLite (os menos acessados saem primeiro)
+MAX_ITENS_PADRAO = 10000
+
+
+# Versão das regras que produzem o resultado (extrai-dados e llm). Ela faz parte da
+# chave: ao publicar regras novas, aumente CACHE_VERSAO e os resultados gravados com
+# as antigas deixam de ser devolvidos (no S3 e no DynamoDB saem pelo lifecycle/TTL)
+VERSAO_REGRAS = os.environ.get("CACHE_VERSAO", "1")
+
+
+def hash_conteudo(dados):
+    # Hash dos bytes da imagem já decodificada, então o mesmo arquivo reenviado (ex.:
+    # retry do cliente) cai sempre na mesma entrada
+    return hashlib.sha256(dados).hexdigest()
+
+
+def chave_cache(hash_arquivo, versao=VERSAO_REGRAS):
+    # Chave do cache: versão das regras + hash da imagem
+    return f"v{versao}/{hash_arquivo}"
+
+
+# Todos os backends expõem obter(chave) -> dict ou None e gravar(chave, resultado)
+
+
+class CacheSQLite:
+    # Backend local (testes e execução fora da AWS). Aplica TTL na leitura e limite
+    # de tamanho na escrita, removendo as entradas acessadas há mais tempo. A conexão
+    # é compartilhada pelas threads do upload em lote, uma operação por vez.
+    def __init__(self, caminho=":memory:", ttl=TTL_PADRAO, max_itens=MAX_ITENS_PADRAO):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self.trava = threading.Lock()
+        self.conexao.execute(
+            "CREATE TABLE IF NOT EXISTS resultados ("
+            " chave TEXT PRIMARY KEY, valor TEXT NOT NULL, criado REAL NOT NULL, acessado REAL NOT NULL)"
+        )
+        self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_acessado ON resultados (acessado)")
+        self.conexao.commit()
+
+    def obter(self, chave):
+        with self.trava:
+            linha = self.conexao.execute(
+                "SELECT valor, criado FROM resultados WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                return None
+            agora = time.time()
+            if self.ttl and agora - linha[1] > self.ttl:
+                self.conexao.execute("DELETE FROM resultados WHERE chave = ?", (chave,))
+                self.conexao.commit()
+                return None
+            self.conexao.execute("UPDATE resultados SET acessado = ? WHERE chave = ?", (agora, chave))
+            self.conexao.commit()
+        return json.loads(linha[0])
+
+    def gravar(self, chave, resultado):
+        agora = time.time()
+        with self.trava:
+            self.conexao.execute(
+                "INSERT OR REPLACE INTO resultados (chave, valor, criado, acessado) VALUES (?, ?, ?, ?)",
+                (chave, json.dumps(resultado, ensure_ascii=False), agora, agora)
+            )
+            if self.max_itens:
+                self.conexao.execute(
+                    "DELETE FROM resultados WHERE chave IN ("
+                    " SELECT chave FROM resultados ORDER BY acessado DESC LIMIT -1 OFFSET ?)",
+                    (self.max_itens,)
+                )
+            self.conexao.commit()
+
+
+class CacheS3:
+    # Um objeto JSON por hash em <bucket>/<prefixo>. O TTL é conferido pelo LastModified
+    # na leitura; o limite de tamanho fica a cargo de uma regra de lifecycle do bucket
+    # expirando o prefixo (listar o prefixo a cada requisição sairia caro).
+    def __init__(self, s3_client, bucket, prefixo="cache/", ttl=TTL_PADRAO):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefixo = prefixo
+        self.ttl = ttl
+
+    def _chave_objeto(self, chave):
+        return f"{self.prefixo}{chave}.json"
+
+    def obter(self, chave):
+        try:
+            resposta = self.s3.get_object(Bucket=self.bucket, Key=self._chave_objeto(chave))
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        if self.ttl and time.time() - resposta["LastModified"].timestamp() > self.ttl:
+            return None
+        return json.loads(resposta["Body"].read().decode())
+
+    def gravar(self, chave, resultado):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._chave_objeto(chave),
+            Body=json.dumps(resultado, ensure_ascii=False).encode(),
+            ContentType="application/json"
+        )
+
+
+class CacheDynamoDB:
+    # Tabela com chave de partição "chave" (string) e TTL nativo habilitado no atributo
+    # "expira_em". Como o DynamoDB remove itens expirados com atraso, a validade também
+    # é conferida na leitura.
+    def __init__(self, dynamodb_client, tabela, ttl=TTL_PADRAO):
+        self.dynamodb = dynamodb_client
+        self.tabela = tabela
+        self.ttl = ttl
+
+    def obter(self, chave):
+        resposta = self.dynamodb.get_item(TableName=self.tabela, Key={"chave": {"S": chave}})
+        item = resposta.get("Item")
+        if not item:
+            return None
+        if "expira_em" in item and float(item["expira_em"]["N"]) < time.time():
+            return None
+        return json.loads(item["valor"]["S"])
+
+    def gravar(self, chave, resultado):
+        item = {
+            "chave": {"S": chave},
+            "valor": {"S": json.dumps(resultado, ensure_ascii=False)},
+        }
+        if self.ttl:
+            item["expira_em"] = {"N": str(int(time.time() + self.ttl))}
+        self.dynamodb.put_item(TableName=self.tabela, Item=item)
+
+
+def criar_cache(s3_client=None, bucket=None):
+    # Escolhe o backend pela variável CACHE_BACKEND: "s3" (padrão), "dynamodb",
+    # "sqlite" ou "desligado"
+    backend = os.environ.get("CACHE_BACKEND", "s3").lower()
+    ttl = int(os.environ.get("CACHE_TTL_SEGUNDOS", TTL_PADRAO))
+    if backend == "s3":
+        return CacheS3(s3_client, bucket, os.environ.get("CACHE_PREFIXO", "cache/"), ttl)
+    if backend == "dynamodb":
+        from clientes_aws import preguicoso
+        return CacheDynamoDB(preguicoso("dynamodb"), os.environ["CACHE_TABELA"], ttl)
+    if backend == "sqlite":
+        caminho = os.environ.get("CACHE_SQLITE_CAMINHO", "/tmp/cache-notas.db")
+        max_itens = int(os.environ.get("CACHE_MAX_ITENS", MAX_ITENS_PADRAO))
+        return CacheSQLite(caminho, ttl, max_itens)
+    return None
+
+
+def obter_seguro(cache, chave):
+    # Falha no cache nunca derruba o processamento: vira um miss
+    if cache is None:
+        return None
+    try:
+        return cache.obter(chave)
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao ler o cache: {str(e)}")
+        return None
+
+
+def gravar_seguro(cache, chave, resultado):
+    if cache is None:
+        return
+    try:
+        cache.gravar(chave, resultado)
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao gravar no cache: {str(e)}")
@@ -0,0 +1,171 @@
+import os
+import sys
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Classificação das notas por forma de pagamento sem reescrever a imagem: um marcador
+# vazio em indice/<pasta>/<chave da imagem> serve de índice (listar um prefixo devolve
+# todas as notas daquela pasta, já com a chave de cada imagem no nome do marcador). Na
+# requisição só o marcador é gravado; a tag "forma_pgto" na imagem e a cópia física
+# para dinheiro/ ou outros/ são opcionais e feitas em lote, fora da requisição. Ao mover,
+# o artefato do OCR e a linha do repositório de notas passam para a chave final.
+
+PREFIXO_INDICE = os.environ.get("PREFIXO_INDICE", "indice/")
+TAG_FORMA_PGTO = "forma_pgto"
+PASTAS = ("dinheiro", "outros")
+THREADS_RELOCACAO = 16
+
+
+def pasta_destino(forma_pgto):
+    # Mesma regra que o mover_arquivo usava para escolher a pasta
+    if str(forma_pgto).lower() in ("dinheiro", "pix"):
+        return "dinheiro"
+    return "outros"
+
+
+def _nome(key):
+    return key.rsplit("/", 1)[-1]
+
+
+def chave_indice(pasta, key):
+    return f"{PREFIXO_INDICE}{pasta}/{key}"
+
+
+def classificar_arquivo(s3_client, bucket, key, forma_pgto):
+    # Uma única requisição pequena (o marcador) no lugar de copy_object + delete_object.
+    # Repetir a chamada (ex.: consulta do job feita duas vezes) não muda nada.
+    pasta = pasta_destino(forma_pgto)
+    s3_client.put_object(Bucket=bucket, Key=chave_indice(pasta, key), Body=b"")
+    return pasta
+
+
+def listar_indice(s3_client, bucket, pasta):
+    # Gera (chave do marcador, chave da imagem) para todas as notas de uma pasta, só
+    # com a listagem (a chave da imagem é o resto do nome do marcador)
+    prefixo = f"{PREFIXO_INDICE}{pasta}/"
+    parametros = {"Bucket": bucket, "Prefix": prefixo}
+    while True:
+        resposta = s3_client.list_objects_v2(**parametros)
+        for objeto in resposta.get("Contents", []):
+            marcador = objeto["Key"]
+            yield marcador, marcador[len(prefixo):]
+        if not resposta.get("IsTruncated"):
+            return
+        parametros["ContinuationToken"] = resposta["NextContinuationToken"]
+
+
+def etiquetar_arquivo(s3_client, bucket, pasta, key):
+    # Tag "forma_pgto" na imagem (para regras de lifecycle ou políticas por tag)
+    s3_client.put_object_tagging(
+        Bucket=bucket,
+        Key=key,
+        Tagging={"TagSet": [{"Key": TAG_FORMA_PGTO, "Value": pasta}]}
+    )
+    return key
+
+
+def mover_artefato(s3_client, bucket, key, destino):
+    # O artefato do OCR fica em ocr/<chave sem extensão> e guarda a chave da imagem: é
+    # regravado para o destino (a reextração grava no repositório por essa chave)
+    from artefatos_ocr import chave_artefato, ler_artefato, serializar_artefato
+    from limitador import codigo_erro
+    origem = chave_artefato(key)
+    try:
+        conteudo = s3_client.get_object(Bucket=bucket, Key=origem)["Body"].read()
+    except Exception as e:
+        if codigo_erro(e) in ("NoSuchKey", "404"):
+            return None
+        raise
+    artefato = ler_artefato(conteudo)
+    s3_client.put_object(
+        Bucket=bucket, Key=chave_artefato(destino),
+        Body=serializar_artefato(destino, artefato["text"], artefato.get("linhas")), ContentType="application/gzip"
+    )
+    s3_client.delete_object(Bucket=bucket, Key=origem)
+    return chave_artefato(destino)
+
+
+def relocar_arquivo(s3_client, bucket, pasta, marcador, key, repositorio=None):
+    # Copia a imagem para <pasta>/<nome> (com as tags), leva o artefato do OCR e a linha
+    # do repositório para a chave nova, apaga a original e troca o marcador por um que
+    # aponta para o destino. Notas já relocadas são puladas.
+    destino = f"{pasta}/{_nome(key)}"
+    if key == destino:
+        return None
+    s3_client.copy_object(Bucket=bucket, CopySource={"Bucket": bucket, "Key": key}, Key=destino)
+    mover_artefato(s3_client, bucket, key, destino)
+    if repositorio is not None:
+        repositorio.renomear(key, destino)
+    s3_client.put_object(Bucket=bucket, Key=chave_indice(pasta, destino), Body=b"")
+    s3_client.delete_object(Bucket=bucket, Key=key)
+    s3_client.delete_object(Bucket=bucket, Key=marcador)
+    return destino
+
+
+def relocar_pendentes(s3_client, bucket, threads=THREADS_RELOCACAO, limite=None, etiquetar=False, mover=True,
+                      repositorio=None):
+    # Job em lote (agendado ou manual), fora do caminho da requisição: aplica a tag
+    # "forma_pgto" (etiquetar) e/ou move para as pastas físicas (mover) as notas do
+    # índice, em paralelo. Falhas em um arquivo não param o lote.
+    tarefas = []
+    for pasta in PASTAS:
+        for marcador, key in listar_indice(s3_client, bucket, pasta):
+            if etiquetar or (mover and key != f"{pasta}/{_nome(key)}"):
+                tarefas.append((pasta, marcador, key))
+            if limite and len(tarefas) >= limite:
+                break
+        if limite and len(tarefas) >= limite:
+            break
+
+    def processar(tarefa):
+        pasta, marcador, key = tarefa
+        try:
+            if etiquetar:
+                etiquetar_arquivo(s3_client, bucket, pasta, key)
+            return relocar_arquivo(s3_client, bucket, pasta, marcador, key, repositorio) if mover else None
+        except Exception as e:
+            logger.error(f"❌ Erro ao processar {key}: {str(e)}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        resultados = list(executor.map(processar, tarefas))
+    movidos = sum(1 for r in resultados if r)
+    falhas = sum(1 for r in resultados if r is False)
+    logger.info(f"✅ Relocação concluída: {movidos} movidos, {falhas} falhas")
+    return {"movidos": movidos, "falhas": falhas, "pendentes": len(tarefas)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Aplica a tag forma_pgto e/ou move em lote as notas classificadas para dinheiro/ e outros/."
+    )
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--threads", type=int, default=THREADS_RELOCACAO)
+    parser.add_argument("--limite", type=int, help="Máximo de arquivos processados nesta execução")
+    parser.add_argument("--etiquetar", action="store_true", help="Aplica a tag forma_pgto nas imagens do índice")
+    parser.add_argument("--sem-mover", action="store_true", help="Não move as imagens para as pastas")
+    parser.add_argument("--sqlite", help="Repositório SQLite de notas que acompanha as chaves movidas")
+    parser.add_argument("--tabela", help="Tabela do repositório no DynamoDB que acompanha as chaves movidas")
+    args = parser.parse_args(argv)
+
+    # Fora da Lambda, a fábrica de clientes e o formato dos artefatos vêm da pasta
+    # comum/ do repositório; o pool de conexões comporta as threads da relocação
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "comum"))
+    from clientes_aws import cliente
+    import repositorio_notas
+    repositorio = None
+    if args.sqlite:
+        repositorio = repositorio_notas.RepositorioSQLite(args.sqlite)
+    elif args.tabela:
+        repositorio = repositorio_notas.RepositorioDynamoDB(cliente("dynamodb"), args.tabela)
+    logging.basicConfig(level=logging.INFO)
+    print(relocar_pendentes(cliente("s3"), args.bucket, args.threads, args.limite, args.etiquetar,
+                            not args.sem_mover, repositorio))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,94 @@
 import json
-import boto3
 import base64
 import uuid
 import logging
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+from cache_resultados import criar_cache, chave_cache, hash_conteudo, obter_seguro, gravar_seguro
+from classificacao import classificar_arquivo
+import preprocessamento
+import repositorio_notas
+from clientes_aws import preguicoso
+from metricas import instrumentado, metricas
 # Configurações
 S3_BUCKET = "meu-bucket-notas"
 REGIAO = "us-east-1"
+# ARN correto da Step Function
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:491085429967:stateMachine:step_function_sprint4-6"
+# State machine de lote: um estado Map que roda a state machine acima para cada nota,
+# com concorrência limitada (definição em "step functions/config_lote.json")
+STATE_MACHINE_ARN_LOTE = os.environ.get(
+    "STATE_MACHINE_ARN_LOTE", "arn:aws:states:us-east-1:491085429967:stateMachine:step_function_lote"
+)
+# Lote: máximo de arquivos por requisição e threads gravando no S3 ao mesmo tempo
+MAX_ARQUIVOS_LOTE = int(os.environ.get("MAX_ARQUIVOS_LOTE", "50"))
+THREADS_UPLOAD = int(os.environ.get("THREADS_UPLOAD", "8"))
+# "EXPRESS" usa start_sync_execution (espera o fim sem polling); "STANDARD" consulta o status
+TIPO_STATE_MACHINE = os.environ.get("TIPO_STATE_MACHINE", "STANDARD").upper()
+# Intervalos do polling (em segundos): começa curto e cresce até o máximo
+POLLING_INICIAL = 0.1
+POLLING_MAXIMO = 2.0
+ESTADOS_FINAIS = ["SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED"]
+# Espera síncrona: para MARGEM_TIMEOUT_MS antes do timeout da Lambda e nunca passa de
+# ESPERA_MAXIMA_SINCRONA (o API Gateway corta a integração em 29 s); ao estourar, o
+# cliente recebe 202 com o job_id e segue pela rota de status
+MARGEM_TIMEOUT_MS = int(os.environ.get("MARGEM_TIMEOUT_MS", "2000"))
+ESPERA_MAXIMA_SINCRONA = float(os.environ.get("ESPERA_MAXIMA_SINCRONA", "25"))
+# Upload direto: o cliente envia a imagem para o S3 por um POST pré-assinado e o
+# evento de criação do objeto (só neste prefixo) inicia a Step Function
+PREFIXO_UPLOAD = os.environ.get("PREFIXO_UPLOAD", "uploads/")
+EXPIRACAO_UPLOAD = int(os.environ.get("EXPIRACAO_UPLOAD_SEGUNDOS", "900"))
+TAMANHO_MAXIMO_UPLOAD = int(os.environ.get("TAMANHO_MAXIMO_UPLOAD", str(20 * 1024 * 1024)))
+# Com o pré-processamento ligado, a versão otimizada de um upload direto vai para cá
+PREFIXO_OTIMIZADAS = os.environ.get("PREFIXO_OTIMIZADAS", "otimizadas/")
  
-# Inicializar clientes AWS
-s3_client = boto3.client("s3")
+# Clientes AWS da fábrica compartilhada: criados no primeiro uso e reaproveitados
+# entre as invocações do mesmo container
+s3_client = preguicoso("s3")
+sfn_client = preguicoso("stepfunctions", REGIAO)
+# Cache de resultados por conteúdo da imagem (backend escolhido por CACHE_BACKEND)
+cache = criar_cache(s3_client, S3_BUCKET)
+# Resultados indexados por CNPJ, data e forma de pagamento (RESULTADOS_BACKEND)
+repositorio = repositorio_notas.criar_repositorio()
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
  
+def resumo_evento(event):
+    # Campos do evento que interessam no log, sem o conteúdo do arquivo
+    if event.get("Records"):
+        return {"Records": [
+            {"eventName": r.get("eventName"), "key": r.get("s3", {}).get("object", {}).get("key"),
+             "size": r.get("s3", {}).get("object", {}).get("size")}
+            for r in event["Records"]
+        ]}
+    return {
+        "httpMethod": event.get("httpMethod"),
+        "path": event.get("path"),
+        "pathParameters": event.get("pathParameters"),
+        "tamanho_body": len(event.get("body") or ""),
+    }
+
+# O corpo pode trazer a imagem inteira em base64: o evento registrado (amostrado, por
+# @instrumentado) é só o resumo
+@instrumentado("recebe-notas", resumo=resumo_evento)
 def lambda_handler(event, context):
-    logger.info("🔹 Evento recebido: %s", json.dumps(event))
+    # Último estado da Step Function ("finaliza nota"): classificação, cache e repositório
+    if "finalizar" in event:
+        return finalizar_execucao(event["finalizar"])
+
+    # Evento do S3 (objeto criado em PREFIXO_UPLOAD): upload direto concluído
+    if event.get("Records"):
+        return processar_evento_s3(event)
+
+    # GET /api/v1/invoices?cnpj=...&data_inicio=...: consulta das notas já processadas
+    if event.get("httpMethod") == "GET" and (event.get("resource") or event.get("path") or "").rstrip("/").endswith("/invoices"):
+        return consultar_notas(event)
+
+    # GET /api/v1/invoice/{job_id}: consulta de um processamento assíncrono
+    if event.get("httpMethod") == "GET":
+        return consultar_job(event)
  
     try:
         # Certificar-se de que a requisição contém um body válido
@@ -29,6 +103,14 @@ def lambda_handler(event, context):
         except json.JSONDecodeError:
             logger.error("❌ Erro: Formato JSON inválido.")
             return {"statusCode": 400, "body": json.dumps({"error": "Formato JSON inválido."})}
+
+        # {"upload_direto": true}: devolve o destino pré-assinado em vez de receber a imagem
+        if body.get("upload_direto"):
+            return criar_upload_direto()
+
+        # {"files": [...]}: várias notas na mesma requisição
+        if "files" in body:
+            return processar_lote(body["files"])
  
         # Verificar se a chave 'file' está presente
         if "file" not in body or not body["file"]:
@@ -39,28 +121,78 @@ def lambda_handler(event, context):
         try:
             file_data = base64.b64decode(body["file"])
             logger.info(f"✅ Arquivo recebido. Tamanho: {len(file_data)} bytes")
+            metricas.registrar("arquivo_bytes", len(file_data), "Bytes")
         except Exception as e:
             logger.error(f"❌ Erro ao decodificar Base64: {str(e)}")
             return {"statusCode": 400, "body": json.dumps({"error": f"Erro ao decodificar Base64: {str(e)}"})}
+
+        # Imagem já processada antes (ex.: retry do cliente): devolve o resultado
+        # guardado sem gravar no S3 nem iniciar a Step Function
+        hash_arquivo = hash_conteudo(file_data)
+        with metricas.cronometro("cache_ms"):
+            em_cache = obter_seguro(cache, chave_cache(hash_arquivo))
+        metricas.contar("cache_acertos", int(em_cache is not None))
+        if em_cache is not None:
+            logger.info(f"✅ Resultado encontrado no cache ({hash_arquivo})")
+            if body.get("async"):
+                return {"statusCode": 200, "body": json.dumps({"status": "SUCCEEDED", "text": em_cache, "cache": True})}
+            return {"statusCode": 200, "body": json.dumps({"text": em_cache, "cache": True})}
  
         file_name = f"nota-{uuid.uuid4()}.jpg"
+
+        # Pré-processamento opcional (reduz, converte para cinza e recomprime); o hash
+        # do cache continua sendo o da imagem recebida
+        with metricas.cronometro("preprocessamento_ms"):
+            file_data, _ = preprocessamento.preprocessar(file_data)
  
         # Salvar no S3
-        s3_client.put_object(Bucket=S3_BUCKET, Key=file_name, Body=file_data)
+        with metricas.cronometro("s3_put_ms"):
+            s3_client.put_object(Bucket=S3_BUCKET, Key=file_name, Body=file_data)
         file_url = f"https://{S3_BUCKET}.s3.{REGIAO}.amazonaws.com/{file_name}"
  
         logger.info(f"✅ Upload concluído! URL: {file_url}")
+
+        # Modo assíncrono: devolve o id do job na hora e o cliente consulta o status depois
+        if body.get("async"):
+            job_id = iniciar_execucao(file_name, hash_arquivo)
+            logger.info(f"✅ Job {job_id} iniciado para {file_name}")
+            return {
+                "statusCode": 202,
+                "body": json.dumps({"job_id": job_id, "status": "RUNNING", "status_url": f"/api/v1/invoice/{job_id}"})
+            }
+
         logger.info("Iniciando a step_function notas")
-        response_json = start_step_function(file_name)
-        if isinstance(response_json, str):  # Se for string, converta para JSON
-            response_json = json.loads(response_json)
+        with metricas.cronometro("step_function_ms"):
+            execucao = start_step_function(file_name, hash_arquivo, tempo_disponivel(context))
+        status = execucao["status"]
+
+        # Prazo da requisição esgotado: o processamento continua e o cliente consulta depois
+        if status == "RUNNING":
+            logger.info(f"⏳ Job {execucao['job_id']} ainda em execução; respondendo 202")
+            return {
+                "statusCode": 202,
+                "body": json.dumps({
+                    "job_id": execucao["job_id"], "status": status, "status_url": f"/api/v1/invoice/{execucao['job_id']}"
+                })
+            }
+        if status != "SUCCEEDED":
+            logger.error(f"❌ Step Function terminou com status {status} ({execucao.get('job_id')})")
+            return {
+                "statusCode": 502,
+                "body": json.dumps({"error": "Processamento não concluído.", "status": status, "job_id": execucao.get("job_id")})
+            }
 
+        response_json = json.loads(execucao["output"])
+        if response_json.get("statusCode") != 200:
+            logger.error(f"❌ Step Function concluída sem resultado: {response_json.get('statusCode')}")
+            return {"statusCode": 502, "body": json.dumps({"error": "Processamento não concluído.", "status": status})}
+
+        # A classificação e as gravações no cache e no repositório já foram feitas pelo
+        # último estado da Step Function
         response = json.loads(response_json["body"])
 
         logger.info(f"fim da step_function notas:{response}")
         
-        mover_arquivo(S3_BUCKET,file_name, response["forma_pgto"])        
-        
         return {
             "statusCode": 200,
             "body": json.dumps({"text":response})
@@ -70,55 +202,313 @@ def lambda_handler(event, context):
         logger.error(f"❌ Erro inesperado: {str(e)}")
         return {"statusCode": 500, "body": json.dumps({"error": "erro na recebe nota"})}
 
-def start_step_function(key):
-    client = boto3.client('stepfunctions')
+def criar_upload_direto():
+    # O nome do objeto carrega o id do job: o evento do S3 usa o mesmo id como nome da
+    # execução, então o cliente já pode consultar GET /api/v1/invoice/{job_id}
+    job_id = f"upload-{uuid.uuid4()}"
+    key = f"{PREFIXO_UPLOAD}{job_id}.jpg"
+    destino = s3_client.generate_presigned_post(
+        Bucket=S3_BUCKET,
+        Key=key,
+        Conditions=[["content-length-range", 1, TAMANHO_MAXIMO_UPLOAD]],
+        ExpiresIn=EXPIRACAO_UPLOAD
+    )
+    logger.info(f"✅ Upload direto criado: {key}")
+    return {
+        "statusCode": 201,
+        "body": json.dumps({
+            "job_id": job_id,
+            "status": "AGUARDANDO_UPLOAD",
+            "upload": {"url": destino["url"], "fields": destino["fields"]},
+            "expira_em": EXPIRACAO_UPLOAD,
+            "status_url": f"/api/v1/invoice/{job_id}"
+        })
+    }
+
+def job_do_upload(key):
+    # uploads/upload-<uuid>.jpg -> upload-<uuid>
+    if not key.startswith(PREFIXO_UPLOAD):
+        return None
+    nome = os.path.splitext(key[len(PREFIXO_UPLOAD):])[0]
+    return nome if nome.startswith("upload-") and "/" not in nome else None
 
-    # ARN correto da Step Function
-    state_machine_arn = "arn:aws:states:us-east-1:491085429967:stateMachine:step_function_sprint4-6"
+def processar_evento_s3(event):
+    iniciados = []
+    for record in event["Records"]:
+        if not record.get("eventName", "").startswith("ObjectCreated"):
+            continue
+        key = unquote_plus(record["s3"]["object"]["key"])
+        job_id = job_do_upload(key)
+        if job_id is None:
+            logger.info(f"Ignorando objeto fora do prefixo de upload: {key}")
+            continue
+        # O S3 pode entregar o mesmo evento mais de uma vez: o nome da execução é a
+        # chave de idempotência, conferida antes do pré-processamento (que baixa e
+        # regrava a imagem)
+        if execucao_existe(job_id):
+            logger.info(f"Job {job_id} já iniciado")
+            continue
+        try:
+            iniciar_execucao(*preprocessar_upload(key, job_id), job_id=job_id)
+        except sfn_client.exceptions.ExecutionAlreadyExists:
+            # Evento repetido entregue ao mesmo tempo que o primeiro
+            logger.info(f"Job {job_id} já iniciado")
+            continue
+        logger.info(f"✅ Job {job_id} iniciado para {key}")
+        iniciados.append(job_id)
+    return {"statusCode": 200, "body": json.dumps({"jobs": iniciados})}
 
-    # Criar JSON de entrada
-    input_data = {
-        "key": key
+def execucao_existe(job_id):
+    try:
+        sfn_client.describe_execution(executionArn=arn_execucao(job_id))
+    except sfn_client.exceptions.ExecutionDoesNotExist:
+        return False
+    return True
+
+def preprocessar_upload(key, job_id):
+    # O arquivo do upload direto já está no S3. Devolve (chave para o OCR, hash): o hash
+    # dos bytes enviados vai na entrada da execução para o último estado gravar o cache,
+    # como nos outros caminhos. A versão otimizada é gravada em PREFIXO_OTIMIZADAS (fora
+    # do prefixo que dispara o evento) e segue para o OCR.
+    original = s3_client.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read()
+    hash_arquivo = hash_conteudo(original)
+    if not preprocessamento.PREPROCESSAR:
+        return key, hash_arquivo
+    otimizada, info = preprocessamento.preprocessar(original)
+    if not info["otimizada"]:
+        return key, hash_arquivo
+    chave_otimizada = f"{PREFIXO_OTIMIZADAS}{job_id}.jpg"
+    s3_client.put_object(Bucket=S3_BUCKET, Key=chave_otimizada, Body=otimizada, ContentType="image/jpeg")
+    return chave_otimizada, hash_arquivo
+
+def processar_lote(arquivos):
+    if not isinstance(arquivos, list) or not arquivos:
+        return {"statusCode": 400, "body": json.dumps({"error": "'files' deve ser uma lista não vazia."})}
+    if len(arquivos) > MAX_ARQUIVOS_LOTE:
+        return {"statusCode": 400, "body": json.dumps({"error": f"Máximo de {MAX_ARQUIVOS_LOTE} arquivos por lote."})}
+
+    # Cada arquivo é decodificado, consultado no cache, pré-processado e gravado no S3
+    # dentro da mesma thread (o cliente boto3 é compartilhado entre elas; o Pillow
+    # libera o GIL durante a maior parte do pré-processamento)
+    with metricas.cronometro("lote_ms"), ThreadPoolExecutor(max_workers=min(THREADS_UPLOAD, len(arquivos))) as executor:
+        itens = list(executor.map(processar_item, range(len(arquivos)), arquivos))
+    pendentes = [item for item in itens if "key" in item]
+    if pendentes:
+        metricas.registrar("lote_arquivos", len(pendentes), "Count")
+
+    # Uma única execução de lote processa todas as notas gravadas
+    gravados = [item for item in pendentes if "error" not in item]
+    lote_id = None
+    if gravados:
+        lote_id = f"lote-{uuid.uuid4()}"
+        sfn_client.start_execution(
+            stateMachineArn=STATE_MACHINE_ARN_LOTE,
+            name=lote_id,
+            input=json.dumps({"itens": [
+                {"key": item["key"], "hash": item["hash"], "job_id": item["job_id"]} for item in gravados
+            ]})
+        )
+        logger.info(f"✅ Lote {lote_id} iniciado com {len(gravados)} notas")
+
+    for item in itens:
+        item.pop("hash", None)
+        if "error" in item:
+            item.pop("key", None)
+            item.pop("job_id", None)
+        elif item.get("job_id"):
+            item.update({"status": "RUNNING", "status_url": f"/api/v1/invoice/{item['job_id']}"})
+    return {"statusCode": 202, "body": json.dumps({"lote_id": lote_id, "itens": itens})}
+
+def preparar_item(indice, arquivo):
+    # Cada arquivo pode vir como a string base64 ou como {"file": "<base64>"}
+    if isinstance(arquivo, dict):
+        arquivo = arquivo.get("file")
+    if not arquivo:
+        return {"indice": indice, "error": "Arquivo não encontrado."}
+    try:
+        file_data = base64.b64decode(arquivo)
+    except Exception as e:
+        return {"indice": indice, "error": f"Erro ao decodificar Base64: {str(e)}"}
+    if not file_data:
+        return {"indice": indice, "error": "Arquivo vazio."}
+
+    hash_arquivo = hash_conteudo(file_data)
+    em_cache = obter_seguro(cache, chave_cache(hash_arquivo))
+    if em_cache is not None:
+        return {"indice": indice, "status": "SUCCEEDED", "text": em_cache, "cache": True}
+
+    file_data, _ = preprocessamento.preprocessar(file_data)
+    return {
+        "indice": indice,
+        "key": f"nota-{uuid.uuid4()}.jpg",
+        "job_id": f"item-{uuid.uuid4()}",
+        "hash": hash_arquivo,
+        "conteudo": file_data,
     }
 
-    response = client.start_execution(
-        stateMachineArn=state_machine_arn,
-        name=f"exec-{uuid.uuid4()}",  # Nome único para evitar conflitos
+def gravar_item(item):
+    try:
+        with metricas.cronometro("s3_put_ms"):
+            s3_client.put_object(Bucket=S3_BUCKET, Key=item["key"], Body=item.pop("conteudo"))
+    except Exception as e:
+        logger.error(f"❌ Erro ao gravar {item['key']}: {str(e)}")
+        item["error"] = "Erro ao gravar o arquivo."
+
+def processar_item(indice, arquivo):
+    # Executado nas threads do lote; o conteúdo sai do item assim que é gravado
+    item = preparar_item(indice, arquivo)
+    if "conteudo" in item:
+        gravar_item(item)
+    return item
+
+def iniciar_execucao(key, hash_arquivo=None, job_id=None):
+    # Inicia a Step Function sem esperar; o nome da execução serve de id do job.
+    # O hash vai junto na entrada para o último estado gravar o resultado no cache.
+    job_id = job_id or f"exec-{uuid.uuid4()}"  # Nome único para evitar conflitos
+    input_data = {"key": key}
+    if hash_arquivo:
+        input_data["hash"] = hash_arquivo
+    sfn_client.start_execution(
+        stateMachineArn=STATE_MACHINE_ARN,
+        name=job_id,
         input=json.dumps(input_data)  # Convertendo JSON para string
     )
-    # Aguarda a conclusão da Step Function
-    
-    execution_arn = response["executionArn"]
+    return job_id
+
+def arn_execucao(job_id):
+    # arn:aws:states:<região>:<conta>:execution:<state machine>:<nome da execução>
+    state_machine = STATE_MACHINE_ARN_LOTE if job_id.startswith("lote-") else STATE_MACHINE_ARN
+    return state_machine.replace(":stateMachine:", ":execution:") + ":" + job_id
+
+def tempo_disponivel(context):
+    # Segundos que a espera síncrona pode usar nesta invocação
+    if context is None or not hasattr(context, "get_remaining_time_in_millis"):
+        return ESPERA_MAXIMA_SINCRONA
+    return max(0.0, min(ESPERA_MAXIMA_SINCRONA, (context.get_remaining_time_in_millis() - MARGEM_TIMEOUT_MS) / 1000))
+
+def start_step_function(key, hash_arquivo=None, timeout=None):
+    # Devolve {"status", "output", "job_id"}; "RUNNING" quando o prazo acabou antes do fim
+    # Criar JSON de entrada (o hash vai junto para o último estado gravar o cache)
+    input_data = {
+        "key": key
+    }
+    if hash_arquivo:
+        input_data["hash"] = hash_arquivo
+
+    # Caminho rápido: state machines EXPRESS respondem direto com o resultado
+    if TIPO_STATE_MACHINE == "EXPRESS":
+        execution_response = sfn_client.start_sync_execution(
+            stateMachineArn=STATE_MACHINE_ARN,
+            name=f"exec-{uuid.uuid4()}",
+            input=json.dumps(input_data)
+        )
+        # Execuções EXPRESS não podem ser consultadas depois: não há job_id para devolver
+        return {"status": execution_response["status"], "output": execution_response.get("output"), "job_id": None}
+
+    job_id = iniciar_execucao(key, hash_arquivo)
+    # Aguarda a conclusão da Step Function (ou o fim do prazo)
+    execution_response = aguardar_execucao(arn_execucao(job_id), timeout)
+    return {"status": execution_response["status"], "output": execution_response.get("output"), "job_id": job_id}
+
+def aguardar_execucao(execution_arn, timeout=None):
+    # Polling com intervalo crescente: execuções rápidas são vistas em ~100 ms em vez
+    # de esperar sempre 2 s, e as longas não geram chamadas demais
+    intervalo = POLLING_INICIAL
+    limite = time.monotonic() + timeout if timeout is not None else None
     while True:
-        execution_response = client.describe_execution(executionArn=execution_arn)
-        status = execution_response["status"]
+        execution_response = sfn_client.describe_execution(executionArn=execution_arn)
+        if execution_response["status"] in ESTADOS_FINAIS:
+            return execution_response  # Sai do loop quando a execução termina
+        if limite is not None and time.monotonic() + intervalo >= limite:
+            return execution_response
+        time.sleep(intervalo)
+        intervalo = min(intervalo * 2, POLLING_MAXIMO)
 
-        if status in ["SUCCEEDED", "FAILED", "TIMED_OUT", "ABORTED"]:
-            break  # Sai do loop quando a execução termina
-        
-        time.sleep(2)  # Espera 2 segundos antes de verificar novamente
-
-    if status == "SUCCEEDED":
-        # Retorna o output final da Step Function
-        output = execution_response.get("output", "")
-        return output
-
-def mover_arquivo(bucket, nome_arquivo, nova_pasta):
-    logger.info(f"Movendo para a bucket correta")
-    if nova_pasta.lower() =="dinheiro" or nova_pasta.lower() == "pix":
-        nova_pasta ="dinheiro"
-        chave_destino = f"{nova_pasta}/{nome_arquivo}"
-    else:
-        nova_pasta="outros"
-        chave_destino = f"{nova_pasta}/{nome_arquivo}"
-    
-
-    s3_client.copy_object(
-        Bucket=bucket,
-        CopySource={"Bucket": bucket, "Key": nome_arquivo},
-        Key=chave_destino
-    )
-    s3_client.delete_object(Bucket=bucket, Key=nome_arquivo)
+def consultar_job(event):
+    # Só leitura: a nota já foi classificada e gravada pelo último estado da execução
+    job_id = (event.get("pathParameters") or {}).get("job_id")
+    if not job_id:
+        return {"statusCode": 400, "body": json.dumps({"error": "job_id não informado."})}
+
+    try:
+        execution_response = sfn_client.describe_execution(executionArn=arn_execucao(job_id))
+    except sfn_client.exceptions.ExecutionDoesNotExist:
+        # Upload direto criado, mas o arquivo ainda não chegou ao S3
+        if job_id.startswith("upload-"):
+            return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": "AGUARDANDO_UPLOAD"})}
+        # Item de lote que ainda não começou (o Map limita quantos rodam ao mesmo tempo)
+        if job_id.startswith("item-"):
+            return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": "NA_FILA"})}
+        return {"statusCode": 404, "body": json.dumps({"error": "Job não encontrado."})}
+    except Exception as e:
+        logger.error(f"❌ Erro ao consultar job {job_id}: {str(e)}")
+        return {"statusCode": 500, "body": json.dumps({"error": "erro na consulta do job"})}
+
+    status = execution_response["status"]
+    # O lote só acompanha o andamento; o resultado de cada nota sai pelo job_id do item
+    if job_id.startswith("lote-"):
+        itens = json.loads(execution_response.get("input", "{}")).get("itens", [])
+        return {"statusCode": 200, "body": json.dumps({
+            "lote_id": job_id, "status": status, "itens": [item["job_id"] for item in itens]
+        })}
+    if status == "RUNNING":
+        return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": status})}
+    if status != "SUCCEEDED":
+        return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": status, "error": "Processamento não concluído."})}
+
+    try:
+        response_json = json.loads(execution_response.get("output", ""))
+        response = json.loads(response_json["body"])
+    except Exception as e:
+        logger.error(f"❌ Erro ao ler resultado do job {job_id}: {str(e)}")
+        return {"statusCode": 500, "body": json.dumps({"error": "erro na consulta do job"})}
+
+    return {"statusCode": 200, "body": json.dumps({"job_id": job_id, "status": status, "text": response})}
+
+def consultar_notas(event):
+    # Paginada: a resposta traz "proximo" (cursor) enquanto houver mais notas; a página
+    # seguinte é pedida com o mesmo filtro e ?cursor=<proximo>
+    if repositorio is None:
+        return {"statusCode": 501, "body": json.dumps({"error": "Consulta de notas desligada (RESULTADOS_BACKEND)."})}
+    try:
+        filtros = repositorio_notas.filtros_consulta(event.get("queryStringParameters"))
+        with metricas.cronometro("consulta_ms"):
+            itens, proximo = repositorio.consultar(**filtros)
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+    except Exception as e:
+        logger.error(f"❌ Erro na consulta de notas: {str(e)}")
+        return {"statusCode": 500, "body": json.dumps({"error": "erro na consulta de notas"})}
+    metricas.registrar("consulta_itens", len(itens), "Count")
+    return {"statusCode": 200, "body": json.dumps({"itens": itens, "proximo": proximo}, ensure_ascii=False)}
+
+def finalizar_execucao(evento):
+    # Chamada pelo estado "finaliza nota", o último da Step Function de uma nota (e,
+    # pelo Map, de cada item de lote): toda execução concluída é classificada e gravada
+    # no cache e no repositório, mesmo que ninguém consulte o job. Recebe a entrada da
+    # execução e a saída da llm; repetir a chamada (Retry) não muda nada.
+    entrada = evento.get("entrada") or {}
+    resultado = evento.get("resultado") or {}
+    if resultado.get("statusCode") != 200:
+        logger.warning(f"⚠️ Nota {entrada.get('key')} sem resultado para finalizar: {resultado.get('statusCode')}")
+        metricas.contar("finalizacao_sem_resultado")
+        return {"finalizado": False}
+    response = json.loads(resultado["body"])
+    finalizar_job(entrada, response)
+    metricas.contar("job_finalizado")
+    return {"finalizado": True}
+
+def finalizar_job(input_data, response):
+    # Uma falha na classificação ou no repositório sobe para a Step Function, que repete
+    # o estado; o cache é só um atalho e não derruba a finalização (gravar_seguro)
+    with metricas.cronometro("s3_classificacao_ms"):
+        finalizar_arquivo(S3_BUCKET, input_data["key"], response["forma_pgto"])
+    if input_data.get("hash"):
+        gravar_seguro(cache, chave_cache(input_data["hash"]), response)
+    if repositorio is not None:
+        with metricas.cronometro("repositorio_ms"):
+            repositorio.gravar_lote([repositorio_notas.registro(input_data["key"], response)])
 
-    
-    return chave_destino
\ No newline at end of file
+def finalizar_arquivo(bucket, nome_arquivo, forma_pgto):
+    # Só grava o marcador do índice: a imagem em si não é lida nem alterada
+    return classificar_arquivo(s3_client, bucket, nome_arquivo, forma_pgto)
@@ -0,0 +1,103 @@
+import io
+import os
+import logging
+
+logger = logging.getLogger()
+
+# Pré-processamento opcional da imagem antes do OCR: corrige a orientação do EXIF,
+# recorta a região clara da nota (papel branco sobre fundo mais escuro), reduz para
+# a resolução alvo, converte para tons de cinza e recomprime em JPEG. Usa o Pillow,
+# que não vem no runtime da Lambda (precisa de uma layer); sem ele, ou se a imagem
+# otimizada não ficar menor, a original segue sem alteração.
+
+PREPROCESSAR = os.environ.get("PREPROCESSAR_IMAGEM", "false").lower() in ("1", "true", "sim")
+# Largura física de um cupom térmico comum e resolução alvo para o Textract (que
+# recomenda pelo menos 150 DPI); a imagem só é reduzida, nunca ampliada
+LARGURA_NOTA_MM = 80
+DPI_ALVO = int(os.environ.get("PREPROCESSAMENTO_DPI", "300"))
+QUALIDADE_JPEG = int(os.environ.get("PREPROCESSAMENTO_QUALIDADE", "85"))
+TONS_DE_CINZA = os.environ.get("PREPROCESSAMENTO_CINZA", "true").lower() in ("1", "true", "sim")
+RECORTAR = os.environ.get("PREPROCESSAMENTO_RECORTE", "false").lower() in ("1", "true", "sim")
+# Recorte: pixels acima deste brilho contam como papel; recortes que sobram com menos
+# que esta fração da área original são descartados (provável erro de detecção)
+LIMIAR_PAPEL = 150
+AREA_MINIMA_RECORTE = 0.2
+MARGEM_RECORTE = 0.02
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+def disponivel():
+    return Image is not None
+
+
+def largura_alvo(dpi=DPI_ALVO):
+    return round(LARGURA_NOTA_MM / 25.4 * dpi)
+
+
+def caixa_nota(imagem):
+    # Caixa que envolve os pixels claros (o papel), com uma pequena margem; None se
+    # a região for pequena demais para ser a nota
+    mascara = imagem.convert("L").point(lambda valor: 255 if valor > LIMIAR_PAPEL else 0)
+    caixa = mascara.getbbox()
+    if not caixa:
+        return None
+    largura, altura = imagem.size
+    esquerda, topo, direita, base = caixa
+    if (direita - esquerda) * (base - topo) < AREA_MINIMA_RECORTE * largura * altura:
+        return None
+    margem_x = int(largura * MARGEM_RECORTE)
+    margem_y = int(altura * MARGEM_RECORTE)
+    return (
+        max(0, esquerda - margem_x), max(0, topo - margem_y),
+        min(largura, direita + margem_x), min(altura, base + margem_y),
+    )
+
+
+def otimizar_imagem(conteudo, dpi=DPI_ALVO, cinza=TONS_DE_CINZA, qualidade=QUALIDADE_JPEG, recortar=RECORTAR):
+    # Retorna (bytes, info). info traz os tamanhos antes/depois e o que foi aplicado.
+    info = {"bytes_original": len(conteudo), "bytes": len(conteudo), "otimizada": False}
+    if Image is None:
+        logger.warning("⚠️ Pillow indisponível; imagem enviada sem pré-processamento")
+        return conteudo, info
+    try:
+        imagem = ImageOps.exif_transpose(Image.open(io.BytesIO(conteudo)))
+        info["dimensoes_original"] = imagem.size
+        # A varredura da caixa (máscara da imagem inteira) só roda com o recorte ligado;
+        # a nota recortada ocupa a imagem toda, então a escala sai da largura dela
+        caixa = caixa_nota(imagem) if recortar else None
+        if caixa:
+            imagem = imagem.crop(caixa)
+            info["recortada"] = True
+        largura_nota = imagem.width
+        alvo = largura_alvo(dpi) if dpi else None
+        if alvo and largura_nota > alvo:
+            escala = alvo / largura_nota
+            imagem = imagem.resize(
+                (max(1, round(imagem.width * escala)), max(1, round(imagem.height * escala))), Image.LANCZOS
+            )
+        imagem = imagem.convert("L") if cinza else imagem.convert("RGB")
+        saida = io.BytesIO()
+        imagem.save(saida, format="JPEG", quality=qualidade, optimize=True)
+    except Exception as e:
+        logger.warning(f"⚠️ Pré-processamento falhou, usando a imagem original: {str(e)}")
+        return conteudo, info
+
+    otimizada = saida.getvalue()
+    info["dimensoes"] = imagem.size
+    if len(otimizada) >= len(conteudo):
+        return conteudo, info
+    info.update({"bytes": len(otimizada), "otimizada": True})
+    return otimizada, info
+
+
+def preprocessar(conteudo):
+    # Ponto de entrada da recebe-nota: só age com PREPROCESSAR_IMAGEM ligado
+    if not PREPROCESSAR:
+        return conteudo, {"bytes_original": len(conteudo), "bytes": len(conteudo), "otimizada": False}
+    conteudo_final, info = otimizar_imagem(conteudo)
+    logger.info(f"🖼️ Pré-processamento: {info['bytes_original']} -> {info['bytes']} bytes")
+    return conteudo_final, info
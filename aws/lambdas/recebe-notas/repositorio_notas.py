@@ -0,0 +1,395 @@
+import os
+import re
+import json
+import time
+import base64
+import sqlite3
+import logging
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+from limitador import codigo_erro
+
+logger = logging.getLogger()
+
+# Repositório dos resultados processados, com índices para as consultas da contabilidade
+# ("notas do CNPJ X em março pagas com PIX") sem listar prefixos do bucket. Cada nota é
+# gravada pela chave da imagem, com três campos normalizados para os índices:
+# CNPJ do emissor (só dígitos), data de emissão (AAAA-MM-DD) e forma de pagamento
+# (minúsculas). As consultas são paginadas por cursor (keyset): cada página continua
+# exatamente de onde a anterior parou, sem OFFSET.
+#
+# Todos os backends expõem gravar_lote(registros, sobrescrever=True) e
+# consultar(...) -> (itens, cursor). Com sobrescrever=False, notas que já estão no
+# repositório ficam como estão (ex.: a reextração em lote não troca o resultado já
+# refinado pela LLM pelo da extração pura).
+
+# Data das notas sem data de emissão válida: ordena antes de todas e fica fora de
+# qualquer filtro de período (atributos de chave do DynamoDB não podem ser vazios)
+DATA_DESCONHECIDA = "0000-00-00"
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 100
+# batch_write_item aceita até 25 itens por chamada
+LOTE_DYNAMODB = 25
+TENTATIVAS_LOTE = 5
+# put_item condicionais feitos ao mesmo tempo (batch_write_item não aceita condição)
+THREADS_CONDICIONAL = 8
+
+FORMATOS_DATA = (
+    re.compile(r"^(?P<dia>\d{2})[/.\-](?P<mes>\d{2})[/.\-](?P<ano>\d{4}|\d{2})$"),
+    re.compile(r"^(?P<ano>\d{4})-(?P<mes>\d{2})-(?P<dia>\d{2})$"),
+)
+
+
+def normalizar_cnpj(valor):
+    digitos = re.sub(r"\D", "", str(valor or ""))
+    return digitos if len(digitos) == 14 else None
+
+
+def normalizar_data(valor):
+    # "dd/mm/aaaa" (o formato das notas), "dd-mm-aa" ou "aaaa-mm-dd" -> "aaaa-mm-dd"
+    for formato in FORMATOS_DATA:
+        encontrado = formato.match(str(valor or "").strip())
+        if not encontrado:
+            continue
+        ano = int(encontrado["ano"])
+        if ano < 100:
+            ano += 2000
+        try:
+            return date(ano, int(encontrado["mes"]), int(encontrado["dia"])).isoformat()
+        except ValueError:
+            return None
+    return None
+
+
+def normalizar_forma(valor):
+    forma = str(valor or "").strip().lower()
+    return forma if forma and forma != "none" else None
+
+
+def registro(key, dados, gravado_em=None):
+    # Registro gravado no repositório a partir do JSON final de uma nota
+    return {
+        "id": key,
+        "cnpj": normalizar_cnpj(dados.get("CNPJ_emissor")),
+        "data": normalizar_data(dados.get("data_emissao")) or DATA_DESCONHECIDA,
+        "forma": normalizar_forma(dados.get("forma_pgto")),
+        "dados": dados,
+        "gravado_em": gravado_em if gravado_em is not None else time.time(),
+    }
+
+
+def _unicos(registros):
+    # A mesma nota repetida no lote fica só com a última versão (o DynamoDB recusa
+    # chaves repetidas num batch_write_item)
+    return list({r["id"]: r for r in registros}.values())
+
+
+def _item_resultado(key, dados, gravado_em):
+    return {"key": key, **dados, "gravado_em": gravado_em}
+
+
+def codificar_cursor(posicao):
+    if posicao is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(posicao, separators=(",", ":")).encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido.")
+
+
+def filtros_consulta(parametros):
+    # Valida os parâmetros da rota de consulta (query string) e devolve os argumentos
+    # de consultar(); erros de validação saem como ValueError com a mensagem ao cliente
+    parametros = parametros or {}
+    filtros = {}
+    if parametros.get("cnpj"):
+        filtros["cnpj"] = normalizar_cnpj(parametros["cnpj"])
+        if not filtros["cnpj"]:
+            raise ValueError("CNPJ inválido.")
+    for nome in ("data_inicio", "data_fim"):
+        if parametros.get(nome):
+            filtros[nome] = normalizar_data(parametros[nome])
+            if not filtros[nome]:
+                raise ValueError(f"Data inválida em {nome} (use dd/mm/aaaa ou aaaa-mm-dd).")
+    if parametros.get("forma_pgto"):
+        filtros["forma_pgto"] = normalizar_forma(parametros["forma_pgto"])
+    if not (filtros.get("cnpj") or filtros.get("forma_pgto") or filtros.get("data_inicio")):
+        raise ValueError("Informe cnpj, forma_pgto ou data_inicio.")
+    try:
+        limite = int(parametros.get("limite") or LIMITE_PADRAO)
+    except ValueError:
+        raise ValueError("limite deve ser um número.")
+    filtros["limite"] = max(1, min(LIMITE_MAXIMO, limite))
+    filtros["cursor"] = parametros.get("cursor")
+    return filtros
+
+
+class RepositorioSQLite:
+    # Backend local (testes, execução fora da AWS e exportações em lote)
+    def __init__(self, caminho=":memory:"):
+        # A relocação das imagens renomeia notas a partir de várias threads
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self.trava = threading.Lock()
+        self.conexao.execute(
+            "CREATE TABLE IF NOT EXISTS notas ("
+            " id TEXT PRIMARY KEY, cnpj TEXT, data TEXT NOT NULL, forma TEXT,"
+            " dados TEXT NOT NULL, gravado_em REAL NOT NULL)"
+        )
+        # Cada índice termina em (data, id), a mesma ordem da paginação
+        self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_cnpj_data ON notas (cnpj, data, id)")
+        self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_forma_data ON notas (forma, data, id)")
+        self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_data ON notas (data, id)")
+        self.conexao.commit()
+
+    def gravar_lote(self, registros, sobrescrever=True):
+        registros = _unicos(registros)
+        comando = "INSERT OR REPLACE" if sobrescrever else "INSERT OR IGNORE"
+        # Uma única transação para o lote inteiro
+        with self.trava, self.conexao:
+            antes = self.conexao.total_changes
+            self.conexao.executemany(
+                f"{comando} INTO notas (id, cnpj, data, forma, dados, gravado_em) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (r["id"], r["cnpj"], r["data"], r["forma"], json.dumps(r["dados"], ensure_ascii=False), r["gravado_em"])
+                    for r in registros
+                ]
+            )
+            # Notas gravadas (as ignoradas por já existirem não contam)
+            return self.conexao.total_changes - antes
+
+    def renomear(self, antiga, nova):
+        # A nota mudou de chave (relocação da imagem): a linha passa para a chave nova
+        with self.trava, self.conexao:
+            self.conexao.execute("DELETE FROM notas WHERE id = ? AND EXISTS (SELECT 1 FROM notas WHERE id = ?)", (nova, antiga))
+            return self.conexao.execute("UPDATE notas SET id = ? WHERE id = ?", (nova, antiga)).rowcount > 0
+
+    def consultar(self, cnpj=None, data_inicio=None, data_fim=None, forma_pgto=None, limite=LIMITE_PADRAO, cursor=None):
+        condicoes = []
+        valores = []
+        for coluna, operador, valor in (
+            ("cnpj", "=", cnpj), ("forma", "=", forma_pgto), ("data", ">=", data_inicio), ("data", "<=", data_fim)
+        ):
+            if valor is not None:
+                condicoes.append(f"{coluna} {operador} ?")
+                valores.append(valor)
+        posicao = decodificar_cursor(cursor)
+        if posicao is not None:
+            condicoes.append("(data, id) > (?, ?)")
+            valores.extend(posicao)
+        sql = "SELECT id, data, dados, gravado_em FROM notas"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        # Uma linha a mais só para saber se há próxima página
+        linhas = self.conexao.execute(sql + " ORDER BY data, id LIMIT ?", valores + [limite + 1]).fetchall()
+        proximo = None
+        if len(linhas) > limite:
+            linhas = linhas[:limite]
+            proximo = codificar_cursor([linhas[-1][1], linhas[-1][0]])
+        return [_item_resultado(id_, json.loads(dados), gravado_em) for id_, _, dados, gravado_em in linhas], proximo
+
+
+class RepositorioDynamoDB:
+    # Tabela com chave de partição "id" (string) e três índices secundários globais
+    # (projeção ALL), todos com chave de ordenação "data" (string):
+    #   cnpj-data (partição "cnpj"), forma-data (partição "forma") e
+    #   mes-data (partição "mes", AAAA-MM), usado nas consultas só por período.
+    # Notas sem CNPJ ou sem forma de pagamento não entram nos índices respectivos.
+    INDICE_CNPJ = "cnpj-data"
+    INDICE_FORMA = "forma-data"
+    INDICE_MES = "mes-data"
+
+    def __init__(self, dynamodb_client, tabela, dormir=time.sleep):
+        self.dynamodb = dynamodb_client
+        self.tabela = tabela
+        self.dormir = dormir
+
+    @staticmethod
+    def _item(registro):
+        item = {
+            "id": {"S": registro["id"]},
+            "data": {"S": registro["data"]},
+            "mes": {"S": registro["data"][:7]},
+            "dados": {"S": json.dumps(registro["dados"], ensure_ascii=False)},
+            "gravado_em": {"N": repr(registro["gravado_em"])},
+        }
+        if registro["cnpj"]:
+            item["cnpj"] = {"S": registro["cnpj"]}
+        if registro["forma"]:
+            item["forma"] = {"S": registro["forma"]}
+        return item
+
+    def gravar_lote(self, registros, sobrescrever=True):
+        registros = _unicos(registros)
+        if not sobrescrever:
+            return self._gravar_novos(registros)
+        pedidos = [{"PutRequest": {"Item": self._item(r)}} for r in registros]
+        for inicio in range(0, len(pedidos), LOTE_DYNAMODB):
+            pendentes = pedidos[inicio:inicio + LOTE_DYNAMODB]
+            for tentativa in range(TENTATIVAS_LOTE):
+                resposta = self.dynamodb.batch_write_item(RequestItems={self.tabela: pendentes})
+                pendentes = resposta.get("UnprocessedItems", {}).get(self.tabela, [])
+                if not pendentes:
+                    break
+                # Itens não processados (capacidade da tabela): tenta de novo com backoff
+                self.dormir(min(1.0, 0.05 * 2 ** tentativa))
+            if pendentes:
+                raise RuntimeError(f"{len(pendentes)} notas não gravadas após {TENTATIVAS_LOTE} tentativas")
+        return len(registros)
+
+    def _gravar_novos(self, registros):
+        # Um put_item condicional por nota: as que já existem são puladas
+        def gravar(registro):
+            try:
+                self.dynamodb.put_item(
+                    TableName=self.tabela,
+                    Item=self._item(registro),
+                    ConditionExpression="attribute_not_exists(id)",
+                )
+            except Exception as e:
+                if codigo_erro(e) != "ConditionalCheckFailedException":
+                    raise
+                return False
+            return True
+
+        if not registros:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(THREADS_CONDICIONAL, len(registros))) as executor:
+            return sum(executor.map(gravar, registros))
+
+    def renomear(self, antiga, nova):
+        # A chave de partição não muda no lugar: grava o item com a chave nova e só
+        # depois apaga o antigo, para a nota nunca sumir do repositório
+        item = self.dynamodb.get_item(TableName=self.tabela, Key={"id": {"S": antiga}}, ConsistentRead=True).get("Item")
+        if not item:
+            return False
+        self.dynamodb.put_item(TableName=self.tabela, Item=dict(item, id={"S": nova}))
+        self.dynamodb.delete_item(TableName=self.tabela, Key={"id": {"S": antiga}})
+        return True
+
+    def _consultar_particao(self, indice, atributo, valor, data_inicio, data_fim, limite, inicio, filtro=None):
+        # Uma partição de um índice, página por página, até juntar `limite` itens; a
+        # última chave lida volta junto para continuar depois
+        parametros = {
+            "TableName": self.tabela,
+            "IndexName": indice,
+            "KeyConditionExpression": "#particao = :particao AND #data BETWEEN :inicio AND :fim",
+            "ExpressionAttributeNames": {"#particao": atributo, "#data": "data"},
+            "ExpressionAttributeValues": {
+                ":particao": {"S": valor},
+                ":inicio": {"S": data_inicio or DATA_DESCONHECIDA},
+                ":fim": {"S": data_fim or "9999-12-31"},
+            },
+        }
+        if filtro:
+            parametros["FilterExpression"] = "#filtro = :filtro"
+            parametros["ExpressionAttributeNames"]["#filtro"] = filtro[0]
+            parametros["ExpressionAttributeValues"][":filtro"] = {"S": filtro[1]}
+        itens = []
+        ultima = inicio
+        while len(itens) < limite:
+            if ultima:
+                parametros["ExclusiveStartKey"] = ultima
+            parametros["Limit"] = limite - len(itens)
+            resposta = self.dynamodb.query(**parametros)
+            itens.extend(resposta.get("Items", []))
+            ultima = resposta.get("LastEvaluatedKey")
+            if not ultima:
+                break
+        return itens, ultima
+
+    def consultar(self, cnpj=None, data_inicio=None, data_fim=None, forma_pgto=None, limite=LIMITE_PADRAO, cursor=None):
+        posicao = decodificar_cursor(cursor) or {}
+        if cnpj or forma_pgto:
+            # CNPJ é o índice mais seletivo; a forma de pagamento vira filtro
+            if cnpj:
+                indice, atributo, valor = self.INDICE_CNPJ, "cnpj", cnpj
+                filtro = ("forma", forma_pgto) if forma_pgto else None
+            else:
+                indice, atributo, valor, filtro = self.INDICE_FORMA, "forma", forma_pgto, None
+            itens, ultima = self._consultar_particao(
+                indice, atributo, valor, data_inicio, data_fim, limite, posicao.get("ultima"), filtro
+            )
+            proximo = codificar_cursor({"ultima": ultima}) if ultima else None
+            return [self._resultado(item) for item in itens], proximo
+
+        # Só período: percorre as partições mensais do índice mes-data, em ordem
+        fim = data_fim or date.today().isoformat()
+        mes = posicao.get("mes") or data_inicio[:7]
+        ultima = posicao.get("ultima")
+        itens = []
+        while len(itens) < limite and mes <= fim[:7]:
+            novos, ultima = self._consultar_particao(
+                self.INDICE_MES, "mes", mes, data_inicio, fim, limite - len(itens), ultima
+            )
+            itens.extend(novos)
+            if not ultima:
+                mes = _proximo_mes(mes)
+        proximo = None
+        if ultima or (len(itens) >= limite and mes <= fim[:7]):
+            proximo = codificar_cursor({"mes": mes, "ultima": ultima})
+        return [self._resultado(item) for item in itens], proximo
+
+    @staticmethod
+    def _resultado(item):
+        return _item_resultado(item["id"]["S"], json.loads(item["dados"]["S"]), float(item["gravado_em"]["N"]))
+
+
+def _proximo_mes(mes):
+    ano, numero = int(mes[:4]), int(mes[5:7])
+    return f"{ano + numero // 12:04d}-{numero % 12 + 1:02d}"
+
+
+def criar_repositorio():
+    # Escolhe o backend pela variável RESULTADOS_BACKEND: "dynamodb", "sqlite" ou
+    # "desligado" (padrão: os resultados não são guardados e a consulta responde 501)
+    backend = os.environ.get("RESULTADOS_BACKEND", "desligado").lower()
+    if backend == "dynamodb":
+        from clientes_aws import preguicoso
+        return RepositorioDynamoDB(preguicoso("dynamodb"), os.environ["RESULTADOS_TABELA"])
+    if backend == "sqlite":
+        return RepositorioSQLite(os.environ.get("RESULTADOS_SQLITE_CAMINHO", "/tmp/notas.db"))
+    return None
+
+
+class GravadorLote:
+    # Junta os registros e grava de `tamanho` em `tamanho` (e o resto ao sair do with)
+    def __init__(self, repositorio, tamanho=LOTE_DYNAMODB * 4, sobrescrever=True):
+        self.repositorio = repositorio
+        self.tamanho = tamanho
+        self.sobrescrever = sobrescrever
+        self.pendentes = []
+        self.gravados = 0
+
+    def adicionar(self, key, dados):
+        self.pendentes.append(registro(key, dados))
+        if len(self.pendentes) >= self.tamanho:
+            self.descarregar()
+
+    def descarregar(self):
+        if self.pendentes:
+            self.gravados += self.repositorio.gravar_lote(self.pendentes, self.sobrescrever)
+            self.pendentes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.descarregar()
+
+
+def gravar_seguro(repositorio, key, dados):
+    # Falha no repositório nunca derruba a requisição: o resultado já foi entregue
+    if repositorio is None:
+        return
+    try:
+        repositorio.gravar_lote([registro(key, dados)])
+    except Exception as e:
+        logger.warning(f"⚠️ Erro ao gravar a nota no repositório: {str(e)}")
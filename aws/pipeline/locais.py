@@ -0,0 +1,224 @@
+import io
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+# Substitutos locais para os clientes boto3 usados no pipeline (S3, Textract e Bedrock).
+# Expõem só os métodos que o código chama, com os mesmos nomes e formatos de resposta,
+# e reproduzem respostas gravadas em disco para rodar sem rede.
+
+
+class NoSuchKey(Exception):
+    # Imita o ClientError do botocore (mesmo formato em .response)
+    def __init__(self, key):
+        super().__init__(f"NoSuchKey: {key}")
+        self.response = {"Error": {"Code": "NoSuchKey", "Message": key}}
+
+
+class _Excecoes:
+    NoSuchKey = NoSuchKey
+
+
+class S3Memoria:
+    # Bucket(s) em memória: {(bucket, key): (bytes, metadados, LastModified)}
+    exceptions = _Excecoes
+
+    def __init__(self):
+        self.objetos = {}
+        self.tags = {}
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode()
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        self.objetos[(Bucket, Key)] = (bytes(Body), dict(Metadata or {}), datetime.now(timezone.utc))
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objetos:
+            raise NoSuchKey(Key)
+        corpo, metadados, modificado = self.objetos[(Bucket, Key)]
+        return {"Body": io.BytesIO(corpo), "Metadata": dict(metadados), "LastModified": modificado,
+                "ContentLength": len(corpo)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        resposta = self.get_object(Bucket, Key)
+        del resposta["Body"]
+        return resposta
+
+    def copy_object(self, Bucket, CopySource, Key, **kwargs):
+        origem = (CopySource["Bucket"], CopySource["Key"])
+        if origem not in self.objetos:
+            raise NoSuchKey(CopySource["Key"])
+        corpo, metadados, _ = self.objetos[origem]
+        self.objetos[(Bucket, Key)] = (corpo, dict(metadados), datetime.now(timezone.utc))
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objetos.pop((Bucket, Key), None)
+        self.tags.pop((Bucket, Key), None)
+        return {}
+
+    def put_object_tagging(self, Bucket, Key, Tagging, **kwargs):
+        if (Bucket, Key) not in self.objetos:
+            raise NoSuchKey(Key)
+        self.tags[(Bucket, Key)] = list(Tagging["TagSet"])
+        return {}
+
+    def get_object_tagging(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objetos:
+            raise NoSuchKey(Key)
+        return {"TagSet": list(self.tags.get((Bucket, Key), []))}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        chaves = sorted(k for b, k in self.objetos if b == Bucket and k.startswith(Prefix))
+        return {"Contents": [{"Key": k, "Size": len(self.objetos[(Bucket, k)][0])} for k in chaves],
+                "KeyCount": len(chaves), "IsTruncated": False}
+
+
+def _nome_gravacao(key):
+    # Respostas do Textract ficam em <diretorio>/<nome do arquivo sem extensão>.json
+    return os.path.splitext(os.path.basename(key))[0] + ".json"
+
+
+class TextractGravado:
+    # Reproduz respostas do Textract gravadas por GravadorTextract. O modo assíncrono
+    # usa a mesma gravação: o job fica IN_PROGRESS nas primeiras `consultas_em_andamento`
+    # consultas e depois os blocos saem paginados de `MaxResults` em `MaxResults`.
+    def __init__(self, diretorio, consultas_em_andamento=1):
+        self.diretorio = diretorio
+        self.consultas_em_andamento = consultas_em_andamento
+        self.chamadas = 0
+        self.jobs = {}
+
+    def _gravacao(self, key):
+        caminho = os.path.join(self.diretorio, _nome_gravacao(key))
+        if not os.path.exists(caminho):
+            raise FileNotFoundError(f"Sem resposta do Textract gravada para {key} ({caminho})")
+        with open(caminho, encoding="utf-8") as arquivo:
+            return json.load(arquivo)
+
+    def detect_document_text(self, Document, **kwargs):
+        self.chamadas += 1
+        return self._gravacao(Document["S3Object"]["Name"])
+
+    def start_document_text_detection(self, DocumentLocation, **kwargs):
+        self.chamadas += 1
+        job_id = f"job-{len(self.jobs) + 1}"
+        self.jobs[job_id] = {"key": DocumentLocation["S3Object"]["Name"], "consultas": 0}
+        return {"JobId": job_id}
+
+    def get_document_text_detection(self, JobId, MaxResults=1000, NextToken=None, **kwargs):
+        self.chamadas += 1
+        job = self.jobs[JobId]
+        job["consultas"] += 1
+        if job["consultas"] <= self.consultas_em_andamento:
+            return {"JobStatus": "IN_PROGRESS"}
+        blocos = self._gravacao(job["key"])["Blocks"]
+        inicio = int(NextToken or 0)
+        resposta = {"JobStatus": "SUCCEEDED", "Blocks": blocos[inicio:inicio + MaxResults],
+                    "DocumentMetadata": {"Pages": max((b.get("Page", 1) for b in blocos), default=1)}}
+        if inicio + MaxResults < len(blocos):
+            resposta["NextToken"] = str(inicio + MaxResults)
+        return resposta
+
+
+class GravadorTextract:
+    # Repassa as chamadas para o Textract real e grava cada resposta para replay
+    def __init__(self, cliente, diretorio):
+        self.cliente = cliente
+        self.diretorio = diretorio
+        self.jobs = {}
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _gravar(self, key, blocos):
+        with open(os.path.join(self.diretorio, _nome_gravacao(key)), "w", encoding="utf-8") as arquivo:
+            json.dump({"Blocks": blocos}, arquivo, ensure_ascii=False)
+
+    def detect_document_text(self, Document, **kwargs):
+        resposta = self.cliente.detect_document_text(Document=Document, **kwargs)
+        self._gravar(Document["S3Object"]["Name"], resposta["Blocks"])
+        return resposta
+
+    # No modo assíncrono, junta os blocos de todas as páginas de resultado do job e
+    # grava um único arquivo quando a última página chega
+    def start_document_text_detection(self, DocumentLocation, **kwargs):
+        resposta = self.cliente.start_document_text_detection(DocumentLocation=DocumentLocation, **kwargs)
+        self.jobs[resposta["JobId"]] = (DocumentLocation["S3Object"]["Name"], [])
+        return resposta
+
+    def get_document_text_detection(self, JobId, **kwargs):
+        resposta = self.cliente.get_document_text_detection(JobId=JobId, **kwargs)
+        if resposta.get("JobStatus") == "SUCCEEDED":
+            key, blocos = self.jobs[JobId]
+            blocos.extend(resposta["Blocks"])
+            if not resposta.get("NextToken"):
+                self._gravar(key, blocos)
+        return resposta
+
+
+def hash_prompt(corpo):
+    # Respostas do Bedrock são indexadas pelo prompt enviado
+    return hashlib.sha256(json.loads(corpo)["inputText"].encode()).hexdigest()
+
+
+class BedrockGravado:
+    # Reproduz respostas do Titan gravadas por GravadorBedrock (<diretorio>/<hash>.txt).
+    # Sem gravação para o prompt, responde `resposta_padrao` (por padrão "{}", ou seja,
+    # a LLM não altera nenhum campo). O streaming entrega a mesma resposta em pedaços.
+    def __init__(self, diretorio=None, resposta_padrao="{}", tamanho_pedaco=16):
+        self.diretorio = diretorio
+        self.resposta_padrao = resposta_padrao
+        self.tamanho_pedaco = tamanho_pedaco
+        self.chamadas = 0
+
+    def _texto(self, body):
+        self.chamadas += 1
+        if self.diretorio:
+            caminho = os.path.join(self.diretorio, hash_prompt(body) + ".txt")
+            if os.path.exists(caminho):
+                with open(caminho, encoding="utf-8") as arquivo:
+                    return arquivo.read()
+        return self.resposta_padrao
+
+    def invoke_model(self, body, **kwargs):
+        resposta = {"results": [{"outputText": self._texto(body)}]}
+        return {"body": io.BytesIO(json.dumps(resposta).encode())}
+
+    def invoke_model_with_response_stream(self, body, **kwargs):
+        texto = self._texto(body)
+        eventos = [
+            {"chunk": {"bytes": json.dumps({"outputText": texto[i:i + self.tamanho_pedaco]}).encode()}}
+            for i in range(0, len(texto), self.tamanho_pedaco)
+        ]
+        return {"body": iter(eventos)}
+
+
+class GravadorBedrock:
+    # Repassa as chamadas para o Bedrock real e grava o texto gerado para replay
+    def __init__(self, cliente, diretorio):
+        self.cliente = cliente
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _gravar(self, body, texto):
+        with open(os.path.join(self.diretorio, hash_prompt(body) + ".txt"), "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+
+    def invoke_model(self, body, **kwargs):
+        resposta = self.cliente.invoke_model(body=body, **kwargs)
+        conteudo = resposta["body"].read()
+        self._gravar(body, json.loads(conteudo)["results"][0]["outputText"])
+        return {**resposta, "body": io.BytesIO(conteudo)}
+
+    def invoke_model_with_response_stream(self, body, **kwargs):
+        resposta = self.cliente.invoke_model_with_response_stream(body=body, **kwargs)
+        eventos = list(resposta["body"])
+        texto = "".join(
+            json.loads(evento["chunk"]["bytes"].decode()).get("outputText", "")
+            for evento in eventos if "chunk" in evento
+        )
+        self._gravar(body, texto)
+        return {**resposta, "body": iter(eventos)}
@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# Roda extrai-texto -> extrai-dados -> llm em um único processo, passando objetos Python
+# entre as etapas (sem os dois saltos de Lambda nem a serialização do "body" da Step
+# Function). Os clientes de Textract, Bedrock e S3 são injetados, então o mesmo código
+# serve para produção (boto3) e para rodar local com as respostas gravadas de locais.py.
+
+RAIZ_LAMBDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas")
+for _pasta in ("comum", "extrai-texto", "extrai-dados", "llm"):
+    _caminho = os.path.normpath(os.path.join(RAIZ_LAMBDAS, _pasta))
+    if _caminho not in sys.path:
+        sys.path.append(_caminho)
+
+import extrator
+import extracao
+import lambda_llm
+from linhas import TabelaLinhas
+
+# Mesmo limite de texto que a extrai-dados repassa para a etapa de LLM
+LIMITE_TEXTO_LLM = 20000
+
+
+class PipelineNotas:
+    def __init__(self, textract=None, bedrock=None, s3=None, bucket=extrator.SOURCE_BUCKET):
+        self.textract = textract or extrator.textract_client
+        self.bedrock = bedrock or lambda_llm.bedrock
+        self.s3 = s3 or extrator.s3_client
+        self.bucket = bucket
+
+    def processar(self, key):
+        # Processa um arquivo que já está no bucket e devolve o resultado de cada etapa
+        # junto com o tempo gasto em cada uma (em ms)
+        # As páginas são extraídas conforme o OCR as entrega: com o Textract assíncrono,
+        # a extração da página 1 roda enquanto as seguintes ainda estão sendo buscadas
+        tempos = {"ocr": 0.0, "extracao": 0.0}
+        extracao_incremental = extracao.ExtracaoIncremental()
+        paginas = []
+
+        inicio = time.perf_counter()
+        for pagina in extrator.extrair_paginas(key, self.textract, self.bucket):
+            tempos["ocr"] += (time.perf_counter() - inicio) * 1000
+            inicio = time.perf_counter()
+            _, texto_pagina, colunas_pagina = pagina
+            extracao_incremental.adicionar_pagina(texto_pagina, TabelaLinhas.de_colunas(texto_pagina, colunas_pagina))
+            paginas.append(pagina)
+            tempos["extracao"] += (time.perf_counter() - inicio) * 1000
+            inicio = time.perf_counter()
+        tempos["ocr"] += (time.perf_counter() - inicio) * 1000
+
+        inicio = time.perf_counter()
+        texto, _ = extrator.juntar_paginas(paginas)
+        dados = extracao_incremental.finalizar()
+        confianca = extracao.avaliar_confianca(dados)
+        tempos["extracao"] += (time.perf_counter() - inicio) * 1000
+
+        inicio = time.perf_counter()
+        resultado = lambda_llm.refinar_dados(dict(dados), confianca, extracao.recortar_texto(texto, LIMITE_TEXTO_LLM), self.bedrock)
+        tempos["llm"] = (time.perf_counter() - inicio) * 1000
+
+        tempos["total"] = tempos["ocr"] + tempos["extracao"] + tempos["llm"]
+        return {
+            "key": key,
+            "texto": texto,
+            "paginas": len(paginas),
+            "heuristica": dados,
+            "confianca": confianca,
+            "resultado": resultado,
+            "tempos": tempos,
+        }
+
+    def processar_imagem(self, conteudo, key):
+        # Grava a imagem no bucket (real ou em memória) e processa
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=conteudo)
+        return self.processar(key)
+
+
+def pipeline_local(textract_gravado, bedrock_gravado=None, resposta_padrao="{}"):
+    # Pipeline inteiro sem rede: S3 em memória e Textract/Bedrock reproduzindo gravações
+    from locais import S3Memoria, TextractGravado, BedrockGravado
+    return PipelineNotas(
+        textract=TextractGravado(textract_gravado),
+        bedrock=BedrockGravado(bedrock_gravado, resposta_padrao),
+        s3=S3Memoria(),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Roda o pipeline de notas em um único processo.")
+    parser.add_argument("imagens", nargs="+", help="Imagens das notas (ou chaves no bucket, com --bucket)")
+    parser.add_argument("--textract-gravado", help="Diretório com respostas gravadas do Textract (modo local)")
+    parser.add_argument("--bedrock-gravado", help="Diretório com respostas gravadas do Bedrock (modo local)")
+    parser.add_argument("--bucket", help="Usa os clientes AWS reais e processa chaves que já estão neste bucket")
+    args = parser.parse_args(argv)
+
+    if args.bucket:
+        pipeline = PipelineNotas(bucket=args.bucket)
+    elif args.textract_gravado:
+        pipeline = pipeline_local(args.textract_gravado, args.bedrock_gravado)
+    else:
+        parser.error("informe --textract-gravado (modo local) ou --bucket (AWS)")
+
+    for caminho in args.imagens:
+        if args.bucket:
+            saida = pipeline.processar(caminho)
+        else:
+            with open(caminho, "rb") as arquivo:
+                saida = pipeline.processar_imagem(arquivo.read(), os.path.basename(caminho))
+        del saida["texto"]
+        print(json.dumps(saida, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import argparse
+from functools import partial
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+# Reextração em lote: aplica as regras atuais da extrai-dados aos artefatos de OCR que
+# a extrai-texto grava (texto + tabela das linhas, ver comum/artefatos_ocr.py), sem
+# chamar o Textract de novo. Os artefatos são lidos em streaming de um diretório local
+# ou de um bucket (boto3 ou o S3Memoria de locais.py), a extração roda no pool de
+# processos do lote da extrai-dados (extracao._mapear_em_processos), com o mesmo
+# orçamento da Lambda, e os resultados vão para o JSONL de saída (uma linha por
+# artefato) em blocos de INTERVALO_CHECKPOINT, na ordem da listagem.
+#
+# O próprio arquivo de saída é o checkpoint: rodar de novo com o mesmo --saida pula os
+# artefatos que já têm resultado e continua de onde parou (uma linha cortada no meio
+# por uma interrupção é descartada e refeita). Com --sqlite ou --tabela, os resultados
+# também são gravados em lote no repositório de notas (recebe-notas/repositorio_notas.py),
+# só para as notas que ainda não estão nele: as já gravadas pela recebe-notas têm o
+# resultado refinado pela LLM (--sobrescrever troca mesmo assim).
+
+RAIZ_LAMBDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas")
+for _pasta in ("comum", "extrai-dados", "recebe-notas"):
+    _caminho = os.path.normpath(os.path.join(RAIZ_LAMBDAS, _pasta))
+    if _caminho not in sys.path:
+        sys.path.append(_caminho)
+
+import artefatos_ocr  # noqa: E402
+import extracao  # noqa: E402
+import repositorio_notas  # noqa: E402
+from linhas import TabelaLinhas  # noqa: E402
+
+# Mesmo padrão da extrai-dados (lambda_extracao_nltk.EXTRACAO_PROTEGIDA)
+EXTRACAO_PROTEGIDA = os.environ.get("EXTRACAO_PROTEGIDA", "true").lower() in ("1", "true", "sim")
+# Artefatos lidos ao mesmo tempo (leitura no S3 é I/O) e enviados por vez a cada processo
+THREADS_LEITURA = 16
+TAMANHO_BLOCO = 16
+# A cada quantos resultados a saída (e o repositório, se houver) é gravada no disco
+INTERVALO_CHECKPOINT = 200
+
+
+class ArtefatosDiretorio:
+    # Artefatos num diretório local (ex.: uma cópia do prefixo ocr/ do bucket)
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+
+    def listar(self):
+        for raiz, pastas, arquivos in os.walk(self.diretorio):
+            pastas.sort()
+            for nome in sorted(arquivos):
+                if nome.endswith(artefatos_ocr.EXTENSAO_ARTEFATO):
+                    yield os.path.relpath(os.path.join(raiz, nome), self.diretorio).replace(os.sep, "/")
+
+    def ler(self, chave):
+        with open(os.path.join(self.diretorio, chave), "rb") as arquivo:
+            return arquivo.read()
+
+
+class ArtefatosS3:
+    # Artefatos num bucket, listados página por página (list_objects_v2)
+    def __init__(self, s3, bucket, prefixo=artefatos_ocr.PREFIXO_ARTEFATOS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefixo = prefixo
+
+    def listar(self):
+        parametros = {"Bucket": self.bucket, "Prefix": self.prefixo}
+        while True:
+            resposta = self.s3.list_objects_v2(**parametros)
+            for objeto in resposta.get("Contents", []):
+                if objeto["Key"].endswith(artefatos_ocr.EXTENSAO_ARTEFATO):
+                    yield objeto["Key"]
+            if not resposta.get("IsTruncated"):
+                return
+            parametros["ContinuationToken"] = resposta["NextContinuationToken"]
+
+    def ler(self, chave):
+        return self.s3.get_object(Bucket=self.bucket, Key=chave)["Body"].read()
+
+
+def reextrair_artefato(conteudo, protegida=True):
+    # Roda nos processos do pool: um artefato com problema vira um resultado com "erro".
+    # Com protegida, usa o mesmo Orcamento da extrai-dados (EXTRACAO_PROTEGIDA).
+    try:
+        artefato = artefatos_ocr.ler_artefato(conteudo)
+        texto = artefato["text"]
+        linhas = TabelaLinhas.de_colunas(texto, artefato["linhas"]) if artefato.get("linhas") else None
+        orcamento = extracao.Orcamento() if protegida else None
+        dados = extracao.extrair_dados_nota(texto, linhas, orcamento)
+        resultado = {"key": artefato.get("key"), "dados": dados, "confianca": extracao.avaliar_confianca(dados, orcamento)}
+        if orcamento is not None and orcamento.parcial:
+            resultado["parcial"] = orcamento.estouros
+        return resultado
+    except Exception as e:
+        return {"erro": str(e)}
+
+
+def reextrair_lido(lido, protegida=True):
+    # (chave, conteúdo) de lidos(); uma falha de leitura chega como a mensagem do erro
+    chave, conteudo = lido
+    if isinstance(conteudo, str):
+        return chave, {"erro": conteudo}
+    return chave, reextrair_artefato(conteudo, protegida)
+
+
+def retomar(caminho):
+    # Artefatos que já têm resultado na saída. Uma última linha incompleta (processo
+    # interrompido no meio da escrita) é cortada do arquivo para ser refeita.
+    feitos = set()
+    if not os.path.exists(caminho):
+        return feitos
+    with open(caminho, "rb+") as arquivo:
+        fim_valido = 0
+        for linha in arquivo:
+            if not linha.endswith(b"\n"):
+                arquivo.truncate(fim_valido)
+                break
+            fim_valido += len(linha)
+            try:
+                feitos.add(json.loads(linha)["artefato"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return feitos
+
+
+def lidos(origem, chaves, threads=THREADS_LEITURA):
+    # (chave, conteúdo) na ordem das chaves, lendo até `threads` artefatos ao mesmo
+    # tempo; a listagem é consumida em janelas, sem carregar tudo na memória. Uma
+    # leitura que falha entra com a mensagem do erro no lugar do conteúdo.
+    iterador = iter(chaves)
+
+    def ler(chave):
+        try:
+            return chave, origem.ler(chave)
+        except Exception as e:
+            return chave, str(e) or type(e).__name__
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            janela = list(islice(iterador, threads * 4))
+            if not janela:
+                return
+            yield from executor.map(ler, janela)
+
+
+def reextrair(origem, caminho_saida, processos=None, tamanho_bloco=TAMANHO_BLOCO, limite=None,
+              intervalo_checkpoint=INTERVALO_CHECKPOINT, repositorio=None, protegida=None, sobrescrever=False):
+    feitos = retomar(caminho_saida)
+    pendentes = (chave for chave in origem.listar() if chave not in feitos)
+    if limite:
+        pendentes = islice(pendentes, limite)
+    resumo = {"ja_processados": len(feitos), "processados": 0, "erros": 0}
+    if protegida is None:
+        protegida = EXTRACAO_PROTEGIDA
+    inicio = time.perf_counter()
+
+    gravador = None
+    if repositorio is not None:
+        gravador = repositorio_notas.GravadorLote(repositorio, sobrescrever=sobrescrever)
+    linhas_pendentes = []
+    with open(caminho_saida, "a", encoding="utf-8") as saida:
+        def checkpoint():
+            # O repositório é gravado antes da saída: uma nota que já consta no
+            # checkpoint nunca fica faltando nele
+            if gravador is not None:
+                gravador.descarregar()
+            saida.writelines(linhas_pendentes)
+            linhas_pendentes.clear()
+            saida.flush()
+            os.fsync(saida.fileno())
+
+        def gravar(chave, resultado):
+            resultado["artefato"] = chave
+            if gravador is not None and "dados" in resultado and resultado.get("key"):
+                gravador.adicionar(resultado["key"], resultado["dados"])
+            linhas_pendentes.append(json.dumps(resultado, ensure_ascii=False) + "\n")
+            resumo["processados"] += 1
+            resumo["erros"] += "erro" in resultado
+            if resumo["processados"] % intervalo_checkpoint == 0:
+                checkpoint()
+
+        funcao = partial(reextrair_lido, protegida=protegida)
+        leitura = lidos(origem, pendentes)
+        if not processos or processos <= 1:
+            resultados = map(funcao, leitura)
+        else:
+            # Janelas limitadas: a leitura fica no máximo uma janela à frente da extração
+            resultados = extracao._mapear_em_processos(funcao, leitura, processos, tamanho_bloco)
+        for chave, resultado in resultados:
+            gravar(chave, resultado)
+        checkpoint()
+
+    resumo["tempo_s"] = time.perf_counter() - inicio
+    if gravador is not None:
+        resumo["gravados_repositorio"] = gravador.gravados
+    return resumo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reaplica as regras atuais de extração aos artefatos de OCR gravados (sem Textract)."
+    )
+    parser.add_argument("-o", "--saida", required=True, help="JSONL de resultados (também é o checkpoint)")
+    parser.add_argument("--diretorio", help="Diretório local com os artefatos (*.json.gz)")
+    parser.add_argument("--bucket", help="Lê os artefatos deste bucket (clientes AWS reais)")
+    parser.add_argument("--prefixo", default=artefatos_ocr.PREFIXO_ARTEFATOS, help="Prefixo dos artefatos no bucket")
+    parser.add_argument("-p", "--processos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tamanho-bloco", type=int, default=TAMANHO_BLOCO)
+    parser.add_argument("--limite", type=int, help="Processa no máximo N artefatos nesta execução")
+    parser.add_argument("--sqlite", help="Grava os resultados também neste repositório SQLite")
+    parser.add_argument("--tabela", help="Grava os resultados também nesta tabela do repositório no DynamoDB")
+    parser.add_argument("--sobrescrever", action="store_true",
+                        help="Troca no repositório também as notas que já estão nele")
+    parser.add_argument("--sem-orcamento", action="store_true", help="Extrai sem o modo protegido da Lambda")
+    args = parser.parse_args(argv)
+
+    if args.bucket:
+        from clientes_aws import cliente
+        origem = ArtefatosS3(cliente("s3"), args.bucket, args.prefixo)
+    elif args.diretorio:
+        origem = ArtefatosDiretorio(args.diretorio)
+    else:
+        parser.error("informe --diretorio ou --bucket")
+
+    repositorio = None
+    if args.sqlite:
+        repositorio = repositorio_notas.RepositorioSQLite(args.sqlite)
+    elif args.tabela:
+        from clientes_aws import cliente
+        repositorio = repositorio_notas.RepositorioDynamoDB(cliente("dynamodb"), args.tabela)
+
+    resumo = reextrair(
+        origem, args.saida, args.processos, args.tamanho_bloco, args.limite,
+        repositorio=repositorio, protegida=not args.sem_orcamento, sobrescrever=args.sobrescrever,
+    )
+    print(
+        f"{resumo['processados']} artefatos reextraídos em {resumo['tempo_s']:.1f} s "
+        f"({resumo['erros']} com erro, {resumo['ja_processados']} já estavam na saída)",
+        file=sys.stderr,
+    )
+    if "gravados_repositorio" in resumo:
+        print(f"{resumo['gravados_repositorio']} notas novas gravadas no repositório", file=sys.stderr)
+    return 1 if resumo["erros"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
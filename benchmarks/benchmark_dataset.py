@@ -0,0 +1,303 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+# Benchmark offline de velocidade e acurácia sobre as notas de dataset/NFs.
+#
+# Usa respostas do Textract gravadas (uma por imagem, em gravacoes/textract/<nome>.json),
+# então não precisa de rede. Para cada nota mede o tempo de cada etapa da extração e do
+# pós-processamento da LLM (com o Bedrock substituído por respostas gravadas) e compara
+# os campos com os rótulos de rotulos.json. O resultado pode ser salvo como baseline;
+# nas execuções seguintes, queda de acurácia ou aumento de latência acima da tolerância
+# faz o script sair com código 1.
+#
+# Sem respostas gravadas (ou com --transcricoes), roda sobre transcrições manuais de
+# parte das notas reais (transcricoes/<nome>.txt, o texto impresso linha a linha, sem
+# erros de OCR), com os mesmos rótulos e baseline próprio: mede a extração sobre
+# layouts reais, mas não a qualidade do OCR. Com --sintetico, usa um conjunto fixo de
+# notas sintéticas rotuladas (microbenchmarks.gerar_nota_rotulada), também com baseline
+# próprio. Os baselines guardam a acurácia por campo e os percentis de latência.
+#
+# Gravar as respostas do Textract (uma vez, com credenciais AWS):
+#   python benchmarks/benchmark_dataset.py --gravar --bucket <bucket-de-teste>
+
+RAIZ = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(RAIZ, "aws", "pipeline"))
+
+from pipeline import PipelineNotas  # noqa: E402  (ajusta o sys.path das Lambdas)
+import extrator  # noqa: E402
+import extracao  # noqa: E402
+import lambda_llm  # noqa: E402
+from locais import BedrockGravado, GravadorTextract  # noqa: E402
+from microbenchmarks import aplicar_ruido, gerar_nota_rotulada, limpar_caches  # noqa: E402
+
+# Os handlers das Lambdas ligam o log em INFO; aqui ele só atrapalharia as medidas
+logging.getLogger().setLevel(logging.ERROR)
+
+DIR_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(RAIZ, "dataset", "NFs")
+TEXTRACT_GRAVADO = os.path.join(DIR_BENCHMARKS, "gravacoes", "textract")
+BEDROCK_GRAVADO = os.path.join(DIR_BENCHMARKS, "gravacoes", "bedrock")
+TRANSCRICOES = os.path.join(DIR_BENCHMARKS, "transcricoes")
+ROTULOS = os.path.join(DIR_BENCHMARKS, "rotulos.json")
+BASELINE = os.path.join(DIR_BENCHMARKS, "baseline.json")
+BASELINE_TRANSCRICOES = os.path.join(DIR_BENCHMARKS, "baseline_transcricoes.json")
+BASELINE_SINTETICO = os.path.join(DIR_BENCHMARKS, "baseline_sintetico.json")
+# Conjunto sintético: tamanhos (caracteres) x taxas de ruído x sementes
+TAMANHOS_SINTETICOS = (1500, 4000, 16000)
+RUIDOS_SINTETICOS = (0.0, 0.02)
+SEMENTES_SINTETICAS = range(4)
+EXTENSOES = (".jpg", ".jpeg", ".png")
+# Aumentos de latência menores que isso (em ms) são ruído de medição, não regressão
+LATENCIA_MINIMA_MS = 0.5
+
+# Etapas medidas separadamente dentro de extrair_dados_nota (extrair_regex cobre CNPJ do
+# emissor, CPF/CNPJ do consumidor e data). A correção de OCR de todos os campos é
+# medida à parte; depois dela cada extrator reaproveita o texto corrigido do seu campo.
+ETAPAS = {
+    "varredura": lambda texto: extracao.varrer_campos(texto),
+    "correcao_ocr": lambda texto: [extracao.corrigir_texto(texto, campo) for campo in extracao.VOCABULARIOS_CAMPOS],
+    "extrair_regex": lambda texto: extracao.extrair_regex(texto),
+    "extrair_nome_emissor": lambda texto: extracao.extrair_nome_emissor(texto),
+    "extrair_endereco": lambda texto: extracao.extrair_endereco(texto),
+    "extrair_numero_nota": lambda texto: extracao.extrair_numero_nota(texto),
+    "extrair_serie": lambda texto: extracao.extrair_serie(texto),
+    "extrair_valor_total": lambda texto: extracao.extrair_valor_total(texto),
+    "extrair_forma_pagamento": lambda texto: extracao.extrair_forma_pagamento(texto),
+}
+
+
+def normalizar(campo, valor):
+    # Compara valores ignorando diferenças que não mudam o dado (pontuação de CNPJ,
+    # caixa, espaços, "R$")
+    if valor is None or str(valor).strip() in ("", "None"):
+        return None
+    valor = str(valor).strip().lower()
+    if campo in ("CNPJ_emissor", "CNPJ_CPF_consumidor", "numero_nota_fiscal", "serie_nota_fiscal"):
+        return re.sub(r"\D", "", valor).lstrip("0") or "0"
+    if campo == "valor_total":
+        valor = valor.replace("r$", "").strip()
+        if "," in valor:
+            valor = valor.replace(".", "").replace(",", ".")
+        try:
+            return f"{float(valor):.2f}"
+        except ValueError:
+            return valor
+    if campo == "forma_pgto":
+        return valor.replace("é", "e").replace("ã", "a")
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", valor)).strip()
+
+
+def percentil(valores, p):
+    # Percentil por posição mais próxima (sem numpy)
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def medir(funcao, *args):
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    return resultado, (time.perf_counter() - inicio) * 1000
+
+
+def carregar_textos(diretorio):
+    textos = {}
+    for nome in sorted(os.listdir(diretorio)) if os.path.isdir(diretorio) else []:
+        if nome.endswith(".json"):
+            with open(os.path.join(diretorio, nome), encoding="utf-8") as arquivo:
+                textos[os.path.splitext(nome)[0]] = extrator.texto_das_linhas(json.load(arquivo))
+    return textos
+
+
+def carregar_transcricoes(diretorio):
+    # Cada linha do arquivo faz o papel de um bloco LINE do Textract: o texto é montado
+    # como o extrator.texto_das_linhas monta (linhas unidas por espaço)
+    textos = {}
+    for nome in sorted(os.listdir(diretorio)) if os.path.isdir(diretorio) else []:
+        if nome.endswith(".txt"):
+            with open(os.path.join(diretorio, nome), encoding="utf-8") as arquivo:
+                linhas = [linha.strip() for linha in arquivo if linha.strip()]
+            textos[os.path.splitext(nome)[0]] = " ".join(linhas)
+    return textos
+
+
+def carregar_rotulos(caminho):
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, encoding="utf-8") as arquivo:
+        return json.load(arquivo)
+
+
+def textos_sinteticos():
+    # Sempre as mesmas notas (sementes fixas), com os rótulos vindos do gerador
+    textos = {}
+    rotulos = {}
+    for tamanho in TAMANHOS_SINTETICOS:
+        for ruido in RUIDOS_SINTETICOS:
+            for semente in SEMENTES_SINTETICAS:
+                nome = f"sintetica-{tamanho}-{ruido}-{semente}"
+                gerador = random.Random(semente)
+                texto, rotulos[nome] = gerar_nota_rotulada(tamanho, gerador)
+                textos[nome] = aplicar_ruido(texto, ruido, gerador)
+    return textos, rotulos
+
+
+def rodar(textos, rotulos, bedrock, repeticoes):
+    latencias = {etapa: [] for etapa in ETAPAS}
+    latencias.update({"extrair_dados_nota": [], "llm": [], "documento": []})
+    acertos = {}
+    rotulados = {}
+    erros = []
+
+    for repeticao in range(repeticoes):
+        for nome, texto in textos.items():
+            # Cada repetição começa sem nada em cache (texto corrigido, âncoras, palavras
+            # já resolvidas pelo fuzzy), como uma nota nova
+            limpar_caches()
+            for etapa, funcao in ETAPAS.items():
+                latencias[etapa].append(medir(funcao, texto)[1])
+
+            limpar_caches()
+            dados, tempo_extracao = medir(extracao.extrair_dados_nota, texto)
+            confianca = extracao.avaliar_confianca(dados)
+            resultado, tempo_llm = medir(lambda_llm.refinar_dados, dict(dados), confianca, texto, bedrock)
+            latencias["extrair_dados_nota"].append(tempo_extracao)
+            latencias["llm"].append(tempo_llm)
+            latencias["documento"].append(tempo_extracao + tempo_llm)
+
+            # Acurácia só na primeira repetição (o resultado é o mesmo nas demais)
+            if repeticao > 0 or nome not in rotulos:
+                continue
+            for campo, esperado in rotulos[nome].items():
+                rotulados[campo] = rotulados.get(campo, 0) + 1
+                if normalizar(campo, resultado.get(campo)) == normalizar(campo, esperado):
+                    acertos[campo] = acertos.get(campo, 0) + 1
+                else:
+                    erros.append({"nota": nome, "campo": campo, "esperado": esperado, "obtido": resultado.get(campo)})
+
+    acuracia = {campo: acertos.get(campo, 0) / total for campo, total in rotulados.items()}
+    tempos = {
+        etapa: {"p50": percentil(valores, 50), "p95": percentil(valores, 95)}
+        for etapa, valores in latencias.items()
+    }
+    return {"documentos": len(textos), "acuracia": acuracia, "latencia_ms": tempos, "erros": erros}
+
+
+def comparar(atual, baseline, tolerancia_acuracia, tolerancia_latencia, checar_latencia):
+    regressoes = []
+    for campo, valor in baseline.get("acuracia", {}).items():
+        if atual["acuracia"].get(campo, 0) < valor - tolerancia_acuracia:
+            regressoes.append(f"acurácia de {campo}: {valor:.1%} -> {atual['acuracia'].get(campo, 0):.1%}")
+    if checar_latencia:
+        for etapa, valores in baseline.get("latencia_ms", {}).items():
+            anterior = valores["p95"]
+            novo = atual["latencia_ms"].get(etapa, {}).get("p95", 0)
+            # Etapas muito rápidas variam demais para comparar só em porcentagem
+            if novo > anterior * (1 + tolerancia_latencia) and novo - anterior > LATENCIA_MINIMA_MS:
+                regressoes.append(f"p95 de {etapa}: {anterior:.3f} ms -> {novo:.3f} ms")
+    return regressoes
+
+
+def imprimir(relatorio):
+    print(f"Documentos: {relatorio['documentos']}")
+    if relatorio["acuracia"]:
+        print("\nAcurácia por campo:")
+        for campo, valor in sorted(relatorio["acuracia"].items()):
+            print(f"  {campo:<22} {valor:7.1%}")
+    print("\nLatência (ms):")
+    print(f"  {'etapa':<26} {'p50':>9} {'p95':>9}")
+    for etapa, valores in relatorio["latencia_ms"].items():
+        print(f"  {etapa:<26} {valores['p50']:9.3f} {valores['p95']:9.3f}")
+
+
+def gravar(bucket, textract_gravado):
+    # Sobe cada imagem do dataset para o bucket e grava a resposta do Textract
+    from clientes_aws import cliente
+    pipeline = PipelineNotas(textract=GravadorTextract(cliente("textract"), textract_gravado),
+                             s3=cliente("s3"), bucket=bucket)
+    for nome in sorted(os.listdir(DATASET)):
+        if nome.lower().endswith(EXTENSOES):
+            with open(os.path.join(DATASET, nome), "rb") as arquivo:
+                pipeline.s3.put_object(Bucket=bucket, Key=nome, Body=arquivo.read())
+            extrator.extrair_texto(nome, pipeline.textract, bucket)
+            print(f"gravado: {nome}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline de velocidade e acurácia (dataset/NFs).")
+    parser.add_argument("--textract-gravado", default=TEXTRACT_GRAVADO)
+    parser.add_argument("--bedrock-gravado", default=BEDROCK_GRAVADO)
+    parser.add_argument("--transcricoes-dir", default=TRANSCRICOES)
+    parser.add_argument("--rotulos", default=ROTULOS)
+    parser.add_argument("--baseline", help=f"Padrão: {BASELINE} ({BASELINE_TRANSCRICOES} nas transcrições, "
+                                           f"{BASELINE_SINTETICO} no conjunto sintético)")
+    parser.add_argument("--transcricoes", action="store_true", help="Usa as transcrições mesmo com gravações")
+    parser.add_argument("--sintetico", action="store_true", help="Usa as notas sintéticas mesmo com gravações")
+    parser.add_argument("--salvar-baseline", action="store_true", help="Grava o resultado atual como baseline")
+    parser.add_argument("--repeticoes", type=int, default=5, help="Repetições para as medidas de latência")
+    parser.add_argument("--tolerancia-acuracia", type=float, default=0.0)
+    parser.add_argument("--tolerancia-latencia", type=float, default=0.5, help="Aumento relativo aceito no p95")
+    parser.add_argument("--sem-latencia", action="store_true", help="Não compara latência com o baseline")
+    parser.add_argument("--json", help="Salva o relatório completo neste arquivo")
+    parser.add_argument("--gravar", action="store_true", help="Grava as respostas do Textract (precisa de AWS)")
+    parser.add_argument("--bucket", help="Bucket usado com --gravar")
+    args = parser.parse_args(argv)
+
+    if args.gravar:
+        if not args.bucket:
+            parser.error("--gravar precisa de --bucket")
+        gravar(args.bucket, args.textract_gravado)
+        return 0
+
+    textos = {} if args.sintetico or args.transcricoes else carregar_textos(args.textract_gravado)
+    if textos:
+        rotulos = carregar_rotulos(args.rotulos)
+        args.baseline = args.baseline or BASELINE
+    elif not args.sintetico and carregar_transcricoes(args.transcricoes_dir):
+        if not args.transcricoes:
+            print(f"Nenhuma resposta do Textract gravada em {args.textract_gravado}; usando as transcrições de "
+                  f"{args.transcricoes_dir} (grave as reais com --gravar).", file=sys.stderr)
+        textos = carregar_transcricoes(args.transcricoes_dir)
+        rotulos = carregar_rotulos(args.rotulos)
+        args.baseline = args.baseline or BASELINE_TRANSCRICOES
+    else:
+        textos, rotulos = textos_sinteticos()
+        args.baseline = args.baseline or BASELINE_SINTETICO
+
+    relatorio = rodar(textos, rotulos, BedrockGravado(args.bedrock_gravado), max(1, args.repeticoes))
+    imprimir(relatorio)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+    if args.salvar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as arquivo:
+            json.dump({"acuracia": relatorio["acuracia"], "latencia_ms": relatorio["latencia_ms"]},
+                      arquivo, ensure_ascii=False, indent=2)
+        print(f"\nBaseline salvo em {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as arquivo:
+            baseline = json.load(arquivo)
+        regressoes = comparar(relatorio, baseline, args.tolerancia_acuracia,
+                              args.tolerancia_latencia, not args.sem_latencia)
+        if regressoes:
+            print("\n❌ Regressões em relação ao baseline:")
+            for regressao in regressoes:
+                print(f"  - {regressao}")
+            return 1
+        print("\n✅ Sem regressões em relação ao baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+# Troca entre tamanho e acurácia do pré-processamento de imagem (recebe-notas/
+# preprocessamento.py) sobre as notas de dataset/NFs.
+#
+# O tamanho de cada variante é calculado localmente (só precisa do Pillow). A acurácia
+# precisa do OCR de cada variante: rode uma vez com --gravar --bucket para subir as
+# imagens processadas e gravar as respostas do Textract (e o tempo de cada chamada) em
+# gravacoes/textract-<variante>/; depois o relatório roda offline, usando os rótulos
+# de rotulos.json como o benchmark_dataset.py.
+
+DIR_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(DIR_BENCHMARKS)
+
+import benchmark_dataset  # noqa: E402  (ajusta o sys.path do pipeline e das Lambdas)
+from benchmark_dataset import RAIZ, DATASET, EXTENSOES, ROTULOS, BEDROCK_GRAVADO  # noqa: E402
+
+sys.path.append(os.path.join(RAIZ, "aws", "lambdas", "recebe-notas"))
+
+import extrator  # noqa: E402
+import preprocessamento  # noqa: E402
+from locais import BedrockGravado, GravadorTextract  # noqa: E402
+
+# Variantes comparadas: nome -> parâmetros de otimizar_imagem (None = imagem original)
+VARIANTES = {
+    "original": None,
+    "300dpi_cinza": {"dpi": 300, "cinza": True, "qualidade": 85},
+    "200dpi_cinza": {"dpi": 200, "cinza": True, "qualidade": 85},
+    "150dpi_cinza_q70": {"dpi": 150, "cinza": True, "qualidade": 70},
+    "300dpi_cinza_recorte": {"dpi": 300, "cinza": True, "qualidade": 85, "recortar": True},
+}
+ARQUIVO_TEMPOS = "tempos_ocr.json"
+
+
+def diretorio_variante(variante):
+    # A variante original usa as mesmas gravações do benchmark_dataset.py
+    if variante == "original":
+        return benchmark_dataset.TEXTRACT_GRAVADO
+    return os.path.join(DIR_BENCHMARKS, "gravacoes", f"textract-{variante}")
+
+
+def imagens_dataset():
+    for nome in sorted(os.listdir(DATASET)):
+        if nome.lower().endswith(EXTENSOES):
+            with open(os.path.join(DATASET, nome), "rb") as arquivo:
+                yield nome, arquivo.read()
+
+
+def processar(conteudo, parametros):
+    if parametros is None:
+        return conteudo
+    return preprocessamento.otimizar_imagem(conteudo, **parametros)[0]
+
+
+def tamanhos(parametros):
+    originais = []
+    processados = []
+    for _, conteudo in imagens_dataset():
+        originais.append(len(conteudo))
+        processados.append(len(processar(conteudo, parametros)))
+    return originais, processados
+
+
+def gravar(bucket, variantes):
+    # Sobe cada variante para o bucket e grava a resposta e o tempo do Textract
+    import boto3
+    s3 = boto3.client("s3")
+    textract = boto3.client("textract")
+    for variante in variantes:
+        diretorio = diretorio_variante(variante)
+        gravador = GravadorTextract(textract, diretorio)
+        tempos = {}
+        for nome, conteudo in imagens_dataset():
+            key = f"benchmark/{variante}/{os.path.splitext(nome)[0]}.jpg"
+            s3.put_object(Bucket=bucket, Key=key, Body=processar(conteudo, VARIANTES[variante]))
+            inicio = time.perf_counter()
+            extrator.extrair_texto(key, gravador, bucket)
+            tempos[os.path.splitext(nome)[0]] = (time.perf_counter() - inicio) * 1000
+            print(f"gravado: {variante}/{nome}")
+        with open(os.path.join(diretorio, ARQUIVO_TEMPOS), "w", encoding="utf-8") as arquivo:
+            json.dump(tempos, arquivo, indent=2)
+
+
+def avaliar(variante, rotulos, bedrock):
+    originais, processados = tamanhos(VARIANTES[variante])
+    resultado = {
+        "bytes_total": sum(processados),
+        "reducao": 1 - sum(processados) / sum(originais) if originais else 0.0,
+        "acuracia_media": None,
+        "acuracia": {},
+        "ocr_p50_ms": None,
+    }
+    diretorio = diretorio_variante(variante)
+    textos = benchmark_dataset.carregar_textos(diretorio)
+    if textos:
+        relatorio = benchmark_dataset.rodar(textos, rotulos, bedrock, 1)
+        resultado["acuracia"] = relatorio["acuracia"]
+        if relatorio["acuracia"]:
+            resultado["acuracia_media"] = sum(relatorio["acuracia"].values()) / len(relatorio["acuracia"])
+    caminho_tempos = os.path.join(diretorio, ARQUIVO_TEMPOS)
+    if os.path.exists(caminho_tempos):
+        with open(caminho_tempos, encoding="utf-8") as arquivo:
+            resultado["ocr_p50_ms"] = benchmark_dataset.percentil(list(json.load(arquivo).values()), 50)
+    return resultado
+
+
+def imprimir(resultados):
+    print(f"  {'variante':<24} {'bytes':>11} {'redução':>8} {'acurácia':>9} {'OCR p50':>10}")
+    for variante, r in resultados.items():
+        acuracia = "-" if r["acuracia_media"] is None else f"{r['acuracia_media']:.1%}"
+        ocr = "-" if r["ocr_p50_ms"] is None else f"{r['ocr_p50_ms']:.0f} ms"
+        print(f"  {variante:<24} {r['bytes_total']:>11} {r['reducao']:>8.1%} {acuracia:>9} {ocr:>10}")
+    if all(r["acuracia_media"] is None for r in resultados.values()):
+        print("\nSem gravações do Textract para as variantes: só os tamanhos foram medidos "
+              "(rode com --gravar --bucket para medir a acurácia).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tamanho x acurácia do pré-processamento de imagem (dataset/NFs).")
+    parser.add_argument("--variantes", help=f"Variantes separadas por vírgula (padrão: todas: {','.join(VARIANTES)})")
+    parser.add_argument("--rotulos", default=ROTULOS)
+    parser.add_argument("--bedrock-gravado", default=BEDROCK_GRAVADO)
+    parser.add_argument("--json", help="Salva o relatório neste arquivo")
+    parser.add_argument("--gravar", action="store_true", help="Grava as respostas do Textract (precisa de AWS)")
+    parser.add_argument("--bucket", help="Bucket usado com --gravar")
+    args = parser.parse_args(argv)
+
+    if not preprocessamento.disponivel():
+        print("O Pillow não está instalado (pip install pillow).", file=sys.stderr)
+        return 2
+    variantes = args.variantes.split(",") if args.variantes else list(VARIANTES)
+    desconhecidas = [v for v in variantes if v not in VARIANTES]
+    if desconhecidas:
+        parser.error(f"variantes desconhecidas: {', '.join(desconhecidas)}")
+
+    if args.gravar:
+        if not args.bucket:
+            parser.error("--gravar precisa de --bucket")
+        gravar(args.bucket, variantes)
+        return 0
+
+    rotulos = {}
+    if os.path.exists(args.rotulos):
+        with open(args.rotulos, encoding="utf-8") as arquivo:
+            rotulos = json.load(arquivo)
+    bedrock = BedrockGravado(args.bedrock_gravado)
+    resultados = {variante: avaliar(variante, rotulos, bedrock) for variante in variantes}
+    imprimir(resultados)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump(resultados, arquivo, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+
+# Microbenchmarks de escala para algoritmos.py e extracao.py.
+#
+# Gera notas sintéticas (cabeçalho, itens e rodapé como num extrato de NFC-e) com
+# tamanho controlado, de 1 KB a 1 MB, e ruído de OCR configurável (caracteres trocados
+# de lugar, apagados e confundidos). Cada função é medida em tamanhos crescentes e o
+# script mostra a curva de tempo e o expoente de crescimento entre um tamanho e o
+# seguinte: perto de 1 é linear; bem acima disso indica custo superlinear, que com
+# notas longas vira timeout na Lambda.
+#
+#   python benchmarks/microbenchmarks.py
+#   python benchmarks/microbenchmarks.py --tamanhos 1k,10k,100k,1m --ruido 0.05 --json curvas.json
+
+RAIZ = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(RAIZ, "aws", "lambdas", "extrai-dados"))
+
+import algoritmos  # noqa: E402
+import extracao  # noqa: E402
+
+TAMANHOS_PADRAO = "1k,4k,16k,64k,256k,1m"
+# Levenshtein e Damerau-Levenshtein comparam duas strings inteiras (custo n*m), então
+# usam tamanhos próprios, bem menores que os das notas
+TAMANHOS_DISTANCIA_PADRAO = "64,128,256,512,1024"
+# Folga sobre o expoente esperado antes de marcar a curva como superlinear
+FOLGA_EXPOENTE = 0.3
+# Expoente esperado de cada função (as demais devem ser lineares no tamanho da nota)
+EXPOENTES_ESPERADOS = {"levenshtein": 2.0, "damerau_levenshtein": 2.0}
+
+# Confusões típicas do OCR em cupons térmicos
+CONFUSOES_OCR = {
+    "O": "0", "0": "O", "o": "0", "I": "1", "1": "l", "l": "1", "i": "l",
+    "S": "5", "5": "S", "B": "8", "8": "B", "Z": "2", "2": "Z", "G": "6",
+    "6": "G", "a": "o", "e": "c", "c": "e", "m": "rn", "rn": "m",
+}
+
+EMISSORES = ["SUPERMERCADO BOM PRECO LTDA", "ATACADAO DOIS IRMAOS S.A.", "PADARIA PAO QUENTE ME",
+             "DROGARIA SAUDE TOTAL LTDA", "HORTIFRUTI VERDE VIDA EIRELI"]
+LOGRADOUROS = ["RUA DAS FLORES, 123", "AV. BRASIL, 900", "AVENIDA PAULISTA, 1000", "RODOVIA SP 340 KM 12"]
+PRODUTOS = ["ARROZ TIPO 1 5KG", "FEIJAO CARIOCA 1KG", "LEITE INTEGRAL 1L", "CAFE TORRADO 500G",
+            "ACUCAR REFINADO 1KG", "OLEO DE SOJA 900ML", "DETERGENTE NEUTRO 500ML", "BISCOITO RECHEADO",
+            "PAO DE FORMA 500G", "SABAO EM PO 1KG", "REFRIGERANTE COLA 2L", "BANANA PRATA KG"]
+FORMAS_PGTO = ["Cartão de Crédito", "Cartão de Débito", "Dinheiro", "PIX"]
+
+
+def ler_tamanho(valor):
+    # "1k" -> 1024, "1m" -> 1048576, "500" -> 500
+    valor = valor.strip().lower()
+    multiplicador = 1
+    if valor.endswith("k"):
+        multiplicador, valor = 1024, valor[:-1]
+    elif valor.endswith("m"):
+        multiplicador, valor = 1024 * 1024, valor[:-1]
+    return int(float(valor) * multiplicador)
+
+
+def _cnpj(gerador):
+    numeros = [gerador.randint(0, 9) for _ in range(8)] + [0, 0, 0, 1]
+    for pesos in ([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]):
+        resto = sum(n * p for n, p in zip(numeros, pesos)) % 11
+        numeros.append(0 if resto < 2 else 11 - resto)
+    d = "".join(map(str, numeros))
+    return f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}"
+
+
+def gerar_nota(tamanho, gerador):
+    # Nota limpa com aproximadamente `tamanho` caracteres: o corpo é repetido com itens
+    # até completar o tamanho, e os totais e a forma de pagamento ficam no fim, como
+    # num extrato longo de supermercado
+    return gerar_nota_rotulada(tamanho, gerador)[0]
+
+
+# Formas de pagamento como a extração devolve (extracao.PADROES_FORMA_PGTO)
+FORMAS_EXTRAIDAS = {"Cartão de Crédito": "CRÉDITO", "Cartão de Débito": "DÉBITO", "Dinheiro": "DINHEIRO", "PIX": "PIX"}
+
+
+def gerar_nota_rotulada(tamanho, gerador):
+    # A nota de gerar_nota e os valores corretos dos campos (no formato de rotulos.json
+    # do benchmark_dataset). Campos do rodapé cortados pelo tamanho ficam sem rótulo.
+    emissor = gerador.choice(EMISSORES)
+    logradouro = gerador.choice(LOGRADOUROS)
+    cnpj = _cnpj(gerador)
+    cabecalho = [
+        emissor,
+        f"{logradouro} CENTRO SAO PAULO SP CEP 01234-567",
+        f"CNPJ: {cnpj} IE: {gerador.randint(100000000, 999999999)}",
+        "DANFE NFC-e - Documento Auxiliar da Nota Fiscal de Consumidor Eletrônica",
+        "# CÓDIGO DESCRIÇÃO QTD UN VL UNIT VL TOTAL",
+    ]
+    numero = f"{gerador.randint(1, 999999):06d}"
+    serie = str(gerador.randint(1, 9))
+    data = f"{gerador.randint(1, 28):02d}/{gerador.randint(1, 12):02d}/{gerador.randint(2019, 2025)}"
+    rodape_modelo = [
+        "QTD. TOTAL DE ITENS {itens}",
+        "VALOR TOTAL R$ {total}",
+        "FORMA PAGAMENTO VALOR PAGO",
+        "{forma} {total}",
+        "CONSUMIDOR NÃO IDENTIFICADO",
+        f"NFC-e nº {numero} Série {serie} Emissão {data} "
+        f"{gerador.randint(0, 23):02d}:{gerador.randint(0, 59):02d}:{gerador.randint(0, 59):02d}",
+        "Consulte pela Chave de Acesso em www.nfce.fazenda.sp.gov.br",
+    ]
+    forma = gerador.choice(FORMAS_PGTO)
+
+    linhas = list(cabecalho)
+    tamanho_atual = sum(len(linha) + 1 for linha in linhas) + 250
+    itens = 0
+    total = 0
+    while tamanho_atual < tamanho:
+        itens += 1
+        quantidade = gerador.randint(1, 5)
+        unitario = gerador.randint(100, 5000)
+        total += quantidade * unitario
+        linha = (f"{itens:03d} {gerador.randint(10 ** 12, 10 ** 13 - 1)} {gerador.choice(PRODUTOS)} "
+                 f"{quantidade} UN X {unitario // 100},{unitario % 100:02d} "
+                 f"{quantidade * unitario // 100},{quantidade * unitario % 100:02d}")
+        linhas.append(linha)
+        tamanho_atual += len(linha) + 1
+
+    valor = f"{total // 100},{total % 100:02d}"
+    linhas += [linha.format(itens=itens, total=valor, forma=forma) for linha in rodape_modelo]
+    texto = "\n".join(linhas)[:max(tamanho, 1)]
+    rotulos = {"nome_emissor": emissor, "CNPJ_emissor": cnpj}
+    if f"{forma} {valor}\n" in texto:
+        rotulos.update({"valor_total": valor, "forma_pgto": FORMAS_EXTRAIDAS[forma]})
+    if f"Emissão {data} " in texto:
+        rotulos.update({"data_emissao": data, "numero_nota_fiscal": numero, "serie_nota_fiscal": serie})
+    return texto, rotulos
+
+
+def aplicar_ruido(texto, taxa, gerador):
+    # A cada caractere, com probabilidade `taxa`, aplica um dos três erros de OCR:
+    # troca com o vizinho, apaga ou confunde com um caractere parecido
+    if taxa <= 0:
+        return texto
+    saida = []
+    i = 0
+    while i < len(texto):
+        caractere = texto[i]
+        if caractere == "\n" or gerador.random() >= taxa:
+            saida.append(caractere)
+            i += 1
+            continue
+        erro = gerador.randrange(3)
+        if erro == 0 and i + 1 < len(texto) and texto[i + 1] != "\n":
+            saida.append(texto[i + 1])
+            saida.append(caractere)
+            i += 2
+            continue
+        if erro == 1:
+            i += 1
+            continue
+        if texto[i:i + 2] in CONFUSOES_OCR:
+            saida.append(CONFUSOES_OCR[texto[i:i + 2]])
+            i += 2
+            continue
+        saida.append(CONFUSOES_OCR.get(caractere, caractere))
+        i += 1
+    return "".join(saida)
+
+
+def gerar_nota_ruidosa(tamanho, taxa_ruido=0.03, semente=0):
+    gerador = random.Random(semente)
+    return aplicar_ruido(gerar_nota(tamanho, gerador), taxa_ruido, gerador)
+
+
+def limpar_caches():
+    # Cada medida parte do zero: sem texto corrigido nem palavras já resolvidas em cache
+    extracao.corrigir_texto.cache_clear()
+    extracao.localizar_ancoras.cache_clear()
+    algoritmos.termo_mais_proximo.cache_clear()
+
+
+TERMOS_FUZZY = [termo for termo, _ in extracao.VOCABULARIO_OCR]
+
+# Funções medidas sobre as notas sintéticas: nome -> função(texto)
+FUNCOES_NOTA = {
+    "fuzzy_search_simples": lambda texto: algoritmos.fuzzy_search_simples(texto, TERMOS_FUZZY),
+    "corrigir_texto": lambda texto: [extracao.corrigir_texto(texto, campo) for campo in extracao.VOCABULARIOS_CAMPOS],
+    "localizar_ancoras": lambda texto: extracao.localizar_ancoras(texto),
+    "extrair_regex": lambda texto: extracao.extrair_regex(texto),
+    "extrair_nome_emissor": lambda texto: extracao.extrair_nome_emissor(texto),
+    "extrair_endereco": lambda texto: extracao.extrair_endereco(texto),
+    "extrair_valor_total": lambda texto: extracao.extrair_valor_total(texto),
+    "extrair_serie": lambda texto: extracao.extrair_serie(texto),
+    "extrair_numero_nota": lambda texto: extracao.extrair_numero_nota(texto),
+    "extrair_forma_pagamento": lambda texto: extracao.extrair_forma_pagamento(texto),
+    "extrair_dados_nota": lambda texto: extracao.extrair_dados_nota(texto),
+}
+
+# Funções de distância: recebem o trecho da nota e a versão com ruído do mesmo trecho
+FUNCOES_DISTANCIA = {
+    "levenshtein": algoritmos.levenshtein,
+    "damerau_levenshtein": algoritmos.damerau_levenshtein,
+}
+
+
+def medir(funcao, args, repeticoes):
+    # Menor tempo entre as repetições (em ms): o mínimo é o menos afetado por ruído
+    melhor = None
+    for _ in range(repeticoes):
+        limpar_caches()
+        inicio = time.perf_counter()
+        funcao(*args)
+        decorrido = (time.perf_counter() - inicio) * 1000
+        melhor = decorrido if melhor is None else min(melhor, decorrido)
+    return melhor
+
+
+def expoentes(pontos):
+    # Inclinação log-log entre pontos consecutivos: tempo ~ tamanho^expoente
+    resultado = [None]
+    for (n0, t0), (n1, t1) in zip(pontos, pontos[1:]):
+        if t0 > 0 and t1 > 0 and n1 != n0:
+            resultado.append(math.log(t1 / t0) / math.log(n1 / n0))
+        else:
+            resultado.append(None)
+    return resultado
+
+
+def curva(funcao, entradas, repeticoes, limite_ms):
+    # entradas: lista de (tamanho, args). Quando uma medida passa do limite, os
+    # tamanhos maiores são pulados (só ficariam mais lentos)
+    pontos = []
+    # Aquecimento: a primeira chamada monta o índice do vocabulário e compila padrões
+    funcao(*entradas[0][1])
+    for tamanho, args in entradas:
+        tempo = medir(funcao, args, repeticoes)
+        pontos.append((tamanho, tempo))
+        if limite_ms and tempo > limite_ms:
+            break
+    return [
+        {"tamanho": tamanho, "ms": tempo, "expoente": expoente}
+        for (tamanho, tempo), expoente in zip(pontos, expoentes(pontos))
+    ]
+
+
+def rodar(tamanhos, tamanhos_distancia, taxa_ruido, repeticoes, limite_ms, funcoes=None, semente=0):
+    notas = [(tamanho, (gerar_nota_ruidosa(tamanho, taxa_ruido, semente),)) for tamanho in tamanhos]
+    maior = gerar_nota(max(tamanhos_distancia), random.Random(semente))
+    pares = []
+    for tamanho in tamanhos_distancia:
+        original = maior[:tamanho]
+        pares.append((tamanho, (original, aplicar_ruido(original, taxa_ruido, random.Random(semente)))))
+
+    curvas = {}
+    for nome, funcao in FUNCOES_DISTANCIA.items():
+        if funcoes is None or nome in funcoes:
+            curvas[nome] = curva(funcao, pares, repeticoes, limite_ms)
+    for nome, funcao in FUNCOES_NOTA.items():
+        if funcoes is None or nome in funcoes:
+            curvas[nome] = curva(funcao, notas, repeticoes, limite_ms)
+    return curvas
+
+
+def superlineares(curvas):
+    # Funções cujo expoente no trecho de maior tamanho passa do esperado (os primeiros
+    # pontos são dominados por custo fixo e não dizem muito)
+    alertas = {}
+    for nome, pontos in curvas.items():
+        limite = EXPOENTES_ESPERADOS.get(nome, 1.0) + FOLGA_EXPOENTE
+        if len(pontos) >= 2 and pontos[-1]["expoente"] is not None and pontos[-1]["expoente"] > limite:
+            alertas[nome] = pontos[-1]["expoente"]
+    return alertas
+
+
+def formatar_tamanho(tamanho):
+    if tamanho >= 1024 * 1024 and tamanho % (1024 * 1024) == 0:
+        return f"{tamanho // (1024 * 1024)}M"
+    if tamanho >= 1024 and tamanho % 1024 == 0:
+        return f"{tamanho // 1024}K"
+    return str(tamanho)
+
+
+def imprimir(curvas):
+    for nome, pontos in curvas.items():
+        print(f"\n{nome}")
+        print(f"  {'tamanho':>9} {'ms':>12} {'expoente':>9}")
+        for ponto in pontos:
+            expoente = "" if ponto["expoente"] is None else f"{ponto['expoente']:.2f}"
+            print(f"  {formatar_tamanho(ponto['tamanho']):>9} {ponto['ms']:12.3f} {expoente:>9}")
+    alertas = superlineares(curvas)
+    if alertas:
+        print("\n⚠️ Crescimento acima do esperado no maior tamanho medido:")
+        for nome, expoente in sorted(alertas.items(), key=lambda item: -item[1]):
+            print(f"  - {nome}: tempo ~ tamanho^{expoente:.2f}")
+    else:
+        print("\n✅ Todas as curvas dentro do crescimento esperado")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Curvas de escala de algoritmos.py e extracao.py com notas sintéticas.")
+    parser.add_argument("--tamanhos", default=TAMANHOS_PADRAO, help="Tamanhos das notas (ex.: 1k,16k,1m)")
+    parser.add_argument("--tamanhos-distancia", default=TAMANHOS_DISTANCIA_PADRAO,
+                        help="Tamanhos das strings para levenshtein/damerau_levenshtein")
+    parser.add_argument("--ruido", type=float, default=0.03, help="Fração de caracteres com erro de OCR")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--limite-ms", type=float, default=10000,
+                        help="Para de aumentar o tamanho de uma função quando uma medida passa disso")
+    parser.add_argument("--funcoes", help="Mede só estas funções (separadas por vírgula)")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--json", help="Salva as curvas neste arquivo")
+    parser.add_argument("--amostra", help="Só grava uma nota sintética com o primeiro tamanho neste arquivo")
+    args = parser.parse_args(argv)
+
+    tamanhos = sorted(ler_tamanho(t) for t in args.tamanhos.split(","))
+    tamanhos_distancia = sorted(ler_tamanho(t) for t in args.tamanhos_distancia.split(","))
+
+    if args.amostra:
+        with open(args.amostra, "w", encoding="utf-8") as arquivo:
+            arquivo.write(gerar_nota_ruidosa(tamanhos[0], args.ruido, args.semente))
+        return 0
+
+    funcoes = set(args.funcoes.split(",")) if args.funcoes else None
+    curvas = rodar(tamanhos, tamanhos_distancia, args.ruido, max(1, args.repeticoes), args.limite_ms,
+                   funcoes, args.semente)
+    imprimir(curvas)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump({"ruido": args.ruido, "curvas": curvas}, arquivo, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
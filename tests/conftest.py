@@ -0,0 +1,10 @@
+import os
+import sys
+
+# As Lambdas não são pacotes: cada pasta entra no caminho como no runtime da AWS (e
+# aws/pipeline, com os substitutos locais dos clientes em locais.py)
+RAIZ_LAMBDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "aws", "lambdas")
+for _pasta in ("comum", "extrai-dados", "extrai-texto", "llm", "recebe-notas", os.path.join("..", "pipeline")):
+    _caminho = os.path.normpath(os.path.join(RAIZ_LAMBDAS, _pasta))
+    if _caminho not in sys.path:
+        sys.path.insert(0, _caminho)
@@ -0,0 +1,62 @@
+import random
+
+from algoritmos import (
+    corrigir_ocr,
+    damerau_levenshtein,
+    damerau_levenshtein_limitado,
+    fuzzy_search_simples,
+    termo_mais_proximo,
+)
+
+VOCABULARIO = (("total", 1), ("cnpj", 1), ("cep", 1), ("cpf", 1), ("pagamento", 2), ("dinheiro", 2))
+
+
+def palavras_aleatorias(quantidade, semente=7):
+    # Alfabeto pequeno: muitos pares próximos, transposições e repetições
+    aleatorio = random.Random(semente)
+    return ["".join(aleatorio.choice("abcd") for _ in range(aleatorio.randint(0, 7))) for _ in range(quantidade)]
+
+
+def test_distancia_limitada_igual_a_completa_ate_o_limite():
+    palavras = palavras_aleatorias(120)
+    for s1, s2 in zip(palavras, palavras[1:]):
+        distancia = damerau_levenshtein(s1, s2)
+        for limite in (0, 1, 2, 3):
+            assert damerau_levenshtein_limitado(s1, s2, limite) == min(distancia, limite + 1), (s1, s2, limite)
+
+
+def test_distancia_limitada_conta_transposicao_como_uma_edicao():
+    assert damerau_levenshtein_limitado("totla", "total", 1) == 1
+    assert damerau_levenshtein_limitado("cnpj", "cpnj", 1) == 1
+    # Diferença de tamanho maior que o limite: desiste sem montar as linhas
+    assert damerau_levenshtein_limitado("pagamento", "pg", 2) == 3
+
+
+def forca_bruta(palavra, vocabulario):
+    # Referência: compara a palavra com todos os termos, na ordem do vocabulário
+    melhor, melhor_distancia = None, None
+    for termo, distancia_max in vocabulario:
+        distancia = damerau_levenshtein(palavra, termo)
+        if distancia <= distancia_max and (melhor_distancia is None or distancia < melhor_distancia):
+            melhor, melhor_distancia = termo, distancia
+    return melhor
+
+
+def test_indice_de_delecoes_acha_o_mesmo_termo_que_a_forca_bruta():
+    palavras = ["total", "totl", "tota1", "cnp", "cnpj", "cpe", "cep", "pagamneto", "pagamen", "dinhero", "nota", ""]
+    palavras += ["".join(random.Random(i).sample("totalcnpjdinheiro", 5)) for i in range(200)]
+    for palavra in palavras:
+        assert termo_mais_proximo(palavra, VOCABULARIO) == forca_bruta(palavra, VOCABULARIO), palavra
+
+
+def test_empate_fica_com_o_primeiro_termo_do_vocabulario():
+    # "cpe" está à distância 1 de "cep" e de "cpf"
+    assert termo_mais_proximo("cpe", VOCABULARIO) == "cep"
+    assert termo_mais_proximo("cpe", (("cpf", 1), ("cep", 1))) == "cpf"
+
+
+def test_corrigir_ocr_troca_todas_as_ocorrencias_numa_passada():
+    texto, mapa = corrigir_ocr("TOTL R$ 10,00 CNPJ 1 TOTL pagamneto", VOCABULARIO)
+    assert mapa == {"TOTL": "total", "CNPJ": "cnpj", "pagamneto": "pagamento"}
+    assert texto == "total R$ 10,00 cnpj 1 total pagamento"
+    assert fuzzy_search_simples("VALOR TOTL", ["total"]) == "VALOR total"
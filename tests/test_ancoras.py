@@ -0,0 +1,56 @@
+import random
+import re
+
+import extracao
+from ancoras import LocalizadorAncoras
+
+TEXTOS = [
+    "MERCADO BOM PRECO LTDA RUA DAS FLORES 100 CEP 01234-567 CNPJ: 11.222.333/0001-81 IE: 123",
+    "VALOR TOTAL R$ 45,90 FORMA PAGAMENTO VALOR PAGO Cartão de Crédito 45,90",
+    "Extrato Nº 012345 do CUPOM FISCAL ELETRÔNICO - SAT TOTAL R$ 7,00 Dinheiro 10,00",
+    "NFC-e nº 347941 Série 001 Emissão 12/03/2024 NF-E 0000123456 COO: 4567 CCF:8901",
+    "total12,50 TOTALR$3 valor  total  9 pix PIX cartao debito CARTÃO DÉBITO ecf-01 SERIE:2",
+    "ſérie 3 İE 4 KARTAO nme 1234567 av. paulista 1000 r. augusta 5 pça da sé",
+]
+
+
+def localizar_ingenuo(palavras, texto):
+    # Referência: busca de cada palavra pelo texto todo, com as equivalências do re.IGNORECASE
+    return {
+        palavra: [m.start() for m in re.finditer(f"(?={re.escape(palavra)})", texto, re.IGNORECASE)]
+        for palavra in dict.fromkeys(p.lower() for p in palavras)
+    }
+
+
+def test_uma_passada_acha_as_mesmas_posicoes_que_a_busca_por_palavra():
+    palavras = ["nfc", "nfc-e", "total", "valor total", "ta", "a", "cartão", "cartao", "série", "ie", "k"]
+    localizador = LocalizadorAncoras(palavras)
+    for texto in TEXTOS:
+        assert localizador.localizar(texto) == localizar_ingenuo(palavras, texto), texto
+
+
+def test_palavras_repetidas_e_maiusculas_viram_uma_so():
+    localizador = LocalizadorAncoras(["CNPJ", "cnpj", "Cnpj"])
+    assert localizador.palavras == ("cnpj",)
+    assert localizador.localizar("cnpj CNPJ") == {"cnpj": [0, 5]}
+
+
+def test_busca_ancorada_igual_a_busca_no_texto_inteiro():
+    aleatorio = random.Random(3)
+    pedacos = " ".join(TEXTOS).split()
+    textos = TEXTOS + [" ".join(aleatorio.sample(pedacos, 12)) for _ in range(200)]
+    for texto in textos:
+        ancoras = extracao.ancoras_do_texto(texto)
+        for nome in extracao.ANCORAS_PADROES:
+            if nome not in extracao.PADROES:
+                continue
+            esperado = extracao.PADROES[nome].search(texto)
+            obtido = extracao.buscar_ancorado(extracao.PADROES[nome], texto, ancoras[nome])
+            assert (obtido and obtido.span()) == (esperado and esperado.span()), (nome, texto)
+
+
+def test_campos_saem_das_ancoras():
+    dados = extracao.extrair_dados_nota(" ".join(TEXTOS[:2]))
+    assert dados["valor_total"] == "45,90"
+    assert dados["forma_pgto"] == "CRÉDITO"
+    assert dados["endereco_emissor"].upper().startswith("RUA DAS FLORES 100 CEP 01234-567")
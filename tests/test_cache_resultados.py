@@ -0,0 +1,70 @@
+import cache_resultados
+from locais import S3Memoria
+
+
+class Relogio:
+    # Substitui time.time no módulo do cache para simular a passagem do tempo
+    def __init__(self, agora):
+        self.agora = agora
+
+    def time(self):
+        return self.agora
+
+
+def test_chave_inclui_a_versao_das_regras():
+    hash_arquivo = cache_resultados.hash_conteudo(b"imagem")
+    assert cache_resultados.chave_cache(hash_arquivo, "2") == f"v2/{hash_arquivo}"
+    assert cache_resultados.chave_cache(hash_arquivo, "2") != cache_resultados.chave_cache(hash_arquivo, "3")
+
+
+def test_sqlite_devolve_o_resultado_gravado_ate_o_ttl(monkeypatch):
+    relogio = Relogio(1000.0)
+    monkeypatch.setattr(cache_resultados, "time", relogio)
+    cache = cache_resultados.CacheSQLite(ttl=60)
+    assert cache.obter("v1/a") is None
+    cache.gravar("v1/a", {"valor_total": "12,50"})
+    relogio.agora += 59
+    assert cache.obter("v1/a") == {"valor_total": "12,50"}
+    relogio.agora += 2
+    assert cache.obter("v1/a") is None
+
+
+def test_sqlite_descarta_as_entradas_acessadas_ha_mais_tempo(monkeypatch):
+    relogio = Relogio(1000.0)
+    monkeypatch.setattr(cache_resultados, "time", relogio)
+    cache = cache_resultados.CacheSQLite(ttl=0, max_itens=2)
+    for chave in ("a", "b"):
+        relogio.agora += 1
+        cache.gravar(chave, {"chave": chave})
+    relogio.agora += 1
+    cache.obter("a")
+    relogio.agora += 1
+    cache.gravar("c", {"chave": "c"})
+    assert cache.obter("b") is None
+    assert cache.obter("a") == {"chave": "a"} and cache.obter("c") == {"chave": "c"}
+
+
+def test_s3_confere_o_ttl_pelo_last_modified(monkeypatch):
+    s3 = S3Memoria()
+    cache = cache_resultados.CacheS3(s3, "bucket", ttl=60)
+    cache.gravar("v1/a", {"forma_pgto": "PIX"})
+    assert ("bucket", "cache/v1/a.json") in s3.objetos
+    assert cache.obter("v1/a") == {"forma_pgto": "PIX"}
+    assert cache.obter("v1/b") is None
+
+    gravado_em = s3.objetos[("bucket", "cache/v1/a.json")][2].timestamp()
+    monkeypatch.setattr(cache_resultados, "time", Relogio(gravado_em + 61))
+    assert cache.obter("v1/a") is None
+
+
+def test_falha_no_cache_vira_miss():
+    class Quebrado:
+        def obter(self, chave):
+            raise RuntimeError("fora do ar")
+
+        def gravar(self, chave, resultado):
+            raise RuntimeError("fora do ar")
+
+    assert cache_resultados.obter_seguro(Quebrado(), "v1/a") is None
+    cache_resultados.gravar_seguro(Quebrado(), "v1/a", {})
+    assert cache_resultados.obter_seguro(None, "v1/a") is None
@@ -0,0 +1,69 @@
+import classificacao
+import repositorio_notas
+from artefatos_ocr import baixar_artefato, chave_artefato, serializar_artefato
+from locais import S3Memoria
+
+BUCKET = "notas"
+
+
+def chaves(s3):
+    return sorted(key for bucket, key in s3.objetos if bucket == BUCKET)
+
+
+def test_pasta_pela_forma_de_pagamento():
+    assert classificacao.pasta_destino("PIX") == "dinheiro"
+    assert classificacao.pasta_destino("DINHEIRO") == "dinheiro"
+    assert classificacao.pasta_destino("CRÉDITO") == "outros"
+    assert classificacao.pasta_destino("None") == "outros"
+
+
+def test_classificar_grava_so_o_marcador_e_e_idempotente():
+    s3 = S3Memoria()
+    s3.put_object(Bucket=BUCKET, Key="nota-1.jpg", Body=b"imagem")
+    for _ in range(2):
+        assert classificacao.classificar_arquivo(s3, BUCKET, "nota-1.jpg", "pix") == "dinheiro"
+    assert chaves(s3) == ["indice/dinheiro/nota-1.jpg", "nota-1.jpg"]
+    assert list(classificacao.listar_indice(s3, BUCKET, "dinheiro")) == [("indice/dinheiro/nota-1.jpg", "nota-1.jpg")]
+
+
+def test_etiquetar_sem_mover_mantem_a_imagem_no_lugar():
+    s3 = S3Memoria()
+    s3.put_object(Bucket=BUCKET, Key="nota-1.jpg", Body=b"imagem")
+    classificacao.classificar_arquivo(s3, BUCKET, "nota-1.jpg", "credito")
+    resultado = classificacao.relocar_pendentes(s3, BUCKET, threads=2, etiquetar=True, mover=False)
+    assert resultado == {"movidos": 0, "falhas": 0, "pendentes": 1}
+    assert s3.get_object_tagging(Bucket=BUCKET, Key="nota-1.jpg")["TagSet"] == [
+        {"Key": "forma_pgto", "Value": "outros"}
+    ]
+    assert "nota-1.jpg" in chaves(s3)
+
+
+def test_relocar_leva_artefato_e_repositorio_para_a_chave_nova():
+    s3 = S3Memoria()
+    s3.put_object(Bucket=BUCKET, Key="uploads/nota-1.jpg", Body=b"imagem")
+    s3.put_object(Bucket=BUCKET, Key=chave_artefato("uploads/nota-1.jpg"),
+                  Body=serializar_artefato("uploads/nota-1.jpg", "TEXTO", {"tamanhos": [5]}))
+    classificacao.classificar_arquivo(s3, BUCKET, "uploads/nota-1.jpg", "dinheiro")
+    repositorio = repositorio_notas.RepositorioSQLite()
+    repositorio.gravar_lote([repositorio_notas.registro(
+        "uploads/nota-1.jpg", {"forma_pgto": "DINHEIRO", "data_emissao": "01/02/2024"}
+    )])
+
+    resultado = classificacao.relocar_pendentes(s3, BUCKET, threads=2, repositorio=repositorio)
+
+    assert resultado["movidos"] == 1 and resultado["falhas"] == 0
+    assert chaves(s3) == ["dinheiro/nota-1.jpg", "indice/dinheiro/dinheiro/nota-1.jpg", "ocr/dinheiro/nota-1.json.gz"]
+    artefato = baixar_artefato(s3, BUCKET, "ocr/dinheiro/nota-1.json.gz")
+    assert (artefato["key"], artefato["text"]) == ("dinheiro/nota-1.jpg", "TEXTO")
+    assert [item["key"] for item in repositorio.consultar(forma_pgto="dinheiro")[0]] == ["dinheiro/nota-1.jpg"]
+
+    # Uma segunda execução não encontra nada para mover
+    assert classificacao.relocar_pendentes(s3, BUCKET, repositorio=repositorio)["pendentes"] == 0
+
+
+def test_relocar_sem_artefato_nem_repositorio():
+    s3 = S3Memoria()
+    s3.put_object(Bucket=BUCKET, Key="nota-2.jpg", Body=b"imagem")
+    classificacao.classificar_arquivo(s3, BUCKET, "nota-2.jpg", "debito")
+    assert classificacao.relocar_pendentes(s3, BUCKET)["movidos"] == 1
+    assert chaves(s3) == ["indice/outros/outros/nota-2.jpg", "outros/nota-2.jpg"]
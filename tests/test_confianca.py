@@ -0,0 +1,32 @@
+import extracao
+import lambda_llm
+
+DADOS_VALIDOS = {
+    "nome_emissor": "MERCADO BOM PRECO LTDA",
+    "endereco_emissor": "RUA DAS FLORES 100 CEP 01234-567",
+    "CNPJ_emissor": "11.222.333/0001-81",
+    "CNPJ_CPF_consumidor": "None",
+    "data_emissao": "12/03/2024",
+    "numero_nota_fiscal": "347941",
+    "serie_nota_fiscal": "1",
+    "valor_total": "12,50",
+    "forma_pgto": "DINHEIRO",
+}
+
+
+def test_limiar_padrao_fica_entre_plausivel_e_validado():
+    assert extracao.CONFIANCA_PLAUSIVEL < lambda_llm.LIMIAR_CONFIANCA <= extracao.CONFIANCA_VALIDADO
+
+
+def test_no_limiar_padrao_so_nome_e_endereco_vao_para_a_llm():
+    confianca = extracao.avaliar_confianca(DADOS_VALIDOS)
+    assert lambda_llm.campos_pendentes(confianca) == ["nome_emissor", "endereco_emissor"]
+
+
+def test_campo_invalido_tambem_vai_para_a_llm():
+    confianca = extracao.avaliar_confianca(dict(DADOS_VALIDOS, CNPJ_emissor="11.222.333/0001-82"))
+    assert lambda_llm.campos_pendentes(confianca) == ["nome_emissor", "CNPJ_emissor", "endereco_emissor"]
+
+
+def test_sem_confianca_revisa_todos_os_campos():
+    assert lambda_llm.campos_pendentes() == lambda_llm.CAMPOS
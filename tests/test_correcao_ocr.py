@@ -0,0 +1,31 @@
+import extracao
+
+
+def test_cep_com_erro_de_ocr_continua_no_endereco():
+    # "CPE" está à distância 1 de "cpf" e de "cep": só o vocabulário do endereço decide
+    texto = "MERCADO BOM PRECO LTDA\nRUA DAS FLORES 100 CPE 01234-567\nCNPJ: 11.222.333/0001-81\n"
+    assert "01234-567" in extracao.extrair_endereco(texto)
+
+
+def test_palavra_nota_nao_vira_total():
+    texto = "DOCUMENTO AUXILIAR\nNota 347941\nVL TOTL R$ 12,50\n"
+    assert extracao.corrigir_texto(texto, "valor_total")[1] == {"Nota": "nota", "TOTL": "total"}
+    assert extracao.extrair_valor_total("Nota 347941\n") == "None"
+
+
+def test_nfc_com_erro_de_ocr_ainda_da_o_numero():
+    texto = "NFC N° 347941 Serie 001\n"
+    assert extracao.extrair_numero_nota(texto) == "347941"
+
+
+def test_correcao_de_um_campo_nao_troca_termos_de_outro():
+    texto = "CPE 01234-567 Nota NFC"
+    corrigidos = {campo: extracao.corrigir_texto(texto, campo)[1] for campo in extracao.VOCABULARIOS_CAMPOS}
+    assert corrigidos["endereco"] == {"CPE": "cep"}
+    assert corrigidos["regex"] == {"CPE": "cpf"}
+    assert "Nota" not in corrigidos["numero_nota"] and "NFC" not in corrigidos["endereco"]
+
+
+def test_cnpj_com_erro_de_ocr_ainda_encerra_o_endereco():
+    texto = "MERCADO BOM PRECO LTDA\nRUA DAS FLORES 100 CEP 01234-567 CNP: 11.222.333/0001-81\n"
+    assert extracao.extrair_endereco(texto).upper() == "RUA DAS FLORES 100 CEP 01234-567"
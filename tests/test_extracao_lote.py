@@ -0,0 +1,57 @@
+import io
+import json
+
+import extracao
+
+
+def texto_nota(numero):
+    return (
+        "MERCADO BOM PRECO LTDA\n"
+        "CNPJ: 11.222.333/0001-81 IE: 123456789\n"
+        f"VALOR TOTAL R$ {numero},90\n"
+        f"NFC-e nº 347{numero} Série 1 Emissão 12/03/2024 10:20:30\n"
+    )
+
+
+def jsonl(registros):
+    return io.StringIO("".join(registro + "\n" for registro in registros))
+
+
+def test_lote_em_processos_igual_ao_sequencial_e_na_ordem():
+    textos = [texto_nota(100 + i) for i in range(12)]
+    sequencial = list(extracao.extrair_lote(textos))
+    assert [dados["numero_nota_fiscal"] for dados in sequencial] == [f"347{100 + i}" for i in range(12)]
+    assert list(extracao.extrair_lote(iter(textos), processos=2, tamanho_bloco=2)) == sequencial
+
+
+def test_jsonl_mantem_a_posicao_dos_registros_invalidos():
+    entrada = jsonl([
+        json.dumps({"key": "a.jpg", "text": texto_nota(101)}),
+        "{quebrado",
+        json.dumps(texto_nota(102)),
+        "",
+        json.dumps({"key": "c.jpg"}),
+        json.dumps({"key": "d.jpg", "text": texto_nota(104)}),
+    ])
+    for processos in (1, 2):
+        entrada.seek(0)
+        resultados = list(extracao.extrair_jsonl(entrada, processos=processos, tamanho_bloco=1))
+        assert [resultado["linha"] for resultado in resultados] == [1, 2, 3, 5, 6]
+        assert resultados[0]["key"] == "a.jpg" and "text" not in resultados[0]
+        assert resultados[0]["dados"]["numero_nota_fiscal"] == "347101"
+        assert "erro" in resultados[1] and "erro" in resultados[3]
+        assert resultados[2]["dados"]["numero_nota_fiscal"] == "347102"
+        assert resultados[4]["dados"]["numero_nota_fiscal"] == "347104"
+
+
+def test_linha_de_comando_grava_um_resultado_por_linha(tmp_path, capsys):
+    entrada = tmp_path / "textos.jsonl"
+    saida = tmp_path / "resultados.jsonl"
+    entrada.write_text(
+        json.dumps({"key": "a.jpg", "text": texto_nota(101)}) + "\n{quebrado\n", encoding="utf-8"
+    )
+    assert extracao.main([str(entrada), "-o", str(saida)]) == 1
+    resultados = [json.loads(linha) for linha in saida.read_text(encoding="utf-8").splitlines()]
+    assert resultados[0]["dados"]["valor_total"] == "101,90"
+    assert "erro" in resultados[1]
+    assert "2 registros processados (1 com erro)" in capsys.readouterr().err
@@ -0,0 +1,95 @@
+import pytest
+
+import limitador
+
+
+class ErroAws(Exception):
+    # Mesmo formato do ClientError do botocore
+    def __init__(self, codigo):
+        super().__init__(codigo)
+        self.response = {"Error": {"Code": codigo}}
+
+
+def falhar(*codigos):
+    # Função que levanta os erros na ordem e depois responde "ok"
+    pendentes = list(codigos)
+
+    def funcao():
+        if pendentes:
+            raise ErroAws(pendentes.pop(0))
+        return "ok"
+    return funcao
+
+
+def sem_espera():
+    return limitador.Limitador(limitador.ArmazemMemoria(), dormir=lambda segundos: None)
+
+
+def test_recarga_do_balde_respeita_a_capacidade():
+    assert limitador.recarregar(0.0, 10.0, 11.0, 2.0, 5.0) == 2.0
+    assert limitador.recarregar(4.0, 10.0, 20.0, 2.0, 5.0) == 5.0
+
+
+def test_balde_em_memoria_libera_a_rajada_e_depois_pede_espera():
+    armazem = limitador.ArmazemMemoria()
+    assert [armazem.consumir("s", 1.0, 3.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert 0.9 < armazem.consumir("s", 1.0, 3.0) <= 1.0
+
+
+def test_espera_pelo_token_e_contada(monkeypatch):
+    monkeypatch.setenv("LIMITE_TPS_SERVICO", "1")
+    monkeypatch.setenv("RAJADA_SERVICO", "1")
+    esperas = []
+    local = limitador.Limitador(limitador.ArmazemMemoria(), dormir=esperas.append)
+    local.aguardar("servico")
+    # O dormir falso não deixa o relógio andar: o limitador soma as esperas até o máximo
+    with pytest.raises(limitador.LimiteExcedido):
+        local.aguardar("servico")
+    assert esperas and local.resumo()["servico"]["espera_ms"] > 0
+
+
+def test_throttling_e_repetido_com_backoff():
+    local = sem_espera()
+    assert local.chamar("servico", falhar("ThrottlingException", "ThrottlingException")) == "ok"
+    contadores = local.resumo()["servico"]
+    assert (contadores["chamadas"], contadores["throttles"], contadores["retries"]) == (3, 2, 2)
+
+
+def test_throttling_persistente_vira_limite_excedido():
+    local = sem_espera()
+    with pytest.raises(limitador.LimiteExcedido):
+        local.chamar("servico", falhar(*["TooManyRequestsException"] * limitador.TENTATIVAS))
+    assert local.resumo()["servico"]["chamadas"] == limitador.TENTATIVAS
+
+
+def test_erro_transitorio_esgotado_sobe_como_esta():
+    local = sem_espera()
+    with pytest.raises(ErroAws) as erro:
+        local.chamar("servico", falhar(*["ServiceUnavailableException"] * limitador.TENTATIVAS))
+    assert limitador.codigo_erro(erro.value) == "ServiceUnavailableException"
+    assert local.resumo()["servico"]["throttles"] == 0
+
+
+def test_erro_definitivo_nao_e_repetido():
+    local = sem_espera()
+    with pytest.raises(ErroAws):
+        local.chamar("servico", falhar("ValidationException"))
+    assert local.resumo()["servico"]["chamadas"] == 1
+
+
+def test_cliente_limitado_so_envolve_chamadas_a_api():
+    class Cliente:
+        meta = "meta"
+
+        def can_paginate(self, nome):
+            return False
+
+        def detect_document_text(self):
+            return "ok"
+
+    local = sem_espera()
+    cliente = limitador.ClienteLimitado(Cliente(), "servico", local)
+    assert cliente.meta == "meta" and cliente.can_paginate("x") is False
+    assert local.resumo() == {}
+    assert cliente.detect_document_text() == "ok"
+    assert local.resumo()["servico"]["chamadas"] == 1
@@ -0,0 +1,70 @@
+import pytest
+
+import extracao
+import extrator
+from linhas import TabelaLinhas
+
+NOTA = [
+    "MERCADO BOM PRECO LTDA",
+    "RUA DAS FLORES 100 CENTRO",
+    "SAO PAULO SP",
+    "ARROZ TIPO 1 5KG",
+    "FEIJAO CARIOCA 1KG",
+    "CNPJ: 11.222.333/0001-81",
+    "VALOR TOTAL 12,50",
+    "Dinheiro 12,50",
+    "NFC-e nº 347941 Série 1 Emissão 12/03/2024 10:20:30",
+]
+
+
+def resposta_textract(linhas):
+    # Blocos LINE como os do Textract, com uma PAGE e uma WORD no meio que são ignoradas
+    blocos = [{"BlockType": "PAGE"}]
+    for i, linha in enumerate(linhas):
+        blocos.append({
+            "BlockType": "LINE", "Text": linha, "Confidence": 99.04 - i, "Page": 1 + i // 5,
+            "Geometry": {"BoundingBox": {"Left": 0.1, "Top": 0.05 * i, "Width": 0.8, "Height": 0.04}},
+        })
+        blocos.append({"BlockType": "WORD", "Text": linha.split()[0]})
+    return {"Blocks": blocos}
+
+
+def test_tabela_do_textract_ida_e_volta():
+    texto, colunas = extrator.tabela_das_linhas(resposta_textract(NOTA))
+    assert texto == extrator.texto_das_linhas(resposta_textract(NOTA))
+    tabela = TabelaLinhas.de_colunas(texto, colunas)
+    assert len(tabela) == len(NOTA)
+    assert [tabela.linha(i) for i in range(len(tabela))] == NOTA
+    assert tabela.caixa(2) == pytest.approx((0.1, 0.1, 0.8, 0.04))
+    assert tabela.confiancas[0] == pytest.approx(99.0) and list(tabela.paginas) == [1] * 5 + [2] * 4
+
+
+def test_trecho_e_posicao_das_linhas():
+    tabela = TabelaLinhas.de_linhas(["AB", "CDE", "F"])
+    assert tabela.texto == "AB CDE F"
+    assert [tabela.indice_da_posicao(p) for p in range(len(tabela.texto))] == [0, 0, 0, 1, 1, 1, 1, 2]
+    assert tabela.trecho(1, 3) == "CDE F"
+    assert tabela.trecho(2, 10) == "F"
+    assert tabela.trecho(3, 4) == ""
+
+
+def test_colunas_inconsistentes_sao_recusadas():
+    with pytest.raises(ValueError):
+        TabelaLinhas("AB CDE", [2, 2])
+    with pytest.raises(ValueError):
+        TabelaLinhas("AB CDE", [2, 3], confiancas=[99.0])
+
+
+def test_endereco_nao_avanca_pelas_linhas_dos_itens():
+    tabela = TabelaLinhas.de_linhas(NOTA)
+    # Sem a tabela, o endereço só para no CNPJ e leva os itens junto
+    assert "ARROZ" in extracao.extrair_endereco(tabela.texto)
+    assert extracao.extrair_endereco(tabela.texto, tabela) == "rua DAS FLORES 100 CENTRO SAO PAULO SP"
+
+
+def test_extracao_com_tabela_acha_os_mesmos_campos():
+    tabela = TabelaLinhas.de_linhas(NOTA)
+    sem_tabela = extracao.extrair_dados_nota(tabela.texto)
+    com_tabela = extracao.extrair_dados_nota(tabela.texto, tabela)
+    for campo in ("CNPJ_emissor", "valor_total", "forma_pgto", "numero_nota_fiscal", "serie_nota_fiscal", "data_emissao"):
+        assert com_tabela[campo] == sem_tabela[campo] != "None", campo
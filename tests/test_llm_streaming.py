@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import lambda_llm
+import limitador
+from locais import BedrockGravado
+
+
+def test_leitor_devolve_o_objeto_assim_que_ele_fecha():
+    leitor = lambda_llm.LeitorJSONIncremental(["valor_total"])
+    assert leitor.alimentar('```json\n{"valor_total": "12,') is None
+    assert leitor.alimentar('50"}') == {"valor_total": "12,50"}
+    # O que vem depois do primeiro objeto é ignorado
+    assert leitor.alimentar(', {"outro": 1}') == {"valor_total": "12,50"}
+
+
+def test_leitor_ignora_chaves_dentro_de_strings_e_trechos_invalidos():
+    leitor = lambda_llm.LeitorJSONIncremental(["nome_emissor"])
+    valor = leitor.alimentar('texto {x} solto {"nome_emissor": "BAR {DO} \\"ZE\\""}')
+    assert valor == {"nome_emissor": 'BAR {DO} "ZE"'}
+    assert leitor.chaves == ["nome_emissor"]
+
+
+def test_leitor_registra_chaves_inesperadas():
+    leitor = lambda_llm.LeitorJSONIncremental(["valor_total"])
+    leitor.alimentar('{"valor_total": "1,00", "comentario": "x"}')
+    assert leitor.chaves_inesperadas == ["comentario"]
+
+
+def test_json_incompleto_nao_e_aceito():
+    with pytest.raises(ValueError):
+        lambda_llm.extrair_primeiro_json('{"valor_total": "12,50"')
+
+
+def test_streaming_le_so_o_primeiro_objeto_e_descarta_campos_invalidos():
+    resposta = json.dumps({"forma_pgto": "PIX", "extra": "x", "valor_total": {"a": 1}}) + " e mais texto"
+    bedrock = BedrockGravado(resposta_padrao=resposta, tamanho_pedaco=4)
+    assert lambda_llm.invocar_modelo_streaming("p", ["forma_pgto", "valor_total"], bedrock) == {"forma_pgto": "PIX"}
+
+
+class BedrockInstavel(BedrockGravado):
+    # Abre o stream e manda um throttlingException no meio nas primeiras `falhas` vezes
+    def __init__(self, falhas, **kwargs):
+        super().__init__(**kwargs)
+        self.falhas = falhas
+        self.streams = 0
+
+    def invoke_model_with_response_stream(self, body, **kwargs):
+        self.streams += 1
+        eventos = list(super().invoke_model_with_response_stream(body, **kwargs)["body"])
+        if self.streams <= self.falhas:
+            eventos = eventos[:1] + [{"throttlingException": {"message": "Too many requests"}}]
+        return {"body": iter(eventos)}
+
+
+def test_throttling_no_meio_do_stream_passa_pelo_limitador(monkeypatch):
+    monkeypatch.setattr(lambda_llm, "STREAMING", True)
+    local = limitador.Limitador(limitador.ArmazemMemoria(), dormir=lambda segundos: None)
+    bedrock = BedrockInstavel(2, resposta_padrao=json.dumps({"forma_pgto": "DINHEIRO"}), tamanho_pedaco=4)
+    cliente = limitador.ClienteLimitado(bedrock, "bedrock-runtime", local)
+
+    assert lambda_llm.invocar_modelo("p", ["forma_pgto"], cliente) == {"forma_pgto": "DINHEIRO"}
+    assert bedrock.streams == 3
+    assert local.resumo()["bedrock-runtime"]["throttles"] == 2
+
+
+def test_erro_do_stream_sai_com_o_codigo_do_boto3():
+    erro = lambda_llm.erro_no_stream({"modelStreamErrorException": {"message": "x"}})
+    assert limitador.codigo_erro(erro) == "ModelStreamErrorException"
+    assert lambda_llm.erro_no_stream({"chunk": {"bytes": b"{}"}}) is None
@@ -0,0 +1,49 @@
+import extracao
+
+# Nota de ~256 KB: o cabeçalho da tabela de itens ("VL TOTAL") seguido do item "001" e
+# o rodapé (total, pagamento, número, série e data) só no fim do texto
+CABECALHO = (
+    "MERCADO BOM PRECO LTDA\n"
+    "RUA DAS FLORES 100 CENTRO SAO PAULO SP CEP 01234-567\n"
+    "CNPJ: 11.222.333/0001-81 IE: 123456789\n"
+    "DANFE NFC-e - Documento Auxiliar da Nota Fiscal de Consumidor Eletrônica\n"
+    "# CÓDIGO DESCRIÇÃO QTD UN VL UNIT VL TOTAL\n"
+)
+RODAPE = (
+    "QTD. TOTAL DE ITENS {itens}\n"
+    "VALOR TOTAL R$ 1.234,56\n"
+    "FORMA PAGAMENTO VALOR PAGO\n"
+    "Dinheiro 1.234,56\n"
+    "CONSUMIDOR NÃO IDENTIFICADO\n"
+    "NFC-e nº 347941 Série 1 Emissão 12/03/2024 10:20:30\n"
+)
+
+
+def nota_longa(tamanho=256 * 1024):
+    itens = []
+    total = len(CABECALHO) + len(RODAPE)
+    while total < tamanho:
+        itens.append(f"{len(itens) + 1:03d} 7891234567890 ARROZ TIPO 1 5KG 1 UN X 25,90 25,90\n")
+        total += len(itens[-1])
+    return CABECALHO + "".join(itens) + RODAPE.format(itens=len(itens))
+
+
+def test_nota_longa_mantem_o_rodape():
+    orcamento = extracao.Orcamento(prazo_ms=60000)
+    dados = extracao.extrair_dados_nota(nota_longa(), None, orcamento)
+    assert "entrada" in orcamento.estouros
+    assert dados["CNPJ_emissor"] == "11.222.333/0001-81"
+    assert dados["valor_total"] == "1.234,56"
+    assert dados["data_emissao"] == "12/03/2024"
+    assert dados["numero_nota_fiscal"] == "347941"
+    assert dados["serie_nota_fiscal"] == "1"
+    assert dados["forma_pgto"] == "DINHEIRO"
+
+
+def test_nota_longa_marca_o_rodape_com_confianca_baixa():
+    orcamento = extracao.Orcamento(prazo_ms=60000)
+    dados = extracao.extrair_dados_nota(nota_longa(), None, orcamento)
+    confianca = extracao.avaliar_confianca(dados, orcamento)
+    for campo in extracao.CAMPOS_RODAPE:
+        assert confianca[campo] == extracao.CONFIANCA_BAIXA
+    assert confianca["CNPJ_emissor"] == extracao.CONFIANCA_VALIDADO
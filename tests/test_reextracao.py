@@ -0,0 +1,108 @@
+import gzip
+import json
+
+import pytest
+
+import artefatos_ocr
+import extrator
+import lambda_extracao_nltk
+import reextracao
+from locais import S3Memoria
+
+BUCKET = "notas"
+TEXTO = (
+    "MERCADO BOM PRECO LTDA "
+    "CNPJ: 11.222.333/0001-81 IE: 123456789 "
+    "VALOR TOTAL R$ 45,90 "
+    "FORMA PAGAMENTO VALOR PAGO Dinheiro 45,90 "
+    "NFC-e nº 347941 Série 1 Emissão 12/03/2024 10:20:30"
+)
+
+
+def colunas_de(texto):
+    # Tabela das linhas sem geometria, no formato que a extrai-texto grava
+    return {"tamanhos": [len(texto)]}
+
+
+def bucket_com_artefatos(quantidade):
+    s3 = S3Memoria()
+    for i in range(quantidade):
+        extrator.gravar_artefato(f"entrada/nota{i:02d}.jpg", TEXTO, colunas_de(TEXTO), s3=s3, bucket=BUCKET)
+    return s3
+
+
+def test_artefato_ida_e_volta():
+    conteudo = artefatos_ocr.serializar_artefato("entrada/a.jpg", TEXTO, colunas_de(TEXTO))
+    # mtime=0: o mesmo OCR gera sempre os mesmos bytes
+    assert conteudo == artefatos_ocr.serializar_artefato("entrada/a.jpg", TEXTO, colunas_de(TEXTO))
+    artefato = artefatos_ocr.ler_artefato(conteudo)
+    assert artefato["key"] == "entrada/a.jpg"
+    assert artefato["text"] == TEXTO
+    assert artefato["linhas"] == colunas_de(TEXTO)
+    assert artefatos_ocr.chave_artefato("entrada/a.jpg") == "ocr/entrada/a.json.gz"
+
+
+def test_artefato_de_outra_versao_e_recusado():
+    conteudo = gzip.compress(json.dumps({"versao": artefatos_ocr.VERSAO_ARTEFATO + 1, "text": ""}).encode())
+    with pytest.raises(ValueError):
+        artefatos_ocr.ler_artefato(conteudo)
+
+
+def test_extrai_dados_le_o_ocr_por_referencia(monkeypatch):
+    s3 = S3Memoria()
+    chave = extrator.gravar_artefato("entrada/a.jpg", TEXTO, colunas_de(TEXTO), s3=s3, bucket=BUCKET)
+    monkeypatch.setattr(lambda_extracao_nltk, "s3_client", s3)
+    corpo = json.dumps({"artefato": chave, "bucket": BUCKET, "key": "entrada/a.jpg"})
+    resposta = lambda_extracao_nltk.lambda_handler({"body": corpo}, None)
+    assert resposta["statusCode"] == 200
+    dados = json.loads(resposta["body"])
+    assert dados["CNPJ_emissor"] == "11.222.333/0001-81"
+    assert dados["valor_total"] == "45,90"
+
+
+def test_reextracao_le_o_bucket_e_grava_uma_linha_por_artefato(tmp_path):
+    s3 = bucket_com_artefatos(3)
+    saida = tmp_path / "saida.jsonl"
+    resumo = reextracao.reextrair(reextracao.ArtefatosS3(s3, BUCKET), str(saida), processos=1)
+    assert resumo["processados"] == 3
+    assert resumo["erros"] == 0
+    linhas = [json.loads(linha) for linha in saida.read_text(encoding="utf-8").splitlines()]
+    assert [linha["artefato"] for linha in linhas] == [f"ocr/entrada/nota{i:02d}.json.gz" for i in range(3)]
+    assert linhas[0]["key"] == "entrada/nota00.jpg"
+    assert linhas[0]["dados"]["CNPJ_emissor"] == "11.222.333/0001-81"
+
+
+def test_reextracao_retoma_do_checkpoint(tmp_path):
+    s3 = bucket_com_artefatos(5)
+    origem = reextracao.ArtefatosS3(s3, BUCKET)
+    saida = tmp_path / "saida.jsonl"
+    primeira = reextracao.reextrair(origem, str(saida), processos=1, limite=2, intervalo_checkpoint=1)
+    assert primeira == {**primeira, "ja_processados": 0, "processados": 2}
+    segunda = reextracao.reextrair(origem, str(saida), processos=1)
+    assert segunda == {**segunda, "ja_processados": 2, "processados": 3}
+    artefatos = [json.loads(linha)["artefato"] for linha in saida.read_text(encoding="utf-8").splitlines()]
+    # Nenhum artefato repetido nem faltando
+    assert artefatos == [f"ocr/entrada/nota{i:02d}.json.gz" for i in range(5)]
+
+
+def test_linha_cortada_no_meio_e_refeita(tmp_path):
+    s3 = bucket_com_artefatos(2)
+    origem = reextracao.ArtefatosS3(s3, BUCKET)
+    saida = tmp_path / "saida.jsonl"
+    reextracao.reextrair(origem, str(saida), processos=1)
+    conteudo = saida.read_bytes()
+    # Interrupção no meio da escrita da segunda linha
+    saida.write_bytes(conteudo[: conteudo.index(b"\n") + 10])
+    assert reextracao.retomar(str(saida)) == {"ocr/entrada/nota00.json.gz"}
+    resumo = reextracao.reextrair(origem, str(saida), processos=1)
+    assert resumo["processados"] == 1
+    assert saida.read_bytes() == conteudo
+
+
+def test_artefato_ilegivel_vira_resultado_com_erro(tmp_path):
+    s3 = bucket_com_artefatos(1)
+    s3.put_object(Bucket=BUCKET, Key="ocr/entrada/quebrado.json.gz", Body=b"nao e gzip")
+    saida = tmp_path / "saida.jsonl"
+    resumo = reextracao.reextrair(reextracao.ArtefatosS3(s3, BUCKET), str(saida), processos=1)
+    assert resumo["processados"] == 2
+    assert resumo["erros"] == 1
@@ -0,0 +1,168 @@
+import json
+
+import pytest
+
+import cache_resultados
+import lambda_upload
+import repositorio_notas
+from locais import S3Memoria
+
+CNPJ_A = "11.222.333/0001-81"
+CNPJ_B = "03.722.508/0001-91"
+
+
+def notas():
+    # 12 notas em três meses, alternando emissor e forma de pagamento
+    for indice in range(12):
+        yield repositorio_notas.registro(f"nota-{indice:02d}.jpg", {
+            "CNPJ_emissor": CNPJ_A if indice % 2 else CNPJ_B,
+            "data_emissao": f"{indice % 28 + 1:02d}/{indice % 3 + 1:02d}/2024",
+            "forma_pgto": "PIX" if indice % 3 else "DINHEIRO",
+        }, gravado_em=1.0)
+
+
+def paginar(repositorio, **filtros):
+    # Todas as páginas de uma consulta, seguindo o cursor
+    chaves, cursor = [], None
+    while True:
+        itens, cursor = repositorio.consultar(cursor=cursor, **filtros)
+        chaves.extend(item["key"] for item in itens)
+        if not cursor:
+            return chaves
+
+
+def test_registro_normaliza_os_campos_dos_indices():
+    registro = repositorio_notas.registro("a.jpg", {"CNPJ_emissor": CNPJ_A, "data_emissao": "05/03/24",
+                                                    "forma_pgto": "PIX"}, gravado_em=1.0)
+    assert (registro["cnpj"], registro["data"], registro["forma"]) == ("11222333000181", "2024-03-05", "pix")
+    sem_data = repositorio_notas.registro("b.jpg", {"data_emissao": "None"})
+    assert sem_data["data"] == repositorio_notas.DATA_DESCONHECIDA and sem_data["cnpj"] is None
+
+
+def test_paginacao_por_cursor_nao_repete_nem_pula_notas():
+    repositorio = repositorio_notas.RepositorioSQLite()
+    assert repositorio.gravar_lote(list(notas())) == 12
+    chaves = paginar(repositorio, data_inicio="2024-01-01", limite=5)
+    assert sorted(chaves) == [f"nota-{indice:02d}.jpg" for indice in range(12)]
+    assert len(set(chaves)) == 12
+
+
+def test_consulta_por_cnpj_forma_e_periodo():
+    repositorio = repositorio_notas.RepositorioSQLite()
+    repositorio.gravar_lote(list(notas()))
+    esperado = [r["id"] for r in notas() if r["cnpj"] == "11222333000181" and r["forma"] == "pix"
+                and "2024-02-01" <= r["data"] <= "2024-03-31"]
+    obtido = paginar(repositorio, cnpj="11222333000181", forma_pgto="pix",
+                     data_inicio="2024-02-01", data_fim="2024-03-31", limite=2)
+    assert sorted(obtido) == sorted(esperado) and esperado
+
+
+def test_cursor_invalido_e_filtros_obrigatorios():
+    with pytest.raises(ValueError):
+        repositorio_notas.decodificar_cursor("não é base64")
+    with pytest.raises(ValueError):
+        repositorio_notas.filtros_consulta({"forma_pgto": ""})
+    filtros = repositorio_notas.filtros_consulta({"cnpj": CNPJ_A, "limite": "1000"})
+    assert filtros["cnpj"] == "11222333000181" and filtros["limite"] == repositorio_notas.LIMITE_MAXIMO
+
+
+def test_gravar_sem_sobrescrever_mantem_a_nota_existente():
+    repositorio = repositorio_notas.RepositorioSQLite()
+    repositorio.gravar_lote([repositorio_notas.registro("a.jpg", {"forma_pgto": "PIX", "data_emissao": "01/01/2024"})])
+    gravados = repositorio.gravar_lote(
+        [repositorio_notas.registro("a.jpg", {"forma_pgto": "DINHEIRO", "data_emissao": "01/01/2024"})],
+        sobrescrever=False,
+    )
+    assert gravados == 0
+    assert repositorio.consultar(data_inicio="2024-01-01")[0][0]["forma_pgto"] == "PIX"
+
+
+class DynamoMemoria:
+    # Tabela com os índices cnpj-data, forma-data e mes-data, só com o que o repositório
+    # usa: batch_write_item e query por partição + intervalo de data, com Limit e
+    # ExclusiveStartKey
+    def __init__(self):
+        self.itens = {}
+        self.consultas = []
+
+    def batch_write_item(self, RequestItems):
+        for pedidos in RequestItems.values():
+            for pedido in pedidos:
+                item = pedido["PutRequest"]["Item"]
+                self.itens[item["id"]["S"]] = item
+        return {}
+
+    def query(self, IndexName, ExpressionAttributeNames, ExpressionAttributeValues, Limit,
+              ExclusiveStartKey=None, FilterExpression=None, **kwargs):
+        self.consultas.append(IndexName)
+        particao = ExpressionAttributeNames["#particao"]
+        valores = ExpressionAttributeValues
+        candidatos = sorted(
+            (item for item in self.itens.values()
+             if item.get(particao, {}).get("S") == valores[":particao"]["S"]
+             and valores[":inicio"]["S"] <= item["data"]["S"] <= valores[":fim"]["S"]),
+            key=lambda item: (item["data"]["S"], item["id"]["S"]),
+        )
+        if ExclusiveStartKey:
+            inicio = (ExclusiveStartKey["data"]["S"], ExclusiveStartKey["id"]["S"])
+            candidatos = [item for item in candidatos if (item["data"]["S"], item["id"]["S"]) > inicio]
+        pagina = candidatos[:Limit]
+        if FilterExpression:
+            atributo = ExpressionAttributeNames["#filtro"]
+            pagina = [item for item in pagina if item.get(atributo, {}).get("S") == valores[":filtro"]["S"]]
+        resposta = {"Items": pagina}
+        if len(candidatos) > Limit:
+            ultimo = candidatos[Limit - 1]
+            resposta["LastEvaluatedKey"] = {"id": ultimo["id"], "data": ultimo["data"], particao: ultimo[particao]}
+        return resposta
+
+
+@pytest.mark.parametrize("filtros, indice", [
+    ({"cnpj": "11222333000181"}, "cnpj-data"),
+    ({"cnpj": "11222333000181", "forma_pgto": "pix"}, "cnpj-data"),
+    ({"forma_pgto": "dinheiro"}, "forma-data"),
+    ({"data_inicio": "2024-01-01", "data_fim": "2024-03-31"}, "mes-data"),
+])
+def test_dynamodb_usa_o_indice_certo_e_pagina_como_o_sqlite(filtros, indice):
+    sqlite = repositorio_notas.RepositorioSQLite()
+    sqlite.gravar_lote(list(notas()))
+    tabela = DynamoMemoria()
+    dynamodb = repositorio_notas.RepositorioDynamoDB(tabela, "notas", dormir=lambda segundos: None)
+    dynamodb.gravar_lote(list(notas()))
+
+    assert sorted(paginar(dynamodb, limite=3, **filtros)) == sorted(paginar(sqlite, limite=3, **filtros))
+    assert set(tabela.consultas) == {indice}
+
+
+def test_finalizacao_grava_marcador_cache_e_repositorio(monkeypatch):
+    s3 = S3Memoria()
+    cache = cache_resultados.CacheSQLite()
+    repositorio = repositorio_notas.RepositorioSQLite()
+    monkeypatch.setattr(lambda_upload, "s3_client", s3)
+    monkeypatch.setattr(lambda_upload, "cache", cache)
+    monkeypatch.setattr(lambda_upload, "repositorio", repositorio)
+    dados = {"CNPJ_emissor": CNPJ_A, "data_emissao": "01/02/2024", "forma_pgto": "PIX"}
+
+    resposta = lambda_upload.lambda_handler({"finalizar": {
+        "entrada": {"key": "nota-1.jpg", "hash": "abc"},
+        "resultado": {"statusCode": 200, "body": json.dumps(dados)},
+    }}, None)
+
+    assert resposta == {"finalizado": True}
+    assert (lambda_upload.S3_BUCKET, "indice/dinheiro/nota-1.jpg") in s3.objetos
+    assert cache.obter(cache_resultados.chave_cache("abc")) == dados
+    assert [item["key"] for item in repositorio.consultar(forma_pgto="pix")[0]] == ["nota-1.jpg"]
+
+
+def test_finalizacao_sem_resultado_nao_grava_nada(monkeypatch):
+    s3 = S3Memoria()
+    repositorio = repositorio_notas.RepositorioSQLite()
+    monkeypatch.setattr(lambda_upload, "s3_client", s3)
+    monkeypatch.setattr(lambda_upload, "repositorio", repositorio)
+
+    resposta = lambda_upload.lambda_handler({"finalizar": {
+        "entrada": {"key": "nota-2.jpg"}, "resultado": {"statusCode": 500, "body": "erro"},
+    }}, None)
+
+    assert resposta == {"finalizado": False}
+    assert s3.objetos == {} and repositorio.consultar(data_inicio="2000-01-01")[0] == []
@@ -0,0 +1,210 @@
+import base64
+import json
+
+import pytest
+
+import cache_resultados
+import lambda_upload
+from locais import S3Memoria
+
+
+class StepFunctionsMemoria:
+    # Execuções por nome; describe_execution devolve o status definido pelo teste
+    class exceptions:
+        class ExecutionDoesNotExist(Exception):
+            pass
+
+        class ExecutionAlreadyExists(Exception):
+            pass
+
+    def __init__(self, status="RUNNING"):
+        self.status = status
+        self.execucoes = {}
+        self.consultas = 0
+
+    def start_execution(self, stateMachineArn, name, input, **kwargs):
+        if name in self.execucoes:
+            raise self.exceptions.ExecutionAlreadyExists(name)
+        self.execucoes[name] = {"stateMachineArn": stateMachineArn, "input": input, "status": self.status}
+        return {"executionArn": lambda_upload.arn_execucao(name)}
+
+    def describe_execution(self, executionArn, **kwargs):
+        self.consultas += 1
+        nome = executionArn.rsplit(":", 1)[1]
+        if nome not in self.execucoes:
+            raise self.exceptions.ExecutionDoesNotExist(nome)
+        return dict(self.execucoes[nome])
+
+
+class S3Upload(S3Memoria):
+    # S3Memoria com o destino pré-assinado do upload direto
+    def generate_presigned_post(self, Bucket, Key, Conditions=None, ExpiresIn=3600):
+        return {"url": f"https://{Bucket}.s3.amazonaws.com/", "fields": {"key": Key}}
+
+
+class Contexto:
+    def __init__(self, restante_ms):
+        self.restante_ms = restante_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.restante_ms
+
+
+@pytest.fixture
+def clientes(monkeypatch):
+    s3, sfn = S3Upload(), StepFunctionsMemoria()
+    monkeypatch.setattr(lambda_upload, "s3_client", s3)
+    monkeypatch.setattr(lambda_upload, "sfn_client", sfn)
+    monkeypatch.setattr(lambda_upload, "cache", cache_resultados.CacheSQLite())
+    monkeypatch.setattr(lambda_upload.preprocessamento, "PREPROCESSAR", False)
+    return s3, sfn
+
+
+def evento_s3(key, nome="ObjectCreated:Post"):
+    return {"Records": [{"eventName": nome, "s3": {"object": {"key": key}}}]}
+
+
+def consultar(job_id):
+    resposta = lambda_upload.lambda_handler({"httpMethod": "GET", "pathParameters": {"job_id": job_id}}, None)
+    return resposta["statusCode"], json.loads(resposta["body"])
+
+
+def test_upload_direto_devolve_o_destino_e_o_job(clientes):
+    resposta = lambda_upload.lambda_handler({"body": json.dumps({"upload_direto": True})}, None)
+    assert resposta["statusCode"] == 201
+    corpo = json.loads(resposta["body"])
+    assert corpo["upload"]["fields"]["key"] == f"{lambda_upload.PREFIXO_UPLOAD}{corpo['job_id']}.jpg"
+    assert corpo["status_url"] == f"/api/v1/invoice/{corpo['job_id']}"
+    # O arquivo ainda não chegou: a consulta já responde pelo job_id
+    assert consultar(corpo["job_id"]) == (200, {"job_id": corpo["job_id"], "status": "AGUARDANDO_UPLOAD"})
+
+
+def test_evento_do_s3_inicia_a_execucao_uma_vez(clientes):
+    s3, sfn = clientes
+    key = f"{lambda_upload.PREFIXO_UPLOAD}upload-123.jpg"
+    s3.put_object(Bucket=lambda_upload.S3_BUCKET, Key=key, Body=b"imagem")
+
+    resposta = lambda_upload.lambda_handler(evento_s3(key), None)
+    assert json.loads(resposta["body"]) == {"jobs": ["upload-123"]}
+    assert json.loads(sfn.execucoes["upload-123"]["input"]) == {
+        "key": key, "hash": cache_resultados.hash_conteudo(b"imagem")
+    }
+    # O S3 pode entregar o mesmo evento de novo
+    resposta = lambda_upload.lambda_handler(evento_s3(key), None)
+    assert json.loads(resposta["body"]) == {"jobs": []}
+    assert list(sfn.execucoes) == ["upload-123"]
+
+
+def test_evento_fora_do_prefixo_de_upload_e_ignorado(clientes):
+    _, sfn = clientes
+    for key in ("otimizadas/upload-1.jpg", f"{lambda_upload.PREFIXO_UPLOAD}outro.jpg"):
+        assert json.loads(lambda_upload.lambda_handler(evento_s3(key), None)["body"]) == {"jobs": []}
+    assert json.loads(lambda_upload.lambda_handler(
+        evento_s3(f"{lambda_upload.PREFIXO_UPLOAD}upload-1.jpg", "ObjectRemoved:Delete"), None
+    )["body"]) == {"jobs": []}
+    assert sfn.execucoes == {}
+
+
+def test_consulta_do_job_por_status(clientes):
+    _, sfn = clientes
+    dados = {"valor_total": "12,50"}
+    sfn.execucoes["exec-1"] = {"status": "RUNNING"}
+    sfn.execucoes["exec-2"] = {"status": "SUCCEEDED", "output": json.dumps({"statusCode": 200, "body": json.dumps(dados)})}
+    sfn.execucoes["exec-3"] = {"status": "FAILED"}
+    sfn.execucoes["lote-1"] = {"status": "RUNNING", "input": json.dumps({"itens": [{"job_id": "item-1"}]})}
+
+    assert consultar("exec-1") == (200, {"job_id": "exec-1", "status": "RUNNING"})
+    assert consultar("exec-2") == (200, {"job_id": "exec-2", "status": "SUCCEEDED", "text": dados})
+    assert consultar("exec-3")[1]["status"] == "FAILED"
+    assert consultar("lote-1") == (200, {"lote_id": "lote-1", "status": "RUNNING", "itens": ["item-1"]})
+    assert consultar("item-2") == (200, {"job_id": "item-2", "status": "NA_FILA"})
+    assert consultar("exec-9")[0] == 404
+
+
+def test_upload_sincrono_responde_202_quando_o_prazo_acaba(clientes):
+    _, sfn = clientes
+    corpo = json.dumps({"file": base64.b64encode(b"imagem").decode()})
+    # Sobra só 200 ms além da margem: a espera para antes da execução terminar
+    contexto = Contexto(lambda_upload.MARGEM_TIMEOUT_MS + 200)
+    resposta = lambda_upload.lambda_handler({"body": corpo}, contexto)
+    assert resposta["statusCode"] == 202
+    job_id = json.loads(resposta["body"])["job_id"]
+    assert sfn.execucoes[job_id]["status"] == "RUNNING"
+
+
+def test_upload_sincrono_com_falha_responde_502(clientes):
+    _, sfn = clientes
+    sfn.status = "FAILED"
+    corpo = json.dumps({"file": base64.b64encode(b"imagem").decode()})
+    resposta = lambda_upload.lambda_handler({"body": corpo}, Contexto(30000))
+    assert resposta["statusCode"] == 502
+    assert json.loads(resposta["body"])["status"] == "FAILED"
+
+
+def test_imagem_em_cache_nao_inicia_execucao(clientes):
+    s3, sfn = clientes
+    lambda_upload.cache.gravar(cache_resultados.chave_cache(cache_resultados.hash_conteudo(b"imagem")), {"valor_total": "1,00"})
+    corpo = json.dumps({"file": base64.b64encode(b"imagem").decode()})
+    resposta = lambda_upload.lambda_handler({"body": corpo}, None)
+    assert json.loads(resposta["body"]) == {"text": {"valor_total": "1,00"}, "cache": True}
+    assert s3.objetos == {} and sfn.execucoes == {}
+
+
+def arquivo(conteudo):
+    return base64.b64encode(conteudo).decode()
+
+
+def test_lote_valida_a_lista_de_arquivos(clientes):
+    for arquivos in ([], "abc", [arquivo(b"x")] * (lambda_upload.MAX_ARQUIVOS_LOTE + 1)):
+        resposta = lambda_upload.lambda_handler({"body": json.dumps({"files": arquivos})}, None)
+        assert resposta["statusCode"] == 400
+
+
+def test_lote_grava_os_arquivos_e_inicia_uma_execucao(clientes):
+    s3, sfn = clientes
+    lambda_upload.cache.gravar(cache_resultados.chave_cache(cache_resultados.hash_conteudo(b"c")), {"valor_total": "1,00"})
+    arquivos = [arquivo(b"a"), {"file": arquivo(b"b")}, arquivo(b"c"), "", {"file": arquivo(b"d")}]
+
+    resposta = lambda_upload.lambda_handler({"body": json.dumps({"files": arquivos})}, None)
+    assert resposta["statusCode"] == 202
+    corpo = json.loads(resposta["body"])
+    itens = corpo["itens"]
+    # Os itens voltam na ordem da requisição
+    assert [item["indice"] for item in itens] == list(range(5))
+    assert itens[2] == {"indice": 2, "status": "SUCCEEDED", "text": {"valor_total": "1,00"}, "cache": True}
+    assert "error" in itens[3] and "key" not in itens[3]
+
+    gravados = [itens[i] for i in (0, 1, 4)]
+    assert all(item["status"] == "RUNNING" and item["status_url"] == f"/api/v1/invoice/{item['job_id']}"
+               for item in gravados)
+    assert sorted(s3.objetos[(lambda_upload.S3_BUCKET, item["key"])][0] for item in gravados) == [b"a", b"b", b"d"]
+    # Uma só execução de lote com as notas gravadas (e o hash para o cache)
+    assert list(sfn.execucoes) == [corpo["lote_id"]]
+    execucao = sfn.execucoes[corpo["lote_id"]]
+    assert execucao["stateMachineArn"] == lambda_upload.STATE_MACHINE_ARN_LOTE
+    assert [item["job_id"] for item in json.loads(execucao["input"])["itens"]] == [item["job_id"] for item in gravados]
+    assert consultar(corpo["lote_id"])[1]["itens"] == [item["job_id"] for item in gravados]
+
+
+def test_lote_com_falha_na_gravacao_nao_entra_na_execucao(clientes, monkeypatch):
+    s3, sfn = clientes
+    put_object = s3.put_object
+
+    def put_object_instavel(Bucket, Key, Body=b"", **kwargs):
+        if Body == b"b":
+            raise OSError("falha de rede")
+        return put_object(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+
+    monkeypatch.setattr(s3, "put_object", put_object_instavel)
+    resposta = lambda_upload.lambda_handler({"body": json.dumps({"files": [arquivo(b"a"), arquivo(b"b")]})}, None)
+    itens = json.loads(resposta["body"])["itens"]
+    assert itens[1] == {"indice": 1, "error": "Erro ao gravar o arquivo."}
+    execucao = next(iter(sfn.execucoes.values()))
+    assert [item["job_id"] for item in json.loads(execucao["input"])["itens"]] == [itens[0]["job_id"]]
+
+
+def test_lote_todo_em_cache_nao_inicia_execucao(clientes):
+    _, sfn = clientes
+    lambda_upload.cache.gravar(cache_resultados.chave_cache(cache_resultados.hash_conteudo(b"a")), {"valor_total": "1,00"})
+    corpo = json.loads(lambda_upload.lambda_handler({"body": json.dumps({"files": [arquivo(b"a")]})}, None)["body"])
+    assert corpo["lote_id"] is None and sfn.execucoes == {}